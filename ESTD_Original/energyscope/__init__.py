@@ -66,10 +66,15 @@ except Exception:
 from .preprocessing.utils.print_dat import *
 from .preprocessing.utils.print_run import *
 from .preprocessing.td_selection.td_selection import *
+from .preprocessing.es_pre.es_model_data import *
 from .preprocessing.es_pre.es_write_energy_model_data import *
+from .preprocessing.es_pre.es_data_store import *
 from .preprocessing.es_pre.es_read_data import *
+from .preprocessing.es_pre.es_check_data import *
+from .preprocessing.es_pre.es_panel import *
 from .postprocessing.cost import get_total_cost
 from .postprocessing.postprocessing import *
 from .postprocessing.plots import *
 from .postprocessing.draw_sankey.ESSankey import drawSankey
+from .energy_model.es_amplpy import *
 from .energy_model.es_run import *
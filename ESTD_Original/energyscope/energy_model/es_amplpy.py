@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Script containing the functions to run EnergyScope (es) through amplpy, without printing the .dat files.
+
+The data is handed to AMPL in memory from config['all_data'] (sets and parameters as they are printed in ESTD_data.dat
+and ESTD_<nbr_td>TD.dat by print_data), which avoids formatting the data as text and parsing it again in AMPL.
+amplpy is an optional dependency, it is only imported when this backend is used.
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from ..preprocessing.es_pre.es_model_data import get_model_data
+from ..preprocessing.es_pre.es_write_energy_model_data import (RES_IMPORT_CONSTANT_DEFAULT, TS_OF_DEC_TECH,
+                                                               EVS_BATT_OF_V2G, MISC_PARAMS, SHARE_PARAMS,
+                                                               NON_PARAM_COLUMNS, EUD_PARAMS, RES_PARAMS,
+                                                               RES_MULT_PARAMS, compute_td_series)
+
+
+def _table(df):
+    # {(row, column): value} of the values of df that are not NaN
+    values = df.to_numpy(dtype=np.float64)
+    rows, cols = np.nonzero(~np.isnan(values))
+    return {(df.index[i], df.columns[j]): float(values[i, j]) for i, j in zip(rows, cols)}
+
+
+def _columns(df, infinity=False):
+    # {column: {row: value}} of the values of df that are not NaN, values > 1e14 are infinite if infinity is True
+    values = df.to_numpy(dtype=np.float64)
+    if infinity:
+        values = np.where(values > 1e+14, np.inf, values)
+    return {c: {r: float(v) for r, v in zip(df.index, values[:, j]) if not np.isnan(v)}
+            for j, c in enumerate(df.columns)}
+
+
+def model_sets(config):
+    """
+    Sets of the model for the data of config, as printed by print_data.
+
+    Returns
+    -------
+    Dictionary {set name: list}, the indexed sets are dictionaries {index: list}.
+    """
+    sets = get_model_data(config).sets()
+    # END_USES_TYPES is computed by the model
+    sets.pop('END_USES_TYPES')
+    sets['RES_IMPORT_CONSTANT'] = list(RES_IMPORT_CONSTANT_DEFAULT)
+    sets['STORAGE_OF_END_USES_TYPES'] = {k: list(v) for k, v in sets['STORAGE_OF_END_USES_TYPES'].items()}
+    for batt in EVS_BATT_OF_V2G.values():
+        sets['STORAGE_OF_END_USES_TYPES']['ELECTRICITY'].remove(batt)
+    sets['TS_OF_DEC_TECH'] = {tech: [ts] for tech, ts in TS_OF_DEC_TECH.items()}
+    sets['EVs_BATT_OF_V2G'] = {v2g: [batt] for v2g, batt in EVS_BATT_OF_V2G.items()}
+    return sets
+
+
+def model_params(config):
+    """
+    Parameters of the model for the data of config (ESTD_data.dat), as printed by print_data.
+
+    Returns
+    -------
+    Dictionary {parameter name: value} for the scalar parameters and {parameter name: {index: value}} for the
+    indexed ones (the index of a parameter with several dimensions is a tuple).
+    """
+    data = config['all_data']
+    misc = data['Misc']
+    params = {k: misc[k] for k in MISC_PARAMS + SHARE_PARAMS + ['c_grid_extra', 'import_capacity']}
+    params['gwp_limit'] = config['GWP_limit']
+
+    evs = misc['evs']
+    params['batt_per_car'] = dict(zip(evs['CAR'], evs['batt_per_car']))
+    params['vehicule_capacity'] = dict(zip(evs['CAR'], evs['vehicule_capacity']))
+    params['state_of_charge_ev'] = {(b, h + 1): v for b, values in misc['state_of_charge_ev'].items()
+                                    for h, v in enumerate(values)}
+    params['share_ned'] = dict(misc['share_ned'])
+    params['loss_network'] = dict(misc['loss_network'])
+
+    params['end_uses_demand_year'] = _table(data['Demand'].drop(columns=NON_PARAM_COLUMNS, errors='ignore'))
+    params['layers_in_out'] = _table(data['Layers_in_out'])
+    params.update(_columns(data['Technologies'].drop(columns=NON_PARAM_COLUMNS, errors='ignore'), infinity=True))
+    params.update(_columns(data['Resources'].loc[:, ['avail', 'gwp_op', 'c_op']], infinity=True))
+    params['storage_eff_in'] = _table(data['Storage_eff_in'])
+    params['storage_eff_out'] = _table(data['Storage_eff_out'])
+    params.update(_columns(data['Storage_characteristics']))
+    return params
+
+
+def model_td_data(config):
+    """
+    Set T_H_TD and parameters of the model depending on the typical days (ESTD_<nbr_td>TD.dat), as printed by
+    print_data.
+
+    Returns
+    -------
+    T_H_TD as a list of tuples (hour of the year, hour of the day, TD) and the parameters as in model_params.
+    """
+    td_series = compute_td_series(config)
+    t_h_td = td_series['td_data']['t_h_td']
+    t_h_td = list(zip(t_h_td['H_of_Y'].tolist(), t_h_td['H_of_D'].tolist(), t_h_td['TD_number'].tolist()))
+
+    params = {'nbr_tds': config['nbr_td'], 'peak_sh_factor': float(td_series['peak_sh_factor'])}
+    # {(hour, TD): value} of each time series
+    values = {k: {(h + 1, d + 1): v for (h, d), v in np.ndenumerate(ts)}
+              for k, ts in zip(td_series['names'], td_series['td_ts'])}
+    for k, param in EUD_PARAMS.items():
+        params[param.split()[1]] = values[k]
+    techs = {tech: k for k, tech in RES_PARAMS.items()}
+    techs.update({tech: k for k, mult in RES_MULT_PARAMS.items() for tech in mult})
+    params['c_p_t'] = {(tech,) + i: v for tech, k in techs.items() for i, v in values[k].items()}
+    return t_h_td, params
+
+
+def run_es_amplpy(config):
+    """
+    Run EnergyScope through amplpy: the model es_model.mod is read and the data is set in memory from
+    config['all_data'] (see model_sets, model_params and model_td_data), no .dat file is printed.
+    The options, the solving and the printing of the outputs are the same as with the .run file of run_es.
+
+    :param config: configuration (config['ampl_backend'] = 'amplpy')
+    """
+    try:
+        from amplpy import AMPL, Environment
+    except ImportError as e:
+        raise ImportError("The amplpy backend (config['ampl_backend'] = 'amplpy') needs the amplpy package, "
+                          "install it with pip install amplpy") from e
+
+    case_dir = Path(__file__).parents[2] / 'case_studies' / config['case_study']
+    output_dir = case_dir / 'output'
+
+    ampl = AMPL() if config['AMPL_path'] is None else AMPL(Environment(str(config['AMPL_path'])))
+    try:
+        # the outputs are printed relatively to the case study, as with the .run file
+        ampl.cd(str(case_dir))
+        ampl.read(str(config['es_path'] / 'es_model.mod'))
+
+        logging.info('Setting the data of EnergyScope')
+        t_h_td, td_params = model_td_data(config)
+        # the number of TDs defines TYPICAL_DAYS
+        ampl.get_parameter('nbr_tds').set(td_params.pop('nbr_tds'))
+        for name, values in model_sets(config).items():
+            if isinstance(values, dict):
+                for index, v in values.items():
+                    ampl.get_set(name).get(index).set_values(v)
+            else:
+                ampl.get_set(name).set_values(values)
+        ampl.get_set('T_H_TD').set_values(t_h_td)
+        params = model_params(config)
+        params.update(td_params)
+        for name, values in params.items():
+            if isinstance(values, dict):
+                ampl.get_parameter(name).set_values(values)
+            else:
+                ampl.get_parameter(name).set(values)
+
+        for option_name, option_value in config['ampl_options'].items():
+            for value in (option_value if isinstance(option_value, list) else [option_value]):
+                ampl.set_option(option_name, str(value))
+
+        # running ES
+        logging.info('Running EnergyScope')
+        ampl.solve()
+        solve_result = ampl.get_value('solve_result')
+        if solve_result in ['limit', 'infeasible', 'failure']:
+            print("The run didn't end normally.")
+            print(solve_result)
+            sys.exit(1)
+
+        # saving sets and parameters to output file
+        ampl.eval(f'param PathName symbolic := "{output_dir}";')
+        ampl_run_dir = Path(__file__).parent / 'run'
+        print_files = [ampl_run_dir / 'print_year_summary.run']
+        if config['print_hourly_data']:
+            print_files.append(ampl_run_dir / 'print_hourly_data.run')
+        if config['print_sankey']:
+            print_files.append(ampl_run_dir / 'print_sankey.run')
+        for print_file in print_files:
+            ampl.read(str(print_file))
+    finally:
+        ampl.close()
+
+    logging.info('End of run')
+
+    return
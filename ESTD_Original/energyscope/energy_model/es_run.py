@@ -15,6 +15,7 @@ from subprocess import CalledProcessError, run
 from pathlib import Path
 
 from energyscope import print_run
+from .es_amplpy import run_es_amplpy
 
 def run_es(config):
     """
@@ -42,8 +43,23 @@ def run_es(config):
         config['ampl_options']['solver'] = config['AMPL_path'] / config['ampl_options']['solver']
         ampl_command = str(config['AMPL_path'] / 'ampl ') + run_file
 
-    # copy .mod to case_study directory
-    shutil.copyfile((config['es_path'] / 'es_model.mod'), (cs / config['case_study'] / 'es_model.mod'))
+    if config.get('ampl_backend', 'files') == 'amplpy':
+        # data set in memory through amplpy, no .dat nor .run file
+        return run_es_amplpy(config)
+
+    mod_fns = [cs / config['case_study'] / 'es_model.mod']
+    dat_fns = [cs / config['case_study'] / 'ESTD_data.dat',
+               cs / config['case_study'] / ('ESTD_' + str(config['nbr_td']) + 'TD.dat')]
+    commands_fns = None
+    layered_files = config.get('layered_files') if config.get('layered_data', False) else None
+    if layered_files is not None:
+        # layered data mode (see print_data): shared model and base data, then the overrides of the case study
+        mod_fns = [config['es_path'] / 'es_model.mod']
+        dat_fns = [layered_files.get('data', dat_fns[0]), layered_files.get('td', dat_fns[1])]
+        commands_fns = [layered_files['override']]
+    else:
+        # copy .mod to case_study directory
+        shutil.copyfile((config['es_path'] / 'es_model.mod'), mod_fns[0])
     # list printing files to consider according to config
     ampl_run_dir = Path(__file__).parent / 'run'
     print_files = [str(ampl_run_dir / 'print_year_summary.run')]
@@ -52,11 +68,9 @@ def run_es(config):
     if config['print_sankey']:
         print_files.append(str(ampl_run_dir / 'print_sankey.run'))
     # print .run to case_study directory
-    print_run(run_fn=(cs / config['case_study'] / run_file), mod_fns=[(cs / config['case_study'] / 'es_model.mod')],
-              dat_fns=[(cs / config['case_study'] / 'ESTD_data.dat'),
-                       (cs / config['case_study'] / ('ESTD_' + str(config['nbr_td']) + 'TD.dat'))],
+    print_run(run_fn=(cs / config['case_study'] / run_file), mod_fns=mod_fns, dat_fns=dat_fns,
               options=config['ampl_options'], output_dir=(cs / config['case_study'] / 'output'),
-              print_files=print_files)
+              print_files=print_files, commands_fns=commands_fns)
 
     os.chdir((cs / config['case_study']))
     # running ES
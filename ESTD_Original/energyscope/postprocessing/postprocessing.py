@@ -4,6 +4,7 @@ import pandas as pd
 from pathlib import Path
 
 from ..common import *
+from ..preprocessing.es_pre.es_model_data import ModelData
 
 def read_outputs(cs:str, hourly_data=False, layers=[]):
     """Reads the EnergyScope outputs in the case study (cs) specified
@@ -134,8 +135,9 @@ def get_assets_l(layer: str, eff_tech: pd.DataFrame, assets: pd.DataFrame, tresh
     layer: str
     Name of the layer to consider
 
-    eff_tech: pd.DataFrame
+    eff_tech: pd.DataFrame or ModelData
     Layers_in_out withtout the resources rows (i.e. the conversion efficiencies of all the technologies)
+    or ModelData of the data (see get_model_data)
 
     assets: pandas.DataFrame
     Assets dataframe (as outputted by the model),
@@ -152,12 +154,13 @@ def get_assets_l(layer: str, eff_tech: pd.DataFrame, assets: pd.DataFrame, tresh
     i.e. rows=technologies of the layer, columns=[c_inv, c_maint, lifetime, f_min, f, f_max, fmin_perc, f_perc, fmax_perc, c_p, c_p_max, tau, gwp_constr]
 
     """
+    eff = eff_tech.layer_efficiency(layer) if isinstance(eff_tech, ModelData) else eff_tech.loc[:, layer]
     # take the tech and resources that produce something on the layer
-    tech = list(eff_tech.loc[eff_tech.loc[:,layer]>treshold,:].index)
+    tech = eff.index[eff > treshold]
     # drop the resources
-    tech = [i for i in tech if i in list(assets.index)]
+    tech = tech[tech.isin(assets.index)]
     # select the assets
     df = assets.loc[tech,:].copy()
     # scale the assets tho their efficiency
-    df.loc[tech, 'f'] = df.loc[tech,'f'] * eff_tech.loc[tech, layer]
+    df.loc[tech, 'f'] = df.loc[tech,'f'] * eff.loc[tech]
     return df
\ No newline at end of file
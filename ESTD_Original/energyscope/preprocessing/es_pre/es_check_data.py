@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions to check the consistency of the data imported by import_data before printing the .dat files
+and running the model (index alignment of the tables, sets of misc.json, bounds of the parameters of es_model.mod,
+NaN and infinite values)
+"""
+import logging
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .es_write_energy_model_data import EUD_PARAMS, RES_PARAMS, RES_MULT_PARAMS, RES_IMPORT_CONSTANT_DEFAULT, \
+    TS_OF_DEC_TECH, EVS_BATT_OF_V2G
+
+# maximum number of faulty entries reported per check
+MAX_REPORTED = 10
+
+# value above which the entries of Technologies and Resources are printed as Infinity (see print_data)
+INFINITY = 1e+14
+
+# tables printed as a parameter of es_model.mod for each of their columns
+TABLE_PARAMS = ['Technologies', 'Resources', 'Storage_characteristics']
+# tables printed as one parameter of es_model.mod
+TABLE_PARAM = {'Demand': 'end_uses_demand_year', 'Storage_eff_in': 'storage_eff_in',
+               'Storage_eff_out': 'storage_eff_out', 'Layers_in_out': 'layers_in_out'}
+
+
+@lru_cache(maxsize=None)
+def read_param_bounds(mod_fn):
+    """
+    Read the bounds of the parameters declared in an AMPL model (ex: param c_p {TECHNOLOGIES} >= 0, <= 1 default 1;).
+    The parameters computed in the model (:=) are not considered.
+
+    Parameters
+    ----------
+    mod_fn: pathlib.Path
+    Path to the .mod file.
+
+    Returns
+    -------
+    Dictionary {param name: (lower bound, lower bound is strict, upper bound, upper bound is strict)}, with -inf/inf
+    when there is no bound.
+    """
+    with open(mod_fn, 'r') as fp:
+        text = re.sub(r'#[^\n]*', '', fp.read())
+    bounds = dict()
+    for name, rest in re.findall(r'\bparam\s+(\w+)\s*(?:\{[^}]*\})?([^;]*);', text):
+        if ':=' in rest:
+            continue
+        lo, lo_strict, hi, hi_strict = -np.inf, False, np.inf, False
+        for op, value in re.findall(r'(>=|<=|>|<)\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)', rest):
+            if op[0] == '>':
+                lo, lo_strict = float(value), op == '>'
+            else:
+                hi, hi_strict = float(value), op == '<'
+        bounds[name] = (lo, lo_strict, hi, hi_strict)
+    return bounds
+
+
+def _out_of_bounds(values, bound):
+    # mask of the values not respecting the bound (NaN are checked separately)
+    lo, lo_strict, hi, hi_strict = bound
+    with np.errstate(invalid='ignore'):
+        low = values <= lo if lo_strict else values < lo
+        high = values >= hi if hi_strict else values > hi
+    return low | high
+
+
+def _report(issues, msg, items):
+    # add an issue listing (at most MAX_REPORTED of) the faulty items
+    items = list(items)
+    if len(items) > 0:
+        more = ' (+' + str(len(items) - MAX_REPORTED) + ' more)' if len(items) > MAX_REPORTED else ''
+        issues.append(msg + ': ' + ', '.join(map(str, items[:MAX_REPORTED])) + more)
+
+
+def _check_frame(issues, name, df, param, bounds, allow_inf=False):
+    # check NaN, infinite values and bounds of all the entries of df (printed as the AMPL parameter param)
+    values = df.to_numpy(dtype=float)
+    rows, cols = np.nonzero(np.isnan(values))
+    _report(issues, name + ': NaN values', zip(df.index[rows], df.columns[cols]))
+    inf = np.isinf(values) | (np.abs(values) > INFINITY)
+    if not allow_inf:
+        rows, cols = np.nonzero(inf)
+        _report(issues, name + ': infinite values', zip(df.index[rows], df.columns[cols]))
+    if param in bounds:
+        # large values printed as Infinity are only allowed for parameters without upper bound
+        bad = _out_of_bounds(values, bounds[param])
+        rows, cols = np.nonzero(bad)
+        _report(issues, name + ': values out of the bounds of param ' + param + ' ' + _bound_str(bounds[param]),
+                ((df.index[r], df.columns[c], float(values[r, c])) for r, c in zip(rows, cols)))
+
+
+def _bound_str(bound):
+    lo, lo_strict, hi, hi_strict = bound
+    s = []
+    if lo > -np.inf:
+        s.append(('> ' if lo_strict else '>= ') + str(lo))
+    if hi < np.inf:
+        s.append(('< ' if hi_strict else '<= ') + str(hi))
+    return '[' + ', '.join(s) + ']'
+
+
+def _check_subset(issues, msg, items, reference):
+    # items that are not in reference
+    _report(issues, msg, pd.Index(items).difference(pd.Index(reference), sort=False))
+
+
+def check_data(config: dict, mod_fn=None, raise_error=True):
+    """
+    Check the consistency of the data of config['all_data'] (see import_data) before printing the .dat files.
+    The checks are:
+    - index alignment: rows of Layers_in_out vs Resources and Technologies, indices of the storage tables,
+      layers of Layers_in_out and of the storage tables
+    - set membership: sets of misc.json (evs, STORAGE_DAILY, share_ned, loss_network, state_of_charge_ev) and sets
+      hardcoded in print_data (RES_IMPORT_CONSTANT, TS_OF_DEC_TECH, EVs_BATT_OF_V2G), storages without any layer,
+      end-use types without technology, columns of Time_series
+    - numeric ranges: bounds of the parameters declared in es_model.mod
+    - NaN and infinite values (values above 1e14 are only allowed in Technologies and Resources, where they are
+      printed as Infinity, for parameters without upper bound)
+
+    Parameters
+    ----------
+    config : dict
+    Dictionnary containing all the configurations to run the current case study of EnergyScope.
+
+    mod_fn: pathlib.Path
+    AMPL model giving the bounds of the parameters (default: es_model.mod in config['es_path'] if it exists,
+    otherwise the one of the package).
+
+    raise_error: bool
+    Raise a ValueError listing the issues if any.
+
+    Returns
+    -------
+    The list of issues found (list of str, empty if the data is consistent).
+    """
+    data = config['all_data']
+    misc = data['Misc']
+    issues = []
+
+    if mod_fn is None:
+        mod_fn = Path(config['es_path']) / 'es_model.mod' if 'es_path' in config else None
+        if mod_fn is None or not mod_fn.is_file():
+            mod_fn = Path(__file__).parents[2] / 'energy_model' / 'es_model.mod'
+    bounds = read_param_bounds(Path(mod_fn).resolve())
+
+    resources = data['Resources']
+    technologies = data['Technologies']
+    layers_in_out = data['Layers_in_out']
+    storage_eff_in = data['Storage_eff_in']
+    storage_eff_out = data['Storage_eff_out']
+    storage_characteristics = data['Storage_characteristics']
+    end_uses_categories = data['End_uses_categories']
+    time_series = data['Time_series']
+
+    # Index alignment #
+    for name, df in data.items():
+        if name != 'Misc' and (df.index.has_duplicates or df.columns.has_duplicates):
+            _report(issues, name + ': duplicated rows or columns',
+                    df.index[df.index.duplicated()].append(df.columns[df.columns.duplicated()]))
+    storage = storage_eff_in.index
+    _check_subset(issues, 'Storage_eff_in: storages not in Technologies', storage, technologies.index)
+    _check_subset(issues, 'Storage_eff_out: storages not in Storage_eff_in', storage_eff_out.index, storage)
+    _check_subset(issues, 'Storage_eff_in: storages not in Storage_eff_out', storage, storage_eff_out.index)
+    _check_subset(issues, 'Storage_characteristics: storages not in Storage_eff_in',
+                  storage_characteristics.index, storage)
+    _check_subset(issues, 'Storage_eff_in: storages not in Storage_characteristics',
+                  storage, storage_characteristics.index)
+    # layers_in_out is defined on RESOURCES union TECHNOLOGIES diff STORAGE_TECH
+    rows = resources.index.append(technologies.index.difference(storage, sort=False))
+    _check_subset(issues, 'Resources/Technologies: missing in Layers_in_out', rows, layers_in_out.index)
+    _check_subset(issues, 'Layers_in_out: not in Resources nor Technologies (or storage)', layers_in_out.index, rows)
+
+    # LAYERS := (RESOURCES diff BIOFUELS diff EXPORT) union END_USES_TYPES
+    end_uses_types = pd.Index(end_uses_categories['END_USES_TYPES_OF_CATEGORY'])
+    not_layers = (resources['Subcategory'] == 'Biofuel') | (resources['Category'] == 'Export')
+    layers = resources.index[~not_layers.to_numpy()].append(end_uses_types)
+    for name in ['Layers_in_out', 'Storage_eff_in', 'Storage_eff_out']:
+        _check_subset(issues, name + ': layers not in LAYERS', data[name].columns, layers)
+    _check_subset(issues, 'Layers_in_out: missing layers', layers, layers_in_out.columns)
+
+    # Set membership #
+    common_storage = storage.intersection(storage_eff_out.index)
+    no_in = (storage_eff_in.loc[common_storage].fillna(0).to_numpy() <= 0).all(axis=1)
+    no_out = (storage_eff_out.loc[common_storage].fillna(0).to_numpy() <= 0).all(axis=1)
+    _report(issues, 'Storage_eff_in: storages without any input layer', common_storage[no_in])
+    _report(issues, 'Storage_eff_out: storages without any output layer', common_storage[no_out])
+
+    eut = end_uses_types.intersection(layers_in_out.columns)
+    techs = layers_in_out.loc[~layers_in_out.index.isin(resources.index), eut]
+    _report(issues, 'End_uses_categories: end-use types without technology (layers_in_out == 1)',
+            eut[~(techs.to_numpy() == 1).any(axis=0)])
+    _check_subset(issues, 'Demand: sectors with non numeric values',
+                  data['Demand'].columns.difference(['Category', 'Subcategory', 'Units'], sort=False),
+                  data['Demand'].select_dtypes('number').columns)
+
+    evs = misc['evs']
+    if len({len(v) for v in evs.values()}) > 1:
+        issues.append('misc.json: the lists of evs do not have the same length')
+    _check_subset(issues, 'misc.json: evs CAR not in Technologies', evs['CAR'], technologies.index)
+    _check_subset(issues, 'misc.json: evs EVs_BATT not in storages', evs['EVs_BATT'], storage)
+    _check_subset(issues, 'misc.json: state_of_charge_ev not in evs EVs_BATT', misc['state_of_charge_ev'].keys(),
+                  evs['EVs_BATT'])
+    _report(issues, 'misc.json: state_of_charge_ev without 24 hourly values',
+            [k for k, v in misc['state_of_charge_ev'].items() if len(v) != 24])
+    _check_subset(issues, 'misc.json: STORAGE_DAILY not in storages', misc['STORAGE_DAILY'], storage)
+    non_energy = end_uses_categories.loc[end_uses_categories['END_USES_CATEGORIES'] == 'NON_ENERGY',
+                                         'END_USES_TYPES_OF_CATEGORY']
+    _check_subset(issues, 'misc.json: share_ned not in END_USES_TYPES_OF_CATEGORY["NON_ENERGY"]',
+                  misc['share_ned'].keys(), non_energy)
+    _check_subset(issues, 'misc.json: END_USES_TYPES_OF_CATEGORY["NON_ENERGY"] missing in share_ned',
+                  non_energy, misc['share_ned'].keys())
+    _check_subset(issues, 'misc.json: loss_network not in END_USES_TYPES', misc['loss_network'].keys(),
+                  end_uses_types)
+
+    # sets hardcoded in print_data
+    _check_subset(issues, 'print_data: RES_IMPORT_CONSTANT not in Resources', RES_IMPORT_CONSTANT_DEFAULT,
+                  resources.index)
+    _check_subset(issues, 'print_data: TS_OF_DEC_TECH technologies not in Technologies', TS_OF_DEC_TECH.keys(),
+                  technologies.index)
+    _check_subset(issues, 'print_data: TS_OF_DEC_TECH storages not in STORAGE_DAILY', TS_OF_DEC_TECH.values(),
+                  misc['STORAGE_DAILY'])
+    _check_subset(issues, 'print_data: EVs_BATT_OF_V2G not in evs CAR', EVS_BATT_OF_V2G.keys(), evs['CAR'])
+    # storages of electricity (first layer found in the order of print_data), from which the EVs batteries are removed
+    elec = pd.Index([])
+    if common_storage.size > 0:
+        eff = storage_eff_in.loc[common_storage].reindex(
+            columns=['HEAT_LOW_T_DHN', 'HEAT_LOW_T_DECEN', 'ELECTRICITY', 'HEAT_HIGH_T']).fillna(0).to_numpy()
+        first = np.where((eff > 0).any(axis=1), (eff > 0).argmax(axis=1), -1)
+        elec = common_storage[first == 2]
+    _check_subset(issues, 'print_data: EVs_BATT_OF_V2G not in STORAGE_OF_END_USES_TYPES["ELECTRICITY"]',
+                  EVS_BATT_OF_V2G.values(), elec)
+
+    # time series
+    ts_columns = list(EUD_PARAMS.keys()) + list(RES_PARAMS.keys()) + list(RES_MULT_PARAMS.keys())
+    _check_subset(issues, 'Time_series: missing columns', ts_columns, time_series.columns)
+    _check_subset(issues, 'Time_series: technologies not in Technologies',
+                  list(RES_PARAMS.values()) + [t for v in RES_MULT_PARAMS.values() for t in v], technologies.index)
+    if time_series.shape[0] != 8760:
+        issues.append('Time_series: ' + str(time_series.shape[0]) + ' rows instead of 8760')
+    ts = time_series.reindex(columns=pd.Index(ts_columns).intersection(time_series.columns, sort=False))
+    _check_frame(issues, 'Time_series', ts, None, {})
+    values = ts.to_numpy(dtype=float)
+    # the EUD time series are normalised into the [0, 1] shares of the model (ex: electricity_time_series)
+    eud = ts.columns.isin(list(EUD_PARAMS.keys()))
+    _report(issues, 'Time_series: negative values', ts.columns[eud & (values < 0).any(axis=0)])
+    _report(issues, 'Time_series: columns summing to 0', ts.columns[~(values.sum(axis=0) > 0)])
+
+    # Numeric ranges, NaN and Infinity #
+    for name in TABLE_PARAMS:
+        df = data[name].select_dtypes('number')
+        for param in df.columns:
+            _check_frame(issues, name, df[[param]], param, bounds, allow_inf=name in ['Technologies', 'Resources'])
+    for name, param in TABLE_PARAM.items():
+        _check_frame(issues, name, data[name].select_dtypes('number'), param, bounds)
+
+    scalars = pd.DataFrame({'value': {k: v for k, v in misc.items() if k in bounds and np.isscalar(v)}},
+                           dtype=float)
+    for param in scalars.index:
+        _check_frame(issues, 'misc.json', scalars.loc[[param]], param, bounds)
+    for param, values in [('share_ned', misc['share_ned']), ('loss_network', misc['loss_network']),
+                          ('batt_per_car', dict(zip(evs['CAR'], evs['batt_per_car']))),
+                          ('vehicule_capacity', dict(zip(evs['CAR'], evs['vehicule_capacity'])))]:
+        _check_frame(issues, 'misc.json', pd.DataFrame({param: values}, dtype=float), param, bounds)
+    soc = {k: v for k, v in misc['state_of_charge_ev'].items() if len(v) == 24}
+    _check_frame(issues, 'misc.json', pd.DataFrame(soc, dtype=float).T, 'state_of_charge_ev', bounds)
+
+    for issue in issues:
+        logging.error(issue)
+    if issues and raise_error:
+        raise ValueError(str(len(issues)) + ' data issues found:\n' + '\n'.join(issues))
+    if not issues:
+        logging.info('Data checked, no issue found')
+    return issues
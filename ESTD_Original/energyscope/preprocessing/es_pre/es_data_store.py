@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions to store the data directories in a content-addressed blob store.
+
+Each unique file is stored once in the store under its content hash, and a data directory can be represented by a
+manifest (manifest.json) giving the hash of each of its files. The files of existing data directories can be replaced
+by hardlinks or reflinks to the blobs, or removed and only resolved through the manifest.
+"""
+import logging
+import os
+import json
+import stat
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+MANIFEST = 'manifest.json'
+
+
+def file_hash(file):
+    """
+    Compute the sha256 hash of the content of a file.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+    Path of the file to hash.
+
+    Returns
+    -------
+    The hexadecimal digest of the content of the file (str).
+    """
+    h = hashlib.sha256()
+    with open(file, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tmp_path(path):
+    """
+    Temporary file next to path, unique for each process and thread, to write a file before moving it atomically into
+    place with os.replace.
+    """
+    path = Path(path)
+    return path.with_name(path.name + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp')
+
+
+def replace_file(src, dst):
+    """
+    Move src to dst with os.replace, also when dst is read-only (ex: a cached file): on Windows, where a read-only
+    file cannot be replaced, its read-only attribute is cleared first.
+    """
+    try:
+        os.replace(src, dst)
+    except PermissionError:
+        if os.name != 'nt' or not os.path.isfile(dst):
+            raise
+        os.chmod(dst, stat.S_IREAD | stat.S_IWRITE)
+        os.replace(src, dst)
+
+
+def evict_lru(cache_dir, max_entries, pattern='*'):
+    """
+    Remove the least recently used files matching pattern in cache_dir (oldest modification time, the entries being
+    touched when used) to keep at most max_entries of them.
+    """
+    entries = []
+    for f in Path(cache_dir).glob(pattern):
+        try:
+            entries.append((f.stat().st_mtime, f))
+        except FileNotFoundError:
+            # removed by a concurrent run
+            continue
+    entries.sort(reverse=True)
+    for _, f in entries[max_entries:]:
+        logging.info('Removing ' + f.name + ' from the cache')
+        try:
+            if os.name == 'nt':
+                # read-only files cannot be removed on Windows
+                os.chmod(f, stat.S_IREAD | stat.S_IWRITE)
+            f.unlink()
+        except FileNotFoundError:
+            continue
+
+
+def blob_path(store_dir, key: str):
+    """Path of the blob with the hash key in the store"""
+    return Path(store_dir) / key[:2] / key
+
+
+def store_file(file, store_dir):
+    """
+    Add a file to the blob store (if not already there).
+    The blobs are read-only, as they can be shared by several data directories through hardlinks.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+    Path of the file to store.
+
+    store_dir: pathlib.Path
+    Directory of the blob store.
+
+    Returns
+    -------
+    The hash of the file (str).
+    """
+    key = file_hash(file)
+    blob = blob_path(store_dir, key)
+    if not blob.is_file():
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fn = tmp_path(blob)
+        shutil.copyfile(file, tmp_fn)
+        os.chmod(tmp_fn, 0o444)
+        replace_file(tmp_fn, blob)
+    return key
+
+
+def read_manifest(data_dir):
+    """
+    Read the manifest of a data directory.
+
+    Returns
+    -------
+    The manifest as a dictionary {'store': path of the store relative to data_dir, 'files': {file name: hash},
+    'stats': {file name: [size, mtime in ns]}} ('stats' giving the files of data_dir when the manifest was written)
+    or None if the directory has no manifest.
+    """
+    manifest_fn = Path(data_dir) / MANIFEST
+    if not manifest_fn.is_file():
+        return None
+    with open(manifest_fn, 'r') as fp:
+        return json.load(fp)
+
+
+def write_manifest(data_dir, store_dir, files: dict, stats: dict = None):
+    """
+    Write the manifest of data_dir with the hash of each file (files), the relative path to the store and the size
+    and modification time of the files present in data_dir (stats, see file_stat)
+    """
+    manifest = {'store': os.path.relpath(store_dir, data_dir), 'files': files, 'stats': stats or {}}
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    tmp_fn = tmp_path(Path(data_dir) / MANIFEST)
+    with open(tmp_fn, 'w') as fp:
+        json.dump(manifest, fp, indent=4, sort_keys=True)
+    os.replace(tmp_fn, Path(data_dir) / MANIFEST)
+
+
+def file_stat(file):
+    """Size and modification time (ns) of a file, to detect the files modified since they were hashed"""
+    st = Path(file).stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _unchanged(file, manifest):
+    # True if the file has the size and modification time recorded in the manifest of its directory
+    return manifest is not None and manifest.get('stats', {}).get(file.name) == file_stat(file)
+
+
+def _stored_hash(file, manifest, store_dir):
+    # Hash of a file of a data directory, added to the store if needed. The hash of the manifest is reused if the file
+    # did not change since the manifest was written and its blob is in the store, the file is hashed otherwise.
+    key = None if manifest is None else manifest['files'].get(file.name)
+    if key is not None and _unchanged(file, manifest) and blob_path(store_dir, key).is_file():
+        return key
+    return store_file(file, store_dir)
+
+
+def resolve_data_file(data_dir, file_name: str):
+    """
+    Give the path to read a file of a data directory.
+    If the file is in data_dir, its path is returned. Otherwise, it is looked up in the manifest of data_dir and the
+    path of the corresponding blob is returned.
+
+    Parameters
+    ----------
+    data_dir: pathlib.Path
+    Data directory.
+
+    file_name: str
+    Name of the file in the data directory (ex: 'Resources.csv').
+
+    Returns
+    -------
+    The path of the file (pathlib.Path) or None if the file is neither in the directory nor in its manifest.
+    """
+    file = Path(data_dir) / file_name
+    if file.is_file():
+        return file
+    manifest = read_manifest(data_dir)
+    if manifest is None or file_name not in manifest['files']:
+        return None
+    return blob_path(Path(data_dir) / manifest['store'], manifest['files'][file_name])
+
+
+def _reflink(src, dst):
+    # copy-on-write clone of src into dst (Linux FICLONE ioctl, supported by btrfs, xfs, ...)
+    import fcntl
+    ficlone = 0x40049409
+    with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+        fcntl.ioctl(fd.fileno(), ficlone, fs.fileno())
+
+
+def link_file(src, dst):
+    """
+    Replace dst by a hardlink to src (or by a copy of src if it cannot be hardlinked, ex: other file system).
+    dst is replaced atomically, without writing into the file it was before (which may itself be a hardlink).
+    On Windows, a read-only src (ex: a cached file) is copied: a hardlink to it would share its read-only attribute,
+    which would have to be cleared to replace dst later.
+    """
+    dst = Path(dst)
+    if dst.is_file() and os.path.samefile(src, dst):
+        return
+    tmp_fn = tmp_path(dst)
+    try:
+        if os.name == 'nt' and not os.access(src, os.W_OK):
+            raise PermissionError('read-only file ' + str(src))
+        os.link(src, tmp_fn)
+    except OSError:
+        shutil.copyfile(src, tmp_fn)
+    replace_file(tmp_fn, dst)
+
+
+def dedup_data_dir(data_dir, store_dir, mode='hardlink'):
+    """
+    Convert a data directory to the content-addressed store.
+    All the files of data_dir are added to the store and a manifest is written in data_dir, with the size and
+    modification time of the remaining files so that they are not hashed again while they do not change.
+    Then, depending on mode, the files are:
+    - 'hardlink': replaced by hardlinks to the blobs (files are then read-only)
+    - 'reflink': replaced by copy-on-write clones of the blobs (hardlinks if the OS or file system does not support it)
+    - 'manifest': removed, they are only resolved through the manifest (see resolve_data_file)
+
+    Parameters
+    ----------
+    data_dir: pathlib.Path
+    Data directory to convert (ex: Data/2050).
+
+    store_dir: pathlib.Path
+    Directory of the blob store (ex: Data/.store).
+
+    mode: str
+    'hardlink', 'reflink' or 'manifest'.
+
+    Returns
+    -------
+    The manifest files dictionary {file name: hash}.
+    """
+    if mode not in ['hardlink', 'reflink', 'manifest']:
+        raise ValueError('Unknown mode ' + str(mode) + ', should be hardlink, reflink or manifest')
+    data_dir = Path(data_dir)
+    manifest = read_manifest(data_dir)
+    files = dict() if manifest is None else dict(manifest['files'])
+    stats = dict()
+    reflink = mode == 'reflink'
+
+    for file in sorted(data_dir.iterdir()):
+        if not file.is_file() or file.name == MANIFEST:
+            continue
+        key = _stored_hash(file, manifest, store_dir)
+        files[file.name] = key
+        blob = blob_path(store_dir, key)
+        if mode == 'manifest':
+            file.unlink()
+            continue
+        # the files already hardlinked (or reflinked and unchanged since) to their blob are kept
+        if not os.path.samefile(file, blob) and not (mode == 'reflink' and _unchanged(file, manifest)):
+            tmp_fn = tmp_path(file)
+            if reflink:
+                try:
+                    _reflink(blob, tmp_fn)
+                except (ImportError, OSError):
+                    # no reflinks on this OS (fcntl) or file system
+                    logging.warning('Reflinks are not supported for ' + str(data_dir) + ', using hardlinks')
+                    reflink = False
+                    if tmp_fn.exists():
+                        tmp_fn.unlink()
+            if not reflink:
+                os.link(blob, tmp_fn)
+            replace_file(tmp_fn, file)
+        stats[file.name] = file_stat(file)
+
+    write_manifest(data_dir, store_dir, files, stats)
+    logging.info('Stored ' + str(len(files)) + ' files of ' + str(data_dir) + ' (' + mode + ')')
+    return files
+
+
+def create_scenario(base_dir, scenario_dir, store_dir, files=None):
+    """
+    Create a new data directory as a manifest of the files of base_dir, optionally replacing some of them.
+    No data file is copied: if base_dir was converted with mode='manifest', creating the scenario only writes its
+    manifest. The files present in base_dir are only hashed if they changed (size or modification time) since the
+    manifest of base_dir was written (see dedup_data_dir), the hashes of the manifest are reused otherwise.
+
+    Parameters
+    ----------
+    base_dir: pathlib.Path
+    Data directory of reference (ex: Data/2050).
+
+    scenario_dir: pathlib.Path
+    Data directory to create.
+
+    store_dir: pathlib.Path
+    Directory of the blob store.
+
+    files: dict
+    Files replacing the ones of base_dir, in the form {file name: path of the new file}.
+    """
+    base_dir = Path(base_dir)
+    manifest = read_manifest(base_dir)
+    base_files = dict() if manifest is None else dict(manifest['files'])
+    # files present in base_dir (not converted or reflinked files that may have been modified), only hashed again if
+    # they changed since the manifest was written
+    for f in sorted(base_dir.iterdir()):
+        if f.is_file() and f.name != MANIFEST:
+            base_files[f.name] = _stored_hash(f, manifest, store_dir)
+
+    for file_name, file in (files or {}).items():
+        base_files[file_name] = store_file(file, store_dir)
+
+    write_manifest(scenario_dir, store_dir, base_files)
+    return
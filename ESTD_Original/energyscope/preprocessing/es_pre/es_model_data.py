@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the ModelData class, a compact integer-indexed view of the data imported by import_data.
+The names of the resources, technologies, layers and end-use types are given integer codes (their position),
+the parameters are stored as contiguous numpy arrays and the memberships to the sets of the model are computed once
+as boolean masks.
+"""
+import numpy as np
+import pandas as pd
+
+# end-use types with storages (see STORAGE_OF_END_USES_TYPES), by order of priority when a storage has several
+# input layers
+STORAGE_END_USES_TYPES = ['HEAT_LOW_T_DHN', 'HEAT_LOW_T_DECEN', 'ELECTRICITY', 'HEAT_HIGH_T']
+
+
+def _codes(names):
+    # dictionary {name: integer code}
+    return {n: i for i, n in enumerate(names)}
+
+
+def _lookup(code, names):
+    # integer codes of names (-1 if not found)
+    return np.array([code.get(n, -1) for n in names], dtype=np.int64)
+
+
+class SparseMatrix:
+    """
+    Sparse matrix with named rows and columns (ex: Layers_in_out, rows=resources/technologies, columns=layers).
+    The nonzero entries are stored in compressed sparse row format (indptr, indices, data) and in compressed sparse
+    column format (col_indptr, col_indices, col_data) for the queries on a column (ex: producers of a layer).
+    """
+    __slots__ = ('row_names', 'col_names', 'row_code', 'col_code', 'shape', 'indptr', 'indices', 'data',
+                 'col_indptr', 'col_indices', 'col_data')
+
+    def __init__(self, row_names, col_names, rows, cols, values):
+        """
+        Build the matrix from its entries in coordinate format (rows[k], cols[k], values[k]), zeros are dropped.
+
+        Parameters
+        ----------
+        row_names, col_names: list(str)
+        Names of the rows and of the columns.
+
+        rows, cols: array-like of int
+        Row and column codes of the entries.
+
+        values: array-like of float
+        Values of the entries.
+        """
+        self.row_names = np.asarray(row_names, dtype=str)
+        self.col_names = np.asarray(col_names, dtype=str)
+        self.row_code = _codes(self.row_names)
+        self.col_code = _codes(self.col_names)
+        self.shape = (self.row_names.size, self.col_names.size)
+        rows, cols, values = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64), \
+            np.asarray(values, dtype=float)
+        keep = values != 0
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+        order = np.lexsort((cols, rows))
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=self.shape[0]))))
+        self.indices = cols[order]
+        self.data = values[order]
+        order = np.lexsort((rows, cols))
+        self.col_indptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=self.shape[1]))))
+        self.col_indices = rows[order]
+        self.col_data = values[order]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """Build the sparse matrix of a dataframe"""
+        values = df.to_numpy(dtype=float)
+        rows, cols = np.nonzero(values)
+        return cls(df.index, df.columns, rows, cols, values[rows, cols])
+
+    @property
+    def nnz(self):
+        """Number of nonzero entries"""
+        return self.data.size
+
+    def to_coo(self):
+        """Row codes, column codes and values of the nonzero entries (ordered by row, then column)"""
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr)), self.indices, self.data
+
+    def to_frame(self):
+        """Dense dataframe of the matrix"""
+        dense = np.zeros(self.shape)
+        rows, cols, values = self.to_coo()
+        dense[rows, cols] = values
+        return pd.DataFrame(dense, index=self.row_names, columns=self.col_names)
+
+    def row(self, name: str):
+        """Nonzero entries of a row, as a pd.Series indexed by the column names"""
+        i = self.row_code[name]
+        sl = slice(self.indptr[i], self.indptr[i + 1])
+        return pd.Series(self.data[sl], index=self.col_names[self.indices[sl]], name=name)
+
+    def column(self, name: str):
+        """Nonzero entries of a column, as a pd.Series indexed by the row names"""
+        j = self.col_code[name]
+        sl = slice(self.col_indptr[j], self.col_indptr[j + 1])
+        return pd.Series(self.col_data[sl], index=self.row_names[self.col_indices[sl]], name=name)
+
+    def producers(self, name: str, threshold=0):
+        """Rows with a value above threshold in the column name (ex: technologies producing a layer)"""
+        col = self.column(name)
+        return col[col > threshold]
+
+    def consumers(self, name: str, threshold=0):
+        """Rows with a value below -threshold in the column name (ex: technologies consuming a layer)"""
+        col = self.column(name)
+        return col[col < -threshold]
+
+
+class ModelData:
+    """
+    Compact integer-indexed view of config['all_data'] (see import_data and get_model_data).
+
+    Names (numpy arrays of str, the integer code of an element is its position):
+    resources, technologies, layers (columns of Layers_in_out), end_uses_types, end_uses_categories, end_uses_input,
+    sectors, lio_names (rows of Layers_in_out), storage_names (rows of Storage_eff_in), time_series_names
+
+    Codes: res_code, tech_code, layer_code, eut_code ({name: code}), eut_category (category code of each end-use type),
+    storage (technology code of each storage), lio_tech (technology code of each row of Layers_in_out, -1 for resources)
+
+    Parameters (float64 arrays): res_params (resources x res_param_names), tech_params (technologies x
+    tech_param_names), demand (end_uses_input x sectors), storage_eff_in and storage_eff_out (storage x layers),
+    storage_char (storage x storage_char_names), time_series (8760 x time_series_names) and layers_in_out
+    (SparseMatrix lio_names x layers, see SparseMatrix)
+
+    Masks: is_biofuel, is_export, is_re (resources), is_storage, is_infrastructure, is_v2g (technologies), lio_is_res
+    (rows of Layers_in_out), eut_lio (rows of Layers_in_out x end_uses_types, technologies of each end-use type),
+    is_storage_daily, is_ev_batt (storage) and storage_eut (code in STORAGE_END_USES_TYPES of each storage, -1 if none)
+    """
+    __slots__ = ('all_data', 'misc',
+                 'resources', 'technologies', 'layers', 'end_uses_types', 'end_uses_categories', 'end_uses_input',
+                 'sectors', 'lio_names', 'storage_names', 'time_series_names',
+                 'res_code', 'tech_code', 'layer_code', 'eut_code', 'eut_category', 'storage', 'lio_tech',
+                 'res_param_names', 'res_params', 'tech_param_names', 'tech_params', 'demand', 'layers_in_out',
+                 'storage_eff_in', 'storage_eff_out', 'storage_char_names', 'storage_char', 'time_series',
+                 'is_biofuel', 'is_export', 'is_re', 'is_storage', 'is_infrastructure', 'is_v2g', 'lio_is_res',
+                 'eut_lio', 'is_storage_daily', 'is_ev_batt', 'storage_eut')
+
+    def __init__(self, all_data: dict):
+        """
+        Build the integer-indexed view of the data.
+
+        Parameters
+        ----------
+        all_data: dict
+        Data as imported by import_data (config['all_data']).
+        """
+        self.all_data = all_data
+        self.misc = all_data['Misc']
+        resources = all_data['Resources']
+        technologies = all_data['Technologies']
+        demand = all_data['Demand'].drop(columns=['Category', 'Subcategory', 'Units'])
+        end_uses_categories = all_data['End_uses_categories']
+        layers_in_out = all_data['Layers_in_out']
+        storage_eff_in = all_data['Storage_eff_in']
+
+        # Names and codes #
+        self.resources = resources.index.to_numpy(dtype=str)
+        self.technologies = technologies.index.to_numpy(dtype=str)
+        self.layers = layers_in_out.columns.to_numpy(dtype=str)
+        self.end_uses_types = end_uses_categories['END_USES_TYPES_OF_CATEGORY'].to_numpy(dtype=str)
+        self.end_uses_categories = end_uses_categories['END_USES_CATEGORIES'].unique().astype(str)
+        self.end_uses_input = demand.index.to_numpy(dtype=str)
+        self.sectors = demand.columns.to_numpy(dtype=str)
+        self.lio_names = layers_in_out.index.to_numpy(dtype=str)
+        self.storage_names = storage_eff_in.index.to_numpy(dtype=str)
+        self.time_series_names = all_data['Time_series'].columns.to_numpy(dtype=str)
+
+        self.res_code = _codes(self.resources)
+        self.tech_code = _codes(self.technologies)
+        self.layer_code = _codes(self.layers)
+        self.eut_code = _codes(self.end_uses_types)
+        self.eut_category = _lookup(_codes(self.end_uses_categories),
+                                    end_uses_categories['END_USES_CATEGORIES'].astype(str))
+        self.storage = _lookup(self.tech_code, storage_eff_in.index.astype(str))
+        self.lio_tech = _lookup(self.tech_code, self.lio_names)
+
+        # Parameters #
+        self.res_param_names = np.array(['avail', 'gwp_op', 'c_op'])
+        self.res_params = np.ascontiguousarray(resources.loc[:, self.res_param_names].to_numpy(dtype=float))
+        tech_params = technologies.drop(columns=['Category', 'Subcategory', 'Technologies name'])
+        self.tech_param_names = tech_params.columns.to_numpy(dtype=str)
+        self.tech_params = np.ascontiguousarray(tech_params.to_numpy(dtype=float))
+        self.demand = np.ascontiguousarray(demand.to_numpy(dtype=float))
+        self.layers_in_out = SparseMatrix.from_frame(layers_in_out)
+        self.storage_eff_in = np.ascontiguousarray(
+            storage_eff_in.reindex(columns=layers_in_out.columns).fillna(0).to_numpy(dtype=float))
+        self.storage_eff_out = np.ascontiguousarray(
+            all_data['Storage_eff_out'].reindex(index=storage_eff_in.index, columns=layers_in_out.columns)
+            .fillna(0).to_numpy(dtype=float))
+        storage_char = all_data['Storage_characteristics'].reindex(index=storage_eff_in.index)
+        self.storage_char_names = storage_char.columns.to_numpy(dtype=str)
+        self.storage_char = np.ascontiguousarray(storage_char.to_numpy(dtype=float))
+        self.time_series = np.ascontiguousarray(all_data['Time_series'].to_numpy(dtype=float))
+
+        # Set memberships #
+        self.is_biofuel = (resources['Subcategory'] == 'Biofuel').to_numpy()
+        self.is_export = (resources['Category'] == 'Export').to_numpy()
+        self.is_re = (resources['Category'] == 'Renewable').to_numpy()
+
+        self.lio_is_res = np.isin(self.lio_names, self.resources)
+        # end-use type of each layer (-1 if the layer is not an end-use type)
+        eut_of_layer = _lookup(self.eut_code, self.layers)
+        rows, cols, values = self.layers_in_out.to_coo()
+        keep = (values == 1) & (eut_of_layer[cols] >= 0) & ~self.lio_is_res[rows]
+        self.eut_lio = np.zeros((self.lio_names.size, self.end_uses_types.size), dtype=bool)
+        self.eut_lio[rows[keep], eut_of_layer[cols[keep]]] = True
+
+        self.is_storage = np.zeros(self.technologies.size, dtype=bool)
+        self.is_storage[self.storage[self.storage >= 0]] = True
+        self.is_infrastructure = ~self.is_storage & ~np.isin(self.technologies,
+                                                             self.lio_names[self.eut_lio.any(axis=1)])
+        self.is_v2g = np.isin(self.technologies, self.misc['evs']['CAR'])
+
+        self.is_storage_daily = np.isin(self.storage_names, self.misc['STORAGE_DAILY'])
+        self.is_ev_batt = np.isin(self.storage_names, self.misc['evs']['EVs_BATT'])
+        eff = storage_eff_in.reindex(columns=STORAGE_END_USES_TYPES).fillna(0).to_numpy(dtype=float) > 0
+        self.storage_eut = np.where(eff.any(axis=1), eff.argmax(axis=1), -1)
+
+    def sets(self):
+        """
+        Sets of the model derived from the data (as printed in ESTD_data.dat).
+
+        Returns
+        -------
+        Dictionary {set name: list of names}, the indexed sets (END_USES_TYPES_OF_CATEGORY,
+        TECHNOLOGIES_OF_END_USES_TYPE, STORAGE_OF_END_USES_TYPES) are dictionaries {index: list of names}.
+        """
+        # technologies of the end-use types, in the order of the end-use types (a technology can appear twice)
+        eut_idx, lio_idx = np.nonzero(self.eut_lio.T)
+        all_tech_of_eut = self.lio_names[lio_idx]
+        cogen = np.char.find(all_tech_of_eut, 'COGEN') >= 0
+        boilers = np.char.find(all_tech_of_eut, 'BOILER') >= 0
+        return {
+            'SECTORS': list(self.sectors),
+            'END_USES_INPUT': list(self.end_uses_input),
+            'END_USES_CATEGORIES': list(self.end_uses_categories),
+            'RESOURCES': list(self.resources),
+            'BIOFUELS': list(self.resources[self.is_biofuel]),
+            'RE_RESOURCES': list(self.resources[self.is_re]),
+            'EXPORT': list(self.resources[self.is_export]),
+            'END_USES_TYPES': list(self.end_uses_types),
+            'END_USES_TYPES_OF_CATEGORY': {c: list(self.end_uses_types[self.eut_category == i])
+                                           for i, c in enumerate(self.end_uses_categories)},
+            'TECHNOLOGIES_OF_END_USES_TYPE': {e: list(all_tech_of_eut[eut_idx == i])
+                                              for i, e in enumerate(self.end_uses_types)},
+            'STORAGE_TECH': list(self.storage_names),
+            'INFRASTRUCTURE': list(self.technologies[self.is_infrastructure]),
+            'STORAGE_OF_END_USES_TYPES': {e: list(self.storage_names[self.storage_eut == i])
+                                          for i, e in enumerate(STORAGE_END_USES_TYPES)},
+            'EVs_BATT': list(self.misc['evs']['EVs_BATT']),
+            'V2G': list(self.misc['evs']['CAR']),
+            'STORAGE_DAILY': list(self.misc['STORAGE_DAILY']),
+            'COGEN': list(all_tech_of_eut[cogen]),
+            'BOILERS': list(all_tech_of_eut[boilers]),
+        }
+
+    def tech_param(self, param: str, techs=None):
+        """Values of the parameter param (column of Technologies) for the technologies techs (default: all)"""
+        values = self.tech_params[:, list(self.tech_param_names).index(param)]
+        return values if techs is None else values[_lookup(self.tech_code, techs)]
+
+    def res_param(self, param: str, res=None):
+        """Values of the parameter param (column of Resources) for the resources res (default: all)"""
+        values = self.res_params[:, list(self.res_param_names).index(param)]
+        return values if res is None else values[_lookup(self.res_code, res)]
+
+    def demand_total(self, end_uses_input=None):
+        """Yearly demand summed over the sectors for the end-uses end_uses_input (default: all)"""
+        total = self.demand.sum(axis=1)
+        return total if end_uses_input is None else total[_lookup(_codes(self.end_uses_input), end_uses_input)]
+
+    def time_series_total(self, names=None):
+        """Sum over the year of the time series names (default: all)"""
+        total = self.time_series.sum(axis=0)
+        return total if names is None else total[_lookup(_codes(self.time_series_names), names)]
+
+    def layer_efficiency(self, layer: str, resources=False):
+        """
+        Column of Layers_in_out for the layer.
+
+        Parameters
+        ----------
+        layer: str
+        Name of the layer.
+
+        resources: bool
+        Keep the rows of the resources (default: only the technologies).
+
+        Returns
+        -------
+        pd.Series of the input/output of each technology (and resource) to the layer.
+        """
+        col = np.zeros(self.lio_names.size)
+        j = self.layer_code[layer]
+        sl = slice(self.layers_in_out.col_indptr[j], self.layers_in_out.col_indptr[j + 1])
+        col[self.layers_in_out.col_indices[sl]] = self.layers_in_out.col_data[sl]
+        keep = np.ones(self.lio_names.size, dtype=bool) if resources else ~self.lio_is_res
+        return pd.Series(col[keep], index=self.lio_names[keep], name=layer)
+
+
+def get_model_data(config: dict):
+    """
+    Get the ModelData of config['all_data'].
+    It is built once and stored into config['model_data'], it is rebuilt when config['all_data'] is replaced or
+    modified through set_params/set_param (the dataframes should not be modified directly in between).
+
+    Parameters
+    ----------
+    config : dict
+    Dictionnary containing all the configurations to run the current case study of EnergyScope.
+
+    Returns
+    -------
+    The ModelData of config['all_data'].
+    """
+    md = config.get('model_data')
+    if md is None or md.all_data is not config['all_data']:
+        md = ModelData(config['all_data'])
+        config['model_data'] = md
+    return md
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions to load the data of several years (ex: Data/2015 ... Data/2050) into one panel
+and to print the .dat files of several years from it
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from energyscope import print_data
+from .es_read_data import import_data
+
+
+def _union(indices):
+    # union of several indices keeping the order of first appearance
+    out = list(indices[0])
+    seen = set(out)
+    for idx in indices[1:]:
+        for i in idx:
+            if i not in seen:
+                out.append(i)
+                seen.add(i)
+    return pd.Index(out, name=indices[0].name)
+
+
+def import_panel(config: dict, years, data_root=None):
+    """
+    Read the data of several years in parallel into a panel.
+    The data of each year is read from data_root/<year> with import_data (using the cache options of config,
+    the data_patch of config is not applied).
+    For each table of config['all_data'], the panel contains one dataframe with a 'Year' index level on top of the
+    index of the table. The rows and columns of the different years are aligned on their union
+    (NaN where a technology, resource or layer does not exist in a year).
+
+    Parameters
+    ----------
+    config : dict
+    Dictionnary containing all the configurations to run the current case study of EnergyScope.
+
+    years: list
+    Years to read (ex: [2015, 2020, 2050]).
+
+    data_root: pathlib.Path
+    Directory containing one data directory per year (default: parent of config['data_dir']).
+
+    Returns
+    -------
+    panel: dict
+    Dictionary with the keys 'years' (list of years), 'data' ({year: all_data} as imported by import_data),
+    'Misc' ({year: misc}) and one aligned dataframe per table (ex: panel['Resources'].loc[(2050, 'H2_RE'), 'gwp_op'],
+    panel['Resources'].xs('H2_RE', level=1)['gwp_op'] for the evolution over the years).
+    """
+    years = list(years)
+    data_root = Path(config['data_dir']).parent if data_root is None else Path(data_root)
+    logging.info('Importing data of years ' + ', '.join(map(str, years)) + ' from ' + str(data_root))
+
+    def read(year):
+        cfg = dict(config)
+        cfg['data_dir'] = data_root / str(year)
+        cfg['data_patch'] = None
+        import_data(cfg)
+        return cfg['all_data']
+
+    with ThreadPoolExecutor(max_workers=len(years)) as executor:
+        data = dict(zip(years, executor.map(read, years)))
+
+    panel = {'years': years, 'data': data, 'Misc': {y: data[y]['Misc'] for y in years}}
+    for table in data[years[0]]:
+        if table == 'Misc':
+            continue
+        index = _union([data[y][table].index for y in years])
+        columns = _union([data[y][table].columns for y in years])
+        panel[table] = pd.concat({y: data[y][table].reindex(index=index, columns=columns) for y in years},
+                                 names=['Year'])
+    return panel
+
+
+def panel_year(panel: dict, year):
+    """
+    Get the data of one year of the panel, in the same form as config['all_data'] (see import_data).
+    The data is not copied nor parsed again.
+    """
+    return panel['data'][year]
+
+
+def print_panel_data(config: dict, panel: dict, years=None):
+    """
+    Print the .dat files of several years of the panel (see print_data).
+    The files of each year are printed into the case study config['case_study'] + '_' + year.
+
+    Parameters
+    ----------
+    config : dict
+    Dictionnary containing all the configurations to run the current case study of EnergyScope.
+
+    panel: dict
+    Panel of data (see import_panel).
+
+    years: list
+    Years to print (default: all the years of the panel).
+    """
+    for year in (panel['years'] if years is None else years):
+        cfg = dict(config)
+        cfg['all_data'] = panel_year(panel, year)
+        cfg['case_study'] = str(config['case_study']) + '_' + str(year)
+        print_data(cfg)
+    return
@@ -8,6 +8,7 @@ Also contains functions to analyse input data
 @author: Paolo Thiran
 """
 import logging
+import copy
 
 import numpy as np
 import pandas as pd
@@ -17,9 +18,11 @@ import os
 import sys
 import json
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import CalledProcessError, run
 from pathlib import Path
 
+from .es_data_store import file_hash, resolve_data_file, tmp_path
 from energyscope import ampl_syntax, print_set, print_df, newline, print_param, print_header, print_run
 
 
@@ -29,6 +32,34 @@ from energyscope import ampl_syntax, print_set, print_df, newline, print_param,
 #  add possibility to run with amplpy
 #  fix sto_year print
 
+# Version of the cleaning done in read_table, part of the cache keys (increment when read_table changes)
+CACHE_VERSION = 2
+# Type of the values of the time series store (see load_time_series), part of its keys
+TIME_SERIES_DTYPE = 'float64'
+
+# Name of the csv file and pd.read_csv options of each table of config['all_data']
+DATA_FILES = {'Demand': ('Demand.csv', {'index_col': 2, 'header': 0}),
+              'Resources': ('Resources.csv', {'index_col': 2, 'header': 2}),
+              'Technologies': ('Technologies.csv', {'index_col': 3, 'header': 0, 'skiprows': [1]}),
+              'End_uses_categories': ('END_USES_CATEGORIES.csv', {}),
+              'Layers_in_out': ('Layers_in_out.csv', {'index_col': 0}),
+              'Storage_characteristics': ('Storage_characteristics.csv', {'index_col': 0}),
+              'Storage_eff_in': ('Storage_eff_in.csv', {'index_col': 0}),
+              'Storage_eff_out': ('Storage_eff_out.csv', {'index_col': 0}),
+              'Time_series': ('Time_series.csv', {'header': 0, 'index_col': 0})}
+
+# Columns read as text in each table, all the other columns are read as float64.
+# If a table schema (ex: Technologies.csv.schema.json) is shipped with the csv, it takes precedence.
+TEXT_COLUMNS = {'Demand': ['Category', 'Subcategory', 'parameter name', 'Units'],
+                'Resources': ['Category', 'Subcategory', 'parameter name', 'Comment'],
+                'Technologies': ['Category', 'Subcategory', 'Technologies name', 'Technologies param', 'Comment'],
+                'End_uses_categories': ['END_USES_CATEGORIES', 'END_USES_TYPES_OF_CATEGORY'],
+                'Layers_in_out': [], 'Storage_characteristics': [], 'Storage_eff_in': [], 'Storage_eff_out': [],
+                'Time_series': []}
+
+# Columns not read from the csv
+DROPPED_COLUMNS = ['Comment']
+
 
 def print_json(my_sets, file):  # printing the dictionary containing all the sets into directory/sets.json
     with open(file, 'w') as fp:
@@ -64,6 +95,9 @@ def load_config(config_fn: str):
     # Extend path
     for param in ['data_dir', 'es_path', 'cs_path', 'step1_path']:
         cfg[param] = project_path / cfg[param]
+    for param in ['cache_dir', 'td_of_days_path']:
+        if cfg.get(param) is not None:
+            cfg[param] = project_path / cfg[param]
 
     # Extend path for log_file
     cfg['ampl_options']['log_file'] = str(cfg['cs_path'] / cfg['case_study'] / cfg['ampl_options']['log_file'])
@@ -71,6 +105,338 @@ def load_config(config_fn: str):
     return cfg
 
 
+def schema_path(file):
+    """Path of the table schema shipped with a csv (ex: Technologies.csv.schema.json for Technologies.csv)"""
+    return Path(file).with_name(Path(file).name + '.schema.json')
+
+
+def read_schema(schema_fn):
+    """
+    Read the table schema shipped with a csv (ex: Technologies.csv.schema.json), if any.
+
+    Parameters
+    ----------
+    schema_fn: pathlib.Path
+    Path of the schema file (see schema_path) or None.
+
+    Returns
+    -------
+    A dictionary {column name: 'str' or 'float64'} or None if there is no schema for this csv.
+    """
+    if schema_fn is None or not Path(schema_fn).is_file():
+        return None
+    fields = read_json(schema_fn)['fields']
+    return {f['name'].strip(): 'str' if f['type'] == 'string' else 'float64' for f in fields}
+
+
+def table_dtypes(name: str, file, schema_fn=None):
+    """
+    Define the pd.read_csv options specifying the type of each column of a table.
+    The index column is read as text (as integers for the time series), the text columns are given by the table schema
+    or TEXT_COLUMNS and all the other columns are parsed as float64. The columns of DROPPED_COLUMNS are not read.
+
+    Parameters
+    ----------
+    name: str
+    Name of the table as in config['all_data'] (ex: 'Resources').
+
+    file: pathlib.Path
+    Path of the csv file.
+
+    schema_fn: pathlib.Path
+    Path of the table schema of the csv (default: schema_path(file)).
+
+    Returns
+    -------
+    A dictionary with the options 'index_col', 'usecols' and 'dtype' of pd.read_csv.
+    """
+    opts = DATA_FILES[name][1]
+    # reading the header only to get the raw names of the columns
+    header_opts = {k: v for k, v in opts.items() if k != 'index_col'}
+    columns = list(pd.read_csv(file, sep=';', nrows=0, **header_opts).columns)
+
+    schema = read_schema(schema_path(file) if schema_fn is None else schema_fn)
+    if schema is None:
+        schema = {c: 'str' for c in TEXT_COLUMNS[name]}
+    index_col = columns[opts.get('index_col', 0)] if 'index_col' in opts else None
+
+    usecols = [c for c in columns if c.strip() not in DROPPED_COLUMNS]
+    dtype = {c: schema.get(c.strip(), 'float64') for c in usecols}
+    if index_col is not None:
+        dtype[index_col] = 'int64' if name == 'Time_series' else 'str'
+    return {'index_col': index_col, 'usecols': usecols, 'dtype': dtype}
+
+
+def read_table(name: str, file, schema_fn=None):
+    """
+    Read one of the csv of the data directory into a cleaned dataframe.
+    The reading options of each table are defined in DATA_FILES and the type of each column is specified
+    (see table_dtypes), so that each numeric column is parsed once as float64.
+    The incomplete rows of resources and technologies are dropped
+    and the white spaces around the indices and columns are stripped.
+
+    Parameters
+    ----------
+    name: str
+    Name of the table as in config['all_data'] (ex: 'Resources').
+
+    file: pathlib.Path
+    Path of the csv file to read.
+
+    schema_fn: pathlib.Path
+    Path of the table schema of the csv (default: schema_path(file)).
+
+    Returns
+    -------
+    The cleaned dataframe.
+    """
+    opts = dict(DATA_FILES[name][1])
+    opts.update(table_dtypes(name, file, schema_fn))
+    try:
+        df = pd.read_csv(file, sep=';', **opts)
+    except ValueError as e:
+        raise ValueError('Could not read ' + str(file) + ' with the expected column types: ' + str(e))
+
+    # Pre-processing #
+    if name in ['Resources', 'Technologies']:
+        df.dropna(axis=0, how='any', inplace=True)
+    # cleaning indices and columns
+    if type(df.index[0]) == str:
+        df.index = df.index.str.strip()
+    if type(df.columns[0]) == str:
+        df.columns = df.columns.str.strip()
+    return df
+
+
+def read_table_cached(name: str, file, cache_dir, schema_fn=None):
+    """
+    Read one of the csv of the data directory through the binary cache in cache_dir.
+    The cache entry is keyed on the content hash of the csv, so that a table is only parsed again when its file
+    changed. The entries are written atomically and can be shared by concurrent runs.
+
+    Parameters
+    ----------
+    name: str
+    Name of the table as in config['all_data'] (ex: 'Resources').
+
+    file: pathlib.Path
+    Path of the csv file to read.
+
+    cache_dir: pathlib.Path
+    Directory containing the cached tables.
+
+    schema_fn: pathlib.Path
+    Path of the table schema of the csv (default: schema_path(file)).
+
+    Returns
+    -------
+    The cleaned dataframe (see read_table).
+    """
+    key = file_hash(file) + '_v' + str(CACHE_VERSION)
+    if schema_fn is None:
+        schema_fn = schema_path(file)
+    if Path(schema_fn).is_file():
+        key = key + '_' + file_hash(schema_fn)[:16]
+    cache_fn = Path(cache_dir) / (name + '_' + key + '.pkl')
+    if cache_fn.is_file():
+        logging.debug('Loading ' + name + ' from cache ' + str(cache_fn))
+        return pd.read_pickle(cache_fn)
+
+    df = read_table(name, file, schema_fn)
+    cache_fn.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fn = tmp_path(cache_fn)
+    df.to_pickle(tmp_fn)
+    os.replace(tmp_fn, cache_fn)
+    return df
+
+
+def load_time_series(file, cache_dir):
+    """
+    Load the time series through a binary store in cache_dir/time_series.
+    The first time a Time_series.csv is read, its values are saved as a float64 .npy array (with a .json containing
+    the index and columns), keyed on the content hash of the csv. The array is then memory-mapped (read-only) so that
+    the returned dataframe is a zero-copy view on it and parallel runs share one page-cached copy of each weather year.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+    Path of the Time_series.csv file.
+
+    cache_dir: pathlib.Path
+    Directory containing the cached data.
+
+    Returns
+    -------
+    The time series as a (8760xN_ts) dataframe of float64 backed by the memory-mapped array.
+    """
+    key = file_hash(file) + '_v' + str(CACHE_VERSION) + '_' + TIME_SERIES_DTYPE
+    store_dir = Path(cache_dir) / 'time_series'
+    npy_fn = store_dir / (key + '.npy')
+    labels_fn = store_dir / (key + '.json')
+
+    if not (npy_fn.is_file() and labels_fn.is_file()):
+        ts = read_table('Time_series', file)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_fn = tmp_path(npy_fn)
+        with open(tmp_fn, 'wb') as fp:
+            np.save(fp, ts.to_numpy(dtype=TIME_SERIES_DTYPE))
+        os.replace(tmp_fn, npy_fn)
+        tmp_fn = tmp_path(labels_fn)
+        print_json({'index': ts.index.tolist(), 'index_name': ts.index.name, 'columns': ts.columns.tolist()}, tmp_fn)
+        os.replace(tmp_fn, labels_fn)
+
+    labels = read_json(labels_fn)
+    values = np.load(npy_fn, mmap_mode='r')
+    index = pd.Index(labels['index'], name=labels['index_name'])
+    return pd.DataFrame(values, index=index, columns=labels['columns'], copy=False)
+
+
+def load_patch(patch):
+    """
+    Load a scenario patch (overlay) on the input data.
+    A patch is a dictionary of the form {table: {row: {column: value}}} where table is a key of config['all_data'].
+    For the miscellaneous data, the patch is of the form {'Misc': {key: value}} and nested dictionaries are updated
+    item by item.
+
+    Parameters
+    ----------
+    patch: dict or str or pathlib.Path
+    The patch itself or the path to a .json or .yaml file containing it.
+
+    Returns
+    -------
+    The patch as a dictionary.
+    """
+    if isinstance(patch, dict):
+        return patch
+    patch = Path(patch)
+    if patch.suffix == '.json':
+        return read_json(patch)
+    with open(patch, 'r') as fp:
+        return yaml.load(fp, Loader=yaml.FullLoader)
+
+
+def _update_misc(misc: dict, patch: dict, prefix=''):
+    # recursive update of the miscellaneous data, only allowing existing keys
+    for key, value in patch.items():
+        if key not in misc:
+            raise KeyError('Unknown key ' + prefix + str(key) + ' in Misc')
+        if isinstance(misc[key], dict) and isinstance(value, dict):
+            _update_misc(misc[key], value, prefix=prefix + str(key) + '.')
+        else:
+            misc[key] = value
+
+
+def _check_names(all_data: dict, table: str, rows, columns):
+    # check that the table, rows and columns exist in the data and raise a KeyError otherwise
+    if table not in all_data:
+        raise KeyError('Unknown table ' + str(table))
+    df = all_data[table]
+    unknown_rows = pd.Index(rows).difference(df.index)
+    if len(unknown_rows) > 0:
+        raise KeyError('Unknown row(s) ' + ', '.join(map(str, unknown_rows)) + ' in table ' + table)
+    unknown_columns = pd.Index(columns).difference(df.columns)
+    if len(unknown_columns) > 0:
+        raise KeyError('Unknown column(s) ' + ', '.join(map(str, unknown_columns)) + ' in table ' + table)
+
+
+def set_params(config: dict, table: str, rows, columns, values):
+    """
+    Set the values of several parameters of a table of the imported data (config['all_data']).
+    The data is modified in memory, there is no need to write and import the csv again.
+
+    Parameters
+    ----------
+    config: dict
+    Dictionnary containing all the configurations, the data must have been imported (see import_data).
+
+    table: str
+    Name of the table in config['all_data'] (ex: 'Resources').
+
+    rows: str or list(str)
+    Name(s) of the rows to modify (ex: ['H2_RE', 'GAS_RE']).
+
+    columns: str or list(str)
+    Name(s) of the columns to modify (ex: 'gwp_op').
+
+    values: float or array-like
+    Values to set, with the usual pandas broadcasting rules of df.loc[rows, columns] = values.
+    For the 'Misc' table, rows are keys of the dictionary and columns must be None (or the key of a nested dictionary).
+    """
+    all_data = config['all_data']
+    # the integer-indexed view of the data is rebuilt at its next use (see get_model_data)
+    config.pop('model_data', None)
+    # the data before the first modification is kept for the layered data mode (see print_data),
+    # only the modified tables are copied
+    base_data = config.setdefault('base_data', dict(all_data))
+    if base_data[table] is all_data[table]:
+        base_data[table] = copy.deepcopy(all_data[table])
+    rows = [rows] if isinstance(rows, str) else list(rows)
+    if table == 'Misc':
+        misc = all_data['Misc']
+        values = [values] * len(rows) if np.ndim(values) == 0 else list(values)
+        for row, value in zip(rows, values):
+            if row not in misc:
+                raise KeyError('Unknown key ' + str(row) + ' in Misc')
+            if columns is None:
+                misc[row] = value
+            else:
+                if columns not in misc[row]:
+                    raise KeyError('Unknown key ' + str(row) + '.' + str(columns) + ' in Misc')
+                misc[row][columns] = value
+        return
+    # a single column is kept as a label, so that values broadcast as in df.loc[rows, column] = values
+    columns = columns if isinstance(columns, str) else list(columns)
+    _check_names(all_data, table, rows, [columns] if isinstance(columns, str) else columns)
+    if not all_data[table].to_numpy().flags.writeable:
+        # memory-mapped time series (see load_time_series) are copied before being modified
+        all_data[table] = all_data[table].astype('float64')
+    all_data[table].loc[rows, columns] = values
+    return
+
+
+def set_param(config: dict, table: str, row: str, column: str, value):
+    """
+    Set the value of one parameter of the imported data (config['all_data']) in memory (see set_params).
+
+    Example: set_param(config, 'Resources', 'H2_RE', 'gwp_op', 0.05)
+    """
+    set_params(config, table, [row], column, value)
+    return
+
+
+def apply_patch(all_data: dict, patch):
+    """
+    Apply a scenario patch (see load_patch) in memory on the data imported by import_data.
+    The names of the tables, rows and columns of the patch must exist in the data.
+
+    Parameters
+    ----------
+    all_data: dict
+    Dictionnary with the dataframes containing all the data (config['all_data']).
+
+    patch: dict or str or pathlib.Path
+    The patch or the path to the file containing it.
+    """
+    patch = load_patch(patch)
+    for table, rows in patch.items():
+        if table not in all_data:
+            raise KeyError('Unknown table ' + str(table) + ' in data patch')
+        if table == 'Misc':
+            _update_misc(all_data['Misc'], rows)
+            continue
+        # gathering the modified values column by column to set them at once
+        patch_df = pd.DataFrame.from_dict(rows, orient='index')
+        _check_names(all_data, table, list(patch_df.index), list(patch_df.columns))
+        if not all_data[table].to_numpy().flags.writeable:
+            # memory-mapped time series (see load_time_series) are copied before being modified
+            all_data[table] = all_data[table].astype('float64')
+        for column, values in patch_df.items():
+            values = values.dropna()
+            all_data[table].loc[values.index, column] = values.values
+    return
+
+
 def import_data(config: dict):
     """
     Read the data into the csv and the misc.json into the data directory (config['data_dir'])
@@ -82,47 +448,52 @@ def import_data(config: dict):
     ----------
     config : dict
     Dictionnary containing all the configurations to run the current case study of EnergyScope.
-    For this function to work, it must contain and item of type pathlib.Path into the key 'data_dir'
+    For this function to work, it must contain and item of type pathlib.Path into the key 'data_dir'.
+    The data directory can be a manifest of files stored in a content-addressed store (see es_data_store).
+    If it contains a pathlib.Path into the key 'cache_dir', the cleaned dataframes are cached there
+    and a csv is only parsed again when its content changed (see read_table_cached).
+    If config['time_series_store'] is also True, the time series are loaded as a zero-copy view on a memory-mapped
+    float64 array (see load_time_series).
+    If it contains a patch into the key 'data_patch' (dict or path to a .json/.yaml file), the patch is applied in
+    memory on the imported data (see apply_patch). This allows to define scenarios as a base data directory plus a
+    few modified values without copying the data directory. The data before the patch is then kept into
+    config['base_data'] (only the patched tables are copied), for the layered data mode of print_data.
 
     """
 
     data_dir = config['data_dir']
+    cache_dir = config.get('cache_dir')
     logging.info('Importing data files from ' + str(data_dir))
-    # Reading CSV #
-    eud = pd.read_csv(data_dir / 'Demand.csv', sep=';', index_col=2, header=0)
-    resources = pd.read_csv(data_dir / 'Resources.csv', sep=';', index_col=2, header=2)
-    technologies = pd.read_csv(data_dir / 'Technologies.csv', sep=';', index_col=3, header=0, skiprows=[1])
-    end_uses_categories = pd.read_csv(data_dir / 'END_USES_CATEGORIES.csv', sep=';')
-    layers_in_out = pd.read_csv(data_dir / 'Layers_in_out.csv', sep=';', index_col=0)
-    storage_characteristics = pd.read_csv(data_dir / 'Storage_characteristics.csv', sep=';', index_col=0)
-    storage_eff_in = pd.read_csv(data_dir / 'Storage_eff_in.csv', sep=';', index_col=0)
-    storage_eff_out = pd.read_csv(data_dir / 'Storage_eff_out.csv', sep=';', index_col=0)
-    time_series = pd.read_csv(data_dir / 'Time_series.csv', sep=';', header=0, index_col=0)
+    # Reading CSV (concurrently) #
+    def read(name):
+        # the files are resolved through the manifest of data_dir if they are in the blob store (see es_data_store)
+        file = resolve_data_file(data_dir, DATA_FILES[name][0])
+        if file is None:
+            raise FileNotFoundError('No file ' + DATA_FILES[name][0] + ' in ' + str(data_dir))
+        schema_fn = resolve_data_file(data_dir, DATA_FILES[name][0] + '.schema.json')
+        if cache_dir is None:
+            return read_table(name, file, schema_fn)
+        if name == 'Time_series' and config.get('time_series_store', False):
+            return load_time_series(file, cache_dir)
+        return read_table_cached(name, file, cache_dir, schema_fn)
 
-    # Reading misc.json
-    misc = read_json(data_dir / 'misc.json')
-
-    # Pre-processing #
-    resources.drop(columns=['Comment'], inplace=True)
-    resources.dropna(axis=0, how='any', inplace=True)
-    technologies.drop(columns=['Comment'], inplace=True)
-    technologies.dropna(axis=0, how='any', inplace=True)
-    # cleaning indices and columns
+    with ThreadPoolExecutor(max_workers=len(DATA_FILES)) as executor:
+        all_df = dict(zip(DATA_FILES, executor.map(read, DATA_FILES)))
 
-    all_df = {'Demand': eud, 'Resources': resources, 'Technologies': technologies,
-              'End_uses_categories': end_uses_categories, 'Layers_in_out': layers_in_out,
-              'Storage_characteristics': storage_characteristics, 'Storage_eff_in': storage_eff_in,
-              'Storage_eff_out': storage_eff_out, 'Time_series': time_series,
-              }
-
-    for key in all_df:
-        if type(all_df[key].index[0]) == str:
-            all_df[key].index = all_df[key].index.str.strip()
-        if type(all_df[key].columns[0]) == str:
-            all_df[key].columns = all_df[key].columns.str.strip()
+    # Reading misc.json
+    misc = read_json(resolve_data_file(data_dir, 'misc.json'))
 
     all_df['Misc'] = misc
 
+    config.pop('base_data', None)
+    if config.get('data_patch') is not None:
+        logging.info('Applying data patch')
+        patch = load_patch(config['data_patch'])
+        # the data before the patch is kept for the layered data mode (see print_data),
+        # only the patched tables are copied
+        config['base_data'] = {k: (copy.deepcopy(v) if k in patch else v) for k, v in all_df.items()}
+        apply_patch(all_df, patch)
+
     config['all_data'] = all_df
 
     return
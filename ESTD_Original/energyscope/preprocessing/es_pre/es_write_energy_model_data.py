@@ -17,10 +17,13 @@ import os
 import sys
 import json
 import shutil
+import threading
 from subprocess import CalledProcessError, run
 from pathlib import Path
 
-from energyscope import ampl_syntax, print_set, print_df, newline, print_param, print_header, print_run
+from energyscope import ampl_syntax, print_run, DatWriter, hash_inputs, td_of_days_path
+from .es_data_store import file_hash, link_file, replace_file, tmp_path
+from .es_model_data import SparseMatrix, ModelData, get_model_data
 
 
 # TODO
@@ -29,14 +32,432 @@ from energyscope import ampl_syntax, print_set, print_df, newline, print_param,
 #  add possibility to run with amplpy
 #  fix sto_year print
 
+# DICTIONARIES TO TRANSLATE TIME SERIES NAMES INTO AMPL SYNTAX #
+# TODO automatise
+# for EUD timeseries
+EUD_PARAMS = {'Electricity (%_elec)': 'param electricity_time_series :',
+              'Space Heating (%_sh)': 'param heating_time_series :',
+              'Passanger mobility (%_pass)': 'param mob_pass_time_series :',
+              'Freight mobility (%_freight)': 'param mob_freight_time_series :'}
+# for resources timeseries that have only 1 tech linked to it
+RES_PARAMS = {'PV': 'PV', 'Wind_onshore': 'WIND_ONSHORE', 'Wind_offshore': 'WIND_OFFSHORE',
+              'Hydro_river': 'HYDRO_RIVER'}
+# for resources timeseries that have several techs linked to it
+RES_MULT_PARAMS = {'Solar': ['DHN_SOLAR', 'DEC_SOLAR']}
+
+# HARDCODED SETS #
+# TODO automatise
+RES_IMPORT_CONSTANT_DEFAULT = ['GAS', 'GAS_RE', 'H2_RE', 'H2']
+# link between the decentralised heating technologies and their thermal storage
+TS_OF_DEC_TECH = {'DEC_HP_ELEC': 'TS_DEC_HP_ELEC', 'DEC_DIRECT_ELEC': 'TS_DEC_DIRECT_ELEC',
+                  'DEC_THHP_GAS': 'TS_DEC_THHP_GAS', 'DEC_COGEN_GAS': 'TS_DEC_COGEN_GAS',
+                  'DEC_ADVCOGEN_GAS': 'TS_DEC_ADVCOGEN_GAS', 'DEC_COGEN_OIL': 'TS_DEC_COGEN_OIL',
+                  'DEC_ADVCOGEN_H2': 'TS_DEC_ADVCOGEN_H2', 'DEC_BOILER_GAS': 'TS_DEC_BOILER_GAS',
+                  'DEC_BOILER_WOOD': 'TS_DEC_BOILER_WOOD', 'DEC_BOILER_OIL': 'TS_DEC_BOILER_OIL'}
+# link between the V2G technologies and their batteries
+EVS_BATT_OF_V2G = {'CAR_PHEV': 'PHEV_BATT', 'CAR_BEV': 'BEV_BATT'}
+
+# SECTIONS OF ESTD_data.dat #
+# scalar parameters of misc.json printed in the misc_params and shares sections
+MISC_PARAMS = ['i_rate', 're_share_primary', 'solar_area', 'power_density_pv', 'power_density_solar_thermal']
+SHARE_PARAMS = ['share_mobility_public_min', 'share_mobility_public_max', 'share_freight_train_min',
+                'share_freight_train_max', 'share_freight_road_min', 'share_freight_road_max',
+                'share_freight_boat_min', 'share_freight_boat_max', 'share_heat_dhn_min', 'share_heat_dhn_max']
+
+# LAYERED DATA MODE #
+# tables whose values can be overridden with let commands after loading the base data:
+# {table: AMPL parameter indexed by (row, column), or None if each column is a parameter indexed by the rows}
+OVERRIDE_TABLES = {'Technologies': None, 'Resources': None, 'Storage_characteristics': None,
+                   'Demand': 'end_uses_demand_year', 'Layers_in_out': 'layers_in_out',
+                   'Storage_eff_in': 'storage_eff_in', 'Storage_eff_out': 'storage_eff_out'}
+# columns of the tables that are not parameters (descriptive or defining the sets)
+NON_PARAM_COLUMNS = ['Category', 'Subcategory', 'Technologies name', 'Units']
+# scalar and indexed parameters of misc.json that can be overridden
+MISC_OVERRIDE_PARAMS = MISC_PARAMS + SHARE_PARAMS + ['c_grid_extra', 'import_capacity']
+MISC_OVERRIDE_INDEXED = ['share_ned', 'loss_network']
+# name of the file with the overrides of a case study
+OVERRIDE_FILE = 'ESTD_override.run'
+# serialises the printing of the shared base files by the scenarios run in threads (the files are also moved
+# atomically into place for the scenarios run in other processes)
+_base_lock = threading.Lock()
+
+
+def _print_sets(dat, sets):
+    STORAGE_OF_END_USES_TYPES = {k: list(v) for k, v in sets['STORAGE_OF_END_USES_TYPES'].items()}
+    for batt in EVS_BATT_OF_V2G.values():
+        STORAGE_OF_END_USES_TYPES['ELECTRICITY'].remove(batt)
+
+    # printing sets
+    dat.set(sets['SECTORS'], 'SECTORS')
+    dat.set(sets['END_USES_INPUT'], 'END_USES_INPUT')
+    dat.set(sets['END_USES_CATEGORIES'], 'END_USES_CATEGORIES')
+    dat.set(sets['RESOURCES'], 'RESOURCES')
+    dat.set(RES_IMPORT_CONSTANT_DEFAULT, 'RES_IMPORT_CONSTANT')
+    dat.set(sets['BIOFUELS'], 'BIOFUELS')
+    dat.set(sets['RE_RESOURCES'], 'RE_RESOURCES')
+    dat.set(sets['EXPORT'], 'EXPORT')
+    dat.newline()
+    for c, j in sets['END_USES_TYPES_OF_CATEGORY'].items():
+        dat.set(j, 'END_USES_TYPES_OF_CATEGORY' + '["' + c + '"]')
+    dat.newline()
+    for e, j in sets['TECHNOLOGIES_OF_END_USES_TYPE'].items():
+        dat.set(j, 'TECHNOLOGIES_OF_END_USES_TYPE' + '["' + e + '"]')
+    dat.newline()
+    dat.set(sets['STORAGE_TECH'], 'STORAGE_TECH')
+    dat.set(sets['INFRASTRUCTURE'], 'INFRASTRUCTURE')
+    dat.newline()
+    dat.row('# Storage subsets')
+    dat.set(sets['EVs_BATT'], 'EVs_BATT')
+    dat.set(sets['V2G'], 'V2G')
+    dat.set(sets['STORAGE_DAILY'], 'STORAGE_DAILY')
+    dat.newline()
+    for e, j in STORAGE_OF_END_USES_TYPES.items():
+        dat.set(j, 'STORAGE_OF_END_USES_TYPES ["' + e + '"]')
+    dat.newline()
+    dat.row('# Link between storages & specific technologies	')
+    # Hardcoded
+    for tech, ts in TS_OF_DEC_TECH.items():
+        dat.set([ts], 'TS_OF_DEC_TECH ["' + tech + '"]')
+    for v2g, batt in EVS_BATT_OF_V2G.items():
+        dat.set([batt], 'EVs_BATT_OF_V2G ["' + v2g + '"]')
+    dat.newline()
+    dat.row('# Additional sets, just needed for printing results	')
+    dat.set(sets['COGEN'], 'COGEN')
+    dat.set(sets['BOILERS'], 'BOILERS')
+    dat.newline()
+
+
+def _print_misc_params(dat, misc, gwp_limit):
+    # printing parameters
+    dat.row('# -----------------------------')
+    dat.row('# PARAMETERS NOT DEPENDING ON THE NUMBER OF TYPICAL DAYS : ')
+    dat.row('# -----------------------------	')
+    dat.row('')
+    dat.row('## PARAMETERS presented in Table 2.	')
+    # printing i_rate, re_share_primary,gwp_limit,solar_area
+    dat.param('i_rate', misc['i_rate'], 'part [2.7.4]')  # [-]
+    dat.param('re_share_primary', misc['re_share_primary'], 'Minimum RE share in primary consumption')
+    dat.param('gwp_limit', gwp_limit, 'gwp_limit [ktCO2-eq./year]: maximum GWP emissions')
+    dat.param('solar_area', misc['solar_area'], '')  # [km^2]
+    dat.param('power_density_pv', misc['power_density_pv'], 'PV : 1 kW/4.22m2   => 0.2367 kW/m2 => 0.2367 GW/km2')
+    dat.param('power_density_solar_thermal', misc['power_density_solar_thermal'],
+              'Solar thermal : 1 kW/3.5m2 => 0.2857 kW/m2 => 0.2857 GW/km2')
+    dat.newline()
+
+
+def _print_evs(dat, evs, state_of_charge_ev):
+    # Electric vehicles :
+    # km-pass/h/veh. : Gives the equivalence between capacity and number of vehicles.
+    # ev_batt, size [GWh]: Size of batteries per car per technology of EV
+    keys_to_extract = ['EVs_BATT', 'vehicule_capacity', 'batt_per_car']
+    evs = pd.DataFrame({key: evs[key] for key in keys_to_extract}, index=evs['CAR'])
+    state_of_charge_ev = pd.DataFrame.from_dict(state_of_charge_ev, orient='index', columns=np.arange(1, 25))
+    # creating Batt_per_Car_df for printing
+    batt_per_car_df = ampl_syntax(evs[['batt_per_car']],
+                                  '# ev_batt,size [GWh]: Size of batteries per car per technology of EV')
+    vehicule_capacity_df = ampl_syntax(evs[['vehicule_capacity']], '# km-pass/h/veh. : Gives the equivalence between '
+                                                                   'capacity and number of vehicles.')
+    dat.row('# Part [2.4]	')
+    dat.df('param:', batt_per_car_df)
+    dat.newline()
+    dat.df('param:', vehicule_capacity_df)
+    dat.newline()
+    dat.df('param state_of_charge_ev :', ampl_syntax(state_of_charge_ev, ''))
+    dat.newline()
+
+
+def _print_network(dat, c_grid_extra, import_capacity):
+    # printing c_grid_extra and import_capacity
+    dat.param('c_grid_extra', c_grid_extra,
+              'cost to reinforce the grid due to intermittent renewable energy penetration. See 2.2.2')
+    dat.param('import_capacity', import_capacity, '')  # [GW] Maximum power of electrical interconnections
+    dat.newline()
+
+
+def _print_demand(dat, eud):
+    eud_simple = eud.drop(columns=['Category', 'Subcategory', 'Units'])
+    eud_simple.index.name = 'param end_uses_demand_year:'
+    dat.row('# end_Uses_year see part [2.1]')
+    dat.df('param end_uses_demand_year : ', ampl_syntax(eud_simple, ''))
+    dat.newline()
+
+
+def _print_shares(dat, shares, share_ned):
+    # Technologies shares
+    for k in ['mobility_public', 'freight_train', 'freight_road', 'freight_boat', 'heat_dhn']:
+        dat.param('share_' + k + '_min', shares['share_' + k + '_min'], '')
+        dat.param('share_' + k + '_max', shares['share_' + k + '_max'], '')
+        dat.newline()
+    share_ned = pd.DataFrame.from_dict(share_ned, orient='index', columns=['share_ned'])
+    dat.df('param:', ampl_syntax(share_ned, ''))
+    dat.newline()
+
+
+def _print_layers_in_out(dat, layers_in_out, sparse):
+    dat.row('# Link between layers  (data from Tables 19,21,22,23,25,29,30)')
+    if sparse:
+        # only the nonzero entries (layers_in_out is mostly zeros)
+        lio = SparseMatrix.from_frame(layers_in_out)
+        rows, cols, values = lio.to_coo()
+        dat.sparse('layers_in_out', lio.row_names[rows], lio.col_names[cols], values)
+    else:
+        dat.df('param layers_in_out : ', ampl_syntax(layers_in_out, ''))
+    dat.newline()
+
+
+def _print_technologies(dat, technologies):
+    technologies_simple = technologies.drop(columns=['Category', 'Subcategory', 'Technologies name'])
+    technologies_simple.index.name = 'param:'
+    technologies_simple = ampl_syntax(technologies_simple, '')
+    technologies_simple[technologies_simple > 1e+14] = 'Infinity'
+    dat.row('# Technologies data from Tables (10,19,21,22,23,25,27,28,29,30) and part [2.2.1.1] for hydro')
+    dat.df('param :', technologies_simple)
+    dat.newline()
+
+
+def _print_resources(dat, resources):
+    resources_simple = resources.loc[:, ['avail', 'gwp_op', 'c_op']]
+    resources_simple.index.name = 'param :'
+    resources_simple = ampl_syntax(resources_simple, '')
+    resources_simple[resources_simple > 1e+14] = 'Infinity'
+    dat.row('# RESOURCES: part [2.5] (Table 26)')
+    dat.df('param :', resources_simple)
+    dat.newline()
+
+
+def _print_storage(dat, storage_eff_in, storage_eff_out, storage_characteristics):
+    dat.row('# Storage inlet/outlet efficiency : part [2.6] (Table 28) and part [2.2.1.1] for hydro.	')
+    dat.df('param storage_eff_in :', ampl_syntax(storage_eff_in, ''))
+    dat.newline()
+    dat.df('param storage_eff_out :', ampl_syntax(storage_eff_out, ''))
+    dat.newline()
+    dat.row('# Storage characteristics : part [2.6] (Table 28) and part [2.2.1.1] for hydro.')
+    dat.df('param :', ampl_syntax(storage_characteristics, ''))
+    dat.newline()
+
+
+def _print_loss_network(dat, loss_network):
+    # Network
+    loss_network_df = pd.DataFrame(data=loss_network.values(), index=loss_network.keys(), columns=[' '])
+    dat.row('# [A.6]')
+    dat.df('param loss_network ', ampl_syntax(loss_network_df, ''))
+
+
+def _kahan_sum(a, axis):
+    # compensated sum of a along axis, vectorized over the other axes (same rounding as the sums of pandas groupby)
+    a = np.moveaxis(a, axis, 0)
+    total = np.zeros(a.shape[1:])
+    compensation = np.zeros(a.shape[1:])
+    for x in a:
+        y = x - compensation
+        t = total + y
+        compensation = t - total - y
+        total = t
+    return total
+
+
+def _iter_td_series(dat, names, td_ts):
+    # formats the EUD time series and c_p_t from the (n_ts, 24, nbr_td) array of the rescaled ts of the TDs
+    # and yields the text of each parameter block, so that only one (24, nbr_td) block is formatted at once
+    hours = np.arange(1, td_ts.shape[1] + 1)
+    tds = np.arange(1, td_ts.shape[2] + 1)
+    index = {k: i for i, k in enumerate(names)}
+    for k, param in EUD_PARAMS.items():
+        dat.matrix(param, hours, tds, td_ts[index[k]])
+        dat.row(';')
+        dat.newline()
+        yield dat.drain()
+
+    dat.row('param c_p_t:=')
+    # c_p_t part where 1 ts => 1 tech
+    for k, tech in RES_PARAMS.items():
+        dat.matrix('["' + tech + '",*,*]:', hours, tds, td_ts[index[k]])
+        dat.newline()
+        yield dat.drain()
+    # c_p_t part where 1 ts => more then 1 tech
+    for k, techs in RES_MULT_PARAMS.items():
+        for j in techs:
+            dat.matrix('["' + j + '",*,*]:', hours, tds, td_ts[index[k]])
+            yield dat.drain()
+
+
+def _iter_t_h_td(t_h_td, chunk_size=24 * 30):
+    # yields the lines of the set T_H_TD ((hour of the year, hour of the day, TD) tuples) by chunks of hours
+    columns = [t_h_td[c].to_numpy() for c in ['H_of_Y', 'H_of_D', 'TD_number']]
+    for start in range(0, len(t_h_td), chunk_size):
+        yield ''.join('(\t%d\t,\t%d\t,\t%d\t)\n' % row
+                      for row in zip(*(c[start:start + chunk_size].tolist() for c in columns)))
+
+
+# formatters of the sections of ESTD_data.dat, in the order of the file
+DATA_SECTIONS = {'sets': _print_sets, 'misc_params': _print_misc_params, 'evs': _print_evs,
+                 'network': _print_network, 'demand': _print_demand, 'shares': _print_shares,
+                 'layers_in_out': _print_layers_in_out, 'technologies': _print_technologies,
+                 'resources': _print_resources, 'storage': _print_storage, 'loss_network': _print_loss_network}
+
+
+def _ampl_value(value, infinity=False):
+    # value of a let command, with the same Infinity convention as the technologies and resources sections
+    value = float(value)
+    if np.isnan(value):
+        raise ValueError('Cannot override a parameter with NaN')
+    if infinity and value > 1e+14:
+        return 'Infinity'
+    return repr(value)
+
+
+def data_overrides(base_data: dict, data: dict):
+    """
+    Compute the parameters of data that differ from base_data.
+
+    Parameters
+    ----------
+    base_data: dict
+    Base data, in the same form as config['all_data'] (see import_data).
+
+    data: dict
+    Data of the scenario. The tables that are the same objects as in base_data are not compared.
+
+    Returns
+    -------
+    List of tuples (parameter, index, value) where index is a tuple of names (empty for scalar parameters),
+    or None if some differences cannot be written as overrides of parameters (sets, time series, ...), including the
+    modifications of values that change the sets derived from the data (ex: a new non-zero entry of Layers_in_out).
+    """
+    overrides = list()
+    tables_changed = False
+    for table, df in data.items():
+        base = base_data[table]
+        if df is base:
+            continue
+        if table == 'Misc':
+            for key, value in df.items():
+                if value == base.get(key):
+                    continue
+                if key in MISC_OVERRIDE_PARAMS:
+                    overrides.append((key, (), _ampl_value(value)))
+                elif key in MISC_OVERRIDE_INDEXED and value.keys() == base[key].keys():
+                    overrides += [(key, (k,), _ampl_value(v)) for k, v in value.items() if v != base[key][k]]
+                else:
+                    return None
+            continue
+        if not (df.index.equals(base.index) and df.columns.equals(base.columns)):
+            return None
+        # comparing all the values at once (NaN equal to NaN)
+        new, old = df.to_numpy(), base.to_numpy()
+        changed = ~((new == old) | (pd.isna(new) & pd.isna(old)))
+        if not changed.any():
+            continue
+        tables_changed = True
+        if table not in OVERRIDE_TABLES or df.columns[changed.any(axis=0)].isin(NON_PARAM_COLUMNS).any():
+            return None
+        param = OVERRIDE_TABLES[table]
+        infinity = table in ['Technologies', 'Resources']
+        for i, j in zip(*np.nonzero(changed)):
+            row, column = df.index[i], df.columns[j]
+            if param is None:
+                overrides.append((column, (row,), _ampl_value(new[i, j], infinity)))
+            else:
+                overrides.append((param, (row, column), _ampl_value(new[i, j], infinity)))
+    if tables_changed and hash_inputs(ModelData(base_data).sets()) != hash_inputs(ModelData(data).sets()):
+        # the base data is printed with the sets of base_data, which cannot be overridden
+        return None
+    return overrides
+
+
+def print_overrides(overrides, out_path):
+    """
+    Print the overrides of parameters (see data_overrides) as AMPL let commands
+    (ex: let gwp_op["H2_RE"] := 0.05;), to include after loading the base data.
+    """
+    lines = ['# Overrides of the base data of the case study']
+    for param, index, value in overrides:
+        index = '[' + ','.join('"' + str(i) + '"' for i in index) + ']' if index else ''
+        lines.append('let ' + str(param) + index + ' := ' + value + ';')
+    with open(out_path, mode='w', newline='') as file:
+        file.write('\n'.join(lines) + '\n')
+    return
+
+
+def _print_base(config, cs, base_cs, file_name):
+    # Prints the base file file_name of base_cs through a temporary case study and moves it atomically into place,
+    # so that concurrent scenarios never include a partially written base file
+    tmp_cs = tmp_path(cs / base_cs)
+    try:
+        print_data(dict(config, case_study=tmp_cs.relative_to(cs)))
+        (cs / base_cs).mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_cs / file_name, cs / base_cs / file_name)
+    finally:
+        shutil.rmtree(tmp_cs, ignore_errors=True)
+
+
+def _print_layered_data(config, cs):
+    # Prints the files of the layered data mode (see print_data).
+    # Returns False if the modifications of the data cannot be written as overrides.
+    data = config['all_data']
+    base_data = config.get('base_data', data)
+    overrides = data_overrides(base_data, data)
+    if overrides is not None:
+        overrides.insert(0, ('gwp_limit', (), _ampl_value(config['GWP_limit'])))
+    if overrides is None:
+        logging.warning('The modifications of the data cannot be written as overrides, '
+                        'printing the full data of ' + str(config['case_study']))
+        config.pop('layered_files', None)
+        return False
+
+    layered_files = dict()
+    with _base_lock:
+        if config['printing']:
+            # gwp_limit is not part of the base data, it is always overridden (frequent parameter of the sweeps)
+            key = hash_inputs(base_data, config.get('sparse_layers_in_out', False))
+            base_cs = Path('_base') / ('data_' + key[:16])
+            if not (cs / base_cs / 'ESTD_data.dat').is_file():
+                logging.info('Printing base data ' + str(base_cs))
+                _print_base(dict(config, all_data=base_data, printing_td=False, layered_data=False, model_data=None),
+                            cs, base_cs, 'ESTD_data.dat')
+            layered_files['data'] = cs / base_cs / 'ESTD_data.dat'
+        if config['printing_td']:
+            # the time series cannot be overridden, they are the same in data and base_data
+            td_fn = 'ESTD_' + str(config['nbr_td']) + 'TD.dat'
+            key = td_data_key(config)
+            base_cs = Path('_base') / ('td_' + key[:16])
+            if not (cs / base_cs / td_fn).is_file():
+                logging.info('Printing base typical days ' + str(base_cs))
+                _print_base(dict(config, printing=False, layered_data=False), cs, base_cs, td_fn)
+            layered_files['td'] = cs / base_cs / td_fn
+            config['td_data'] = generate_t_h_td(config)
+
+    (cs / config['case_study']).mkdir(parents=True, exist_ok=True)
+    layered_files['override'] = cs / config['case_study'] / OVERRIDE_FILE
+    print_overrides(overrides, layered_files['override'])
+    logging.info('Printed ' + str(len(overrides)) + ' overrides of the base data into ' + OVERRIDE_FILE)
+    config['layered_files'] = layered_files
+    return True
+
+
 # Function to print the ESTD_data.dat file #
 def print_data(config):
     """
     TODO add doc
+
+    Layered data mode: if config['layered_data'] is True, the data of the case study is printed as shared base files
+    plus a small file of overrides. The base data (config['base_data'] if the data was patched, see import_data) is
+    printed once per version of the data into case_studies/_base/data_<hash>/ESTD_data.dat and the typical days once
+    per time series and td_of_days.out into case_studies/_base/td_<hash>/. The gwp_limit and the parameters of
+    config['all_data'] that differ from the base data are printed as let commands into the ESTD_override.run of the
+    case study (see data_overrides). The paths of these files are stored into config['layered_files'] for run_es.
+    If some modifications cannot be written as overrides (ex: a new technology), the full data is printed as usual.
+
+    If config['cache_dir'] is given, ESTD_<nbr_td>TD.dat is printed once into cache_dir/td for each key (see
+    td_data_key) and hardlinked into the case studies sharing it, it is only printed again when the key changes.
+    The cached files are read-only and the case study files are always replaced, never written through the links.
     """
 
     cs = Path(__file__).parents[3] / 'case_studies'
 
+    if config.get('layered_data', False) and _print_layered_data(config, cs):
+        return
+
     # make dir and parents
     (cs / config['case_study']).mkdir(parents=True, exist_ok=True)
 
@@ -50,7 +471,6 @@ def print_data(config):
     storage_characteristics = data['Storage_characteristics']
     storage_eff_in = data['Storage_eff_in']
     storage_eff_out = data['Storage_eff_out']
-    time_series = data['Time_series']
 
     if config['printing']:
         logging.info('Printing ESTD_data.dat')
@@ -60,462 +480,179 @@ def print_data(config):
         # config['es_path'] + '/ESTD_data.dat'
         gwp_limit = config['GWP_limit']
 
-        # Pre-processing df #
-
-        # pre-processing resources
-        resources_simple = resources.loc[:, ['avail', 'gwp_op', 'c_op']]
-        resources_simple.index.name = 'param :'
-        resources_simple = resources_simple.astype('float')
-        # pre-processing eud
-        eud_simple = eud.drop(columns=['Category', 'Subcategory', 'Units'])
-        eud_simple.index.name = 'param end_uses_demand_year:'
-        eud_simple = eud_simple.astype('float')
-        # pre_processing technologies
-        technologies_simple = technologies.drop(columns=['Category', 'Subcategory', 'Technologies name'])
-        technologies_simple.index.name = 'param:'
-        technologies_simple = technologies_simple.astype('float')
-
-        # Economical inputs
-        i_rate = config['all_data']['Misc']['i_rate']  # [-]
-        # Political inputs
-        re_share_primary = config['all_data']['Misc']['re_share_primary']  # [-] Minimum RE share in primary consumption
-        solar_area = config['all_data']['Misc']['solar_area']  # [km^2]
-        power_density_pv = config['all_data']['Misc'][
-            'power_density_pv']  # PV : 1 kW/4.22m2   => 0.2367 kW/m2 => 0.2367 GW/km2
-        power_density_solar_thermal = config['all_data']['Misc'][
-            'power_density_solar_thermal']  # Solar thermal : 1 kW/3.5m2 => 0.2857 kW/m2 => 0.2857 GW/km2
-
-        # Technologies shares
-        share_mobility_public_min = config['all_data']['Misc']['share_mobility_public_min']
-        share_mobility_public_max = config['all_data']['Misc']['share_mobility_public_max']
-        share_freight_train_min = config['all_data']['Misc']['share_freight_train_min']
-        share_freight_train_max = config['all_data']['Misc']['share_freight_train_max']
-        share_freight_road_min = config['all_data']['Misc']['share_freight_road_min']
-        share_freight_road_max = config['all_data']['Misc']['share_freight_road_max']
-        share_freight_boat_min = config['all_data']['Misc']['share_freight_boat_min']
-        share_freight_boat_max = config['all_data']['Misc']['share_freight_boat_max']
-        share_heat_dhn_min = config['all_data']['Misc']['share_heat_dhn_min']
-        share_heat_dhn_max = config['all_data']['Misc']['share_heat_dhn_max']
-
-        share_ned = pd.DataFrame.from_dict(config['all_data']['Misc']['share_ned'], orient='index',
-                                           columns=['share_ned'])
-
-        # Electric vehicles :
-        # km-pass/h/veh. : Gives the equivalence between capacity and number of vehicles.
-        # ev_batt, size [GWh]: Size of batteries per car per technology of EV
-        keys_to_extract = ['EVs_BATT', 'vehicule_capacity', 'batt_per_car']
-        evs = pd.DataFrame({key: config['all_data']['Misc']['evs'][key] for key in keys_to_extract},
-                           index=config['all_data']['Misc']['evs']['CAR'])
-        state_of_charge_ev = pd.DataFrame.from_dict(config['all_data']['Misc']['state_of_charge_ev'], orient='index',
-                                                    columns=np.arange(1, 25))
-        # Network
-        loss_network = config['all_data']['Misc']['loss_network']
-        c_grid_extra = config['all_data']['Misc'][
-            'c_grid_extra']  # cost to reinforce the grid due to intermittent renewable energy penetration. See 2.2.2
-        import_capacity = config['all_data']['Misc']['import_capacity']
-        # [GW] Maximum power of electrical interconnections
-
-        # Storage daily
-        STORAGE_DAILY = config['all_data']['Misc']['STORAGE_DAILY']
-
-        # Building SETS from data #
-        SECTORS = list(eud_simple.columns)
-        END_USES_INPUT = list(eud_simple.index)
-        END_USES_CATEGORIES = list(end_uses_categories.loc[:, 'END_USES_CATEGORIES'].unique())
-        RESOURCES = list(resources_simple.index)
-        RES_IMPORT_CONSTANT = ['GAS', 'GAS_RE', 'H2_RE', 'H2']  # TODO automatise
-        BIOFUELS = list(resources[resources.loc[:, 'Subcategory'] == 'Biofuel'].index)
-        RE_RESOURCES = list(
-            resources.loc[(resources['Category'] == 'Renewable'), :].index)
-        EXPORT = list(resources.loc[resources['Category'] == 'Export', :].index)
-
-        END_USES_TYPES_OF_CATEGORY = []
-        for i in END_USES_CATEGORIES:
-            li = list(end_uses_categories.loc[
-                          end_uses_categories.loc[:, 'END_USES_CATEGORIES'] == i, 'END_USES_TYPES_OF_CATEGORY'])
-            END_USES_TYPES_OF_CATEGORY.append(li)
-
-        # TECHNOLOGIES_OF_END_USES_TYPE -> # METHOD 2 (uses layer_in_out to determine the END_USES_TYPE)
-        END_USES_TYPES = list(end_uses_categories.loc[:, 'END_USES_TYPES_OF_CATEGORY'])
-
-        ALL_TECHS = list(technologies_simple.index)
-
-        layers_in_out_tech = layers_in_out.loc[~layers_in_out.index.isin(RESOURCES), :]
-        TECHNOLOGIES_OF_END_USES_TYPE = []
-        for i in END_USES_TYPES:
-            li = list(layers_in_out_tech.loc[layers_in_out_tech.loc[:, i] == 1, :].index)
-            TECHNOLOGIES_OF_END_USES_TYPE.append(li)
-
-        # STORAGE and INFRASTRUCTURES
-        ALL_TECH_OF_EUT = [item for sublist in TECHNOLOGIES_OF_END_USES_TYPE for item in sublist]
-
-        STORAGE_TECH = list(storage_eff_in.index)
-        INFRASTRUCTURE = [item for item in ALL_TECHS if item not in STORAGE_TECH and item not in ALL_TECH_OF_EUT]
-
-        # EVs
-        EVs_BATT = list(evs.loc[:, 'EVs_BATT'])
-        V2G = list(evs.index)
-
-        # STORAGE_OF_END_USES_TYPES ->  #METHOD 2 (using storage_eff_in)
-        STORAGE_OF_END_USES_TYPES_DHN = []
-        STORAGE_OF_END_USES_TYPES_DEC = []
-        STORAGE_OF_END_USES_TYPES_ELEC = []
-        STORAGE_OF_END_USES_TYPES_HIGH_T = []
-
-        for i in STORAGE_TECH:
-            if storage_eff_in.loc[i, 'HEAT_LOW_T_DHN'] > 0:
-                STORAGE_OF_END_USES_TYPES_DHN.append(i)
-            elif storage_eff_in.loc[i, 'HEAT_LOW_T_DECEN'] > 0:
-                STORAGE_OF_END_USES_TYPES_DEC.append(i)
-            elif storage_eff_in.loc[i, 'ELECTRICITY'] > 0:
-                STORAGE_OF_END_USES_TYPES_ELEC.append(i)
-            elif storage_eff_in.loc[i, 'HEAT_HIGH_T'] > 0:
-                STORAGE_OF_END_USES_TYPES_HIGH_T.append(i)
-
-        STORAGE_OF_END_USES_TYPES_ELEC.remove('BEV_BATT')
-        STORAGE_OF_END_USES_TYPES_ELEC.remove('PHEV_BATT')
-
-        # etc. still TS_OF_DEC_TECH and EVs_BATT_OF_V2G missing... -> hard coded !
-
-        COGEN = []
-        BOILERS = []
-
-        for i in ALL_TECH_OF_EUT:
-            if 'BOILER' in i:
-                BOILERS.append(i)
-            if 'COGEN' in i:
-                COGEN.append(i)
-
-        # Adding AMPL syntax #
-        # creating Batt_per_Car_df for printing
-        batt_per_car_df = evs[['batt_per_car']]
-        vehicule_capacity_df = evs[['vehicule_capacity']]
-        state_of_charge_ev = ampl_syntax(state_of_charge_ev, '')
-        loss_network_df = pd.DataFrame(data=loss_network.values(), index=loss_network.keys(), columns=[' '])
-        # Putting all the df in ampl syntax
-        batt_per_car_df = ampl_syntax(batt_per_car_df,
-                                      '# ev_batt,size [GWh]: Size of batteries per car per technology of EV')
-        vehicule_capacity_df = ampl_syntax(vehicule_capacity_df, '# km-pass/h/veh. : Gives the equivalence between '
-                                                                 'capacity and number of vehicles.')
-        eud_simple = ampl_syntax(eud_simple, '')
-        share_ned = ampl_syntax(share_ned, '')
-        layers_in_out = ampl_syntax(layers_in_out, '')
-        technologies_simple = ampl_syntax(technologies_simple, '')
-        technologies_simple[technologies_simple > 1e+14] = 'Infinity'
-        resources_simple = ampl_syntax(resources_simple, '')
-        resources_simple[resources_simple > 1e+14] = 'Infinity'
-        storage_eff_in = ampl_syntax(storage_eff_in, '')
-        storage_eff_out = ampl_syntax(storage_eff_out, '')
-        storage_characteristics = ampl_syntax(storage_characteristics, '')
-        loss_network_df = ampl_syntax(loss_network_df, '')
-
         # Printing data #
+        # The file is split into sections, each formatted by a function of DATA_SECTIONS from its inputs.
+        # If config['cache_dir'] is given, the formatted sections are cached there (keyed on the hash of their inputs)
+        # and only the sections whose inputs changed are formatted again (ex: resources in a sweep over gwp_op).
+        misc = data['Misc']
+        sets = get_model_data(config).sets()
+        section_cache = None if config.get('cache_dir') is None else Path(config['cache_dir']) / 'dat_sections'
+
         # printing signature of data file
         header_file = (Path(__file__).parent / 'headers' / 'header_data.txt')
-        print_header(header_file=header_file, dat_file=out_path)
-
-        # printing sets
-        print_set(SECTORS, 'SECTORS', out_path)
-        print_set(END_USES_INPUT, 'END_USES_INPUT', out_path)
-        print_set(END_USES_CATEGORIES, 'END_USES_CATEGORIES', out_path)
-        print_set(RESOURCES, 'RESOURCES', out_path)
-        print_set(RES_IMPORT_CONSTANT, 'RES_IMPORT_CONSTANT', out_path)
-        print_set(BIOFUELS, 'BIOFUELS', out_path)
-        print_set(RE_RESOURCES, 'RE_RESOURCES', out_path)
-        print_set(EXPORT, 'EXPORT', out_path)
-        newline(out_path)
-        n = 0
-        for j in END_USES_TYPES_OF_CATEGORY:
-            print_set(j, 'END_USES_TYPES_OF_CATEGORY' + '["' + END_USES_CATEGORIES[n] + '"]', out_path)
-            n += 1
-        newline(out_path)
-        n = 0
-        for j in TECHNOLOGIES_OF_END_USES_TYPE:
-            print_set(j, 'TECHNOLOGIES_OF_END_USES_TYPE' + '["' + END_USES_TYPES[n] + '"]', out_path)
-            n += 1
-        newline(out_path)
-        print_set(STORAGE_TECH, 'STORAGE_TECH', out_path)
-        print_set(INFRASTRUCTURE, 'INFRASTRUCTURE', out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Storage subsets'])
-        print_set(EVs_BATT, 'EVs_BATT', out_path)
-        print_set(V2G, 'V2G', out_path)
-        print_set(STORAGE_DAILY, 'STORAGE_DAILY', out_path)
-        newline(out_path)
-        print_set(STORAGE_OF_END_USES_TYPES_DHN, 'STORAGE_OF_END_USES_TYPES ["HEAT_LOW_T_DHN"]', out_path)
-        print_set(STORAGE_OF_END_USES_TYPES_DEC, 'STORAGE_OF_END_USES_TYPES ["HEAT_LOW_T_DECEN"]', out_path)
-        print_set(STORAGE_OF_END_USES_TYPES_ELEC, 'STORAGE_OF_END_USES_TYPES ["ELECTRICITY"]', out_path)
-        print_set(STORAGE_OF_END_USES_TYPES_HIGH_T, 'STORAGE_OF_END_USES_TYPES ["HEAT_HIGH_T"]', out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Link between storages & specific technologies	'])
-        # Hardcoded
-        print_set(['TS_DEC_HP_ELEC'], 'TS_OF_DEC_TECH ["DEC_HP_ELEC"]', out_path)
-        print_set(['TS_DEC_DIRECT_ELEC'], 'TS_OF_DEC_TECH ["DEC_DIRECT_ELEC"]', out_path)
-        print_set(['TS_DEC_THHP_GAS'], 'TS_OF_DEC_TECH ["DEC_THHP_GAS"]', out_path)
-        print_set(['TS_DEC_COGEN_GAS'], 'TS_OF_DEC_TECH ["DEC_COGEN_GAS"]', out_path)
-        print_set(['TS_DEC_ADVCOGEN_GAS'], 'TS_OF_DEC_TECH ["DEC_ADVCOGEN_GAS"]', out_path)
-        print_set(['TS_DEC_COGEN_OIL'], 'TS_OF_DEC_TECH ["DEC_COGEN_OIL"]', out_path)
-        print_set(['TS_DEC_ADVCOGEN_H2'], 'TS_OF_DEC_TECH ["DEC_ADVCOGEN_H2"]', out_path)
-        print_set(['TS_DEC_BOILER_GAS'], 'TS_OF_DEC_TECH ["DEC_BOILER_GAS"]', out_path)
-        print_set(['TS_DEC_BOILER_WOOD'], 'TS_OF_DEC_TECH ["DEC_BOILER_WOOD"]', out_path)
-        print_set(['TS_DEC_BOILER_OIL'], 'TS_OF_DEC_TECH ["DEC_BOILER_OIL"]', out_path)
-        print_set(['PHEV_BATT'], 'EVs_BATT_OF_V2G ["CAR_PHEV"]', out_path)
-        print_set(['BEV_BATT'], 'EVs_BATT_OF_V2G ["CAR_BEV"]', out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Additional sets, just needed for printing results	'])
-        print_set(COGEN, 'COGEN', out_path)
-        print_set(BOILERS, 'BOILERS', out_path)
-        newline(out_path)
-
-        # printing parameters
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# -----------------------------'])
-            writer.writerow(['# PARAMETERS NOT DEPENDING ON THE NUMBER OF TYPICAL DAYS : '])
-            writer.writerow(['# -----------------------------	'])
-            writer.writerow([''])
-            writer.writerow(['## PARAMETERS presented in Table 2.	'])
-        # printing i_rate, re_share_primary,gwp_limit,solar_area
-        print_param('i_rate', i_rate, 'part [2.7.4]', out_path)
-        print_param('re_share_primary', re_share_primary, 'Minimum RE share in primary consumption', out_path)
-        print_param('gwp_limit', gwp_limit, 'gwp_limit [ktCO2-eq./year]: maximum GWP emissions', out_path)
-        print_param('solar_area', solar_area, '', out_path)
-        print_param('power_density_pv', power_density_pv, 'PV : 1 kW/4.22m2   => 0.2367 kW/m2 => 0.2367 GW/km2',
-                    out_path)
-        print_param('power_density_solar_thermal', power_density_solar_thermal,
-                    'Solar thermal : 1 kW/3.5m2 => 0.2857 kW/m2 => 0.2857 GW/km2', out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Part [2.4]	'])
-        print_df('param:', batt_per_car_df, out_path)
-        newline(out_path)
-        print_df('param:', vehicule_capacity_df, out_path)
-        newline(out_path)
-        print_df('param state_of_charge_ev :', state_of_charge_ev, out_path)
-        newline(out_path)
-
-        # printing c_grid_extra and import_capacity
-        print_param('c_grid_extra', c_grid_extra,
-                    'cost to reinforce the grid due to intermittent renewable energy penetration. See 2.2.2', out_path)
-        print_param('import_capacity', import_capacity, '', out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# end_Uses_year see part [2.1]'])
-        print_df('param end_uses_demand_year : ', eud_simple, out_path)
-        newline(out_path)
-        print_param('share_mobility_public_min', share_mobility_public_min, '', out_path)
-        print_param('share_mobility_public_max', share_mobility_public_max, '', out_path)
-        newline(out_path)
-        print_param('share_freight_train_min', share_freight_train_min, '', out_path)
-        print_param('share_freight_train_max', share_freight_train_max, '', out_path)
-        newline(out_path)
-        print_param('share_freight_road_min', share_freight_road_min, '', out_path)
-        print_param('share_freight_road_max', share_freight_road_max, '', out_path)
-        newline(out_path)
-        print_param('share_freight_boat_min', share_freight_boat_min, '', out_path)
-        print_param('share_freight_boat_max', share_freight_boat_max, '', out_path)
-        newline(out_path)
-        print_param('share_heat_dhn_min', share_heat_dhn_min, '', out_path)
-        print_param('share_heat_dhn_max', share_heat_dhn_max, '', out_path)
-        newline(out_path)
-        print_df('param:', share_ned, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Link between layers  (data from Tables 19,21,22,23,25,29,30)'])
-        print_df('param layers_in_out : ', layers_in_out, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(
-                ['# Technologies data from Tables (10,19,21,22,23,25,27,28,29,30) and part [2.2.1.1] for hydro'])
-        print_df('param :', technologies_simple, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# RESOURCES: part [2.5] (Table 26)'])
-        print_df('param :', resources_simple, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(
-                ['# Storage inlet/outlet efficiency : part [2.6] (Table 28) and part [2.2.1.1] for hydro.	'])
-        print_df('param storage_eff_in :', storage_eff_in, out_path)
-        newline(out_path)
-        print_df('param storage_eff_out :', storage_eff_out, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# Storage characteristics : part [2.6] (Table 28) and part [2.2.1.1] for hydro.'])
-        print_df('param :', storage_characteristics, out_path)
-        newline(out_path)
-        with open(out_path, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['# [A.6]'])
-        print_df('param loss_network ', loss_network_df, out_path)
+        dat = DatWriter(out_path, formatters=DATA_SECTIONS)
+        dat.header(header_file)
+
+        dat.cached_section('sets', section_cache, sets=sets)
+        dat.cached_section('misc_params', section_cache, misc={k: misc[k] for k in MISC_PARAMS}, gwp_limit=gwp_limit)
+        dat.cached_section('evs', section_cache, evs=misc['evs'], state_of_charge_ev=misc['state_of_charge_ev'])
+        dat.cached_section('network', section_cache, c_grid_extra=misc['c_grid_extra'],
+                           import_capacity=misc['import_capacity'])
+        dat.cached_section('demand', section_cache, eud=eud)
+        dat.cached_section('shares', section_cache, shares={k: misc[k] for k in SHARE_PARAMS},
+                           share_ned=misc['share_ned'])
+        dat.cached_section('layers_in_out', section_cache, layers_in_out=layers_in_out,
+                           sparse=config.get('sparse_layers_in_out', False))
+        dat.cached_section('technologies', section_cache, technologies=technologies)
+        dat.cached_section('resources', section_cache, resources=resources)
+        dat.cached_section('storage', section_cache, storage_eff_in=storage_eff_in, storage_eff_out=storage_eff_out,
+                           storage_characteristics=storage_characteristics)
+        dat.cached_section('loss_network', section_cache, loss_network=misc['loss_network'])
+        if section_cache is not None:
+            logging.info('Formatted sections: ' + (', '.join(dat.formatted) if dat.formatted else 'none (all cached)'))
+
+        # writing the whole file at once
+        dat.flush()
 
     if config['printing_td']:
-
-        out_path = cs / config['case_study']  # config['es_path']
         nbr_td = config['nbr_td']
+        out_path = cs / config['case_study'] / ('ESTD_' + str(nbr_td) + 'TD.dat')
+        if config.get('cache_dir') is None:
+            logging.info('Printing ESTD_' + str(nbr_td) + 'TD.dat')
+            print_td_data(config, out_path)
+        else:
+            # the TD file is shared by all the case studies with the same time series and typical days
+            cached = Path(config['cache_dir']) / 'td' / (out_path.stem + '_' + td_data_key(config)[:16] + '.dat')
+            if cached.is_file():
+                logging.info('Using cached ' + cached.name)
+                config['td_data'] = generate_t_h_td(config)
+            else:
+                logging.info('Printing ' + cached.name)
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                # read-only, as it is shared by the case studies through hardlinks
+                print_td_data(config, cached, mode=0o444)
+            link_file(cached, out_path)
+
+    return
 
-        logging.info('Printing ESTD_' + str(nbr_td) + 'TD.dat')
-
-        # DICTIONARIES TO TRANSLATE NAMES INTO AMPL SYNTAX #
-        # TODO automatise
-        # for EUD timeseries
-        eud_params = {'Electricity (%_elec)': 'param electricity_time_series :',
-                      'Space Heating (%_sh)': 'param heating_time_series :',
-                      'Passanger mobility (%_pass)': 'param mob_pass_time_series :',
-                      'Freight mobility (%_freight)': 'param mob_freight_time_series :'}
-        # for resources timeseries that have only 1 tech linked to it
-        res_params = {'PV': 'PV', 'Wind_onshore': 'WIND_ONSHORE', 'Wind_offshore': 'WIND_OFFSHORE',
-                      'Hydro_river': 'HYDRO_RIVER'}
-        # for resources timeseries that have several techs linked to it
-        res_mult_params = {'Solar': ['DHN_SOLAR', 'DEC_SOLAR']}
-
-        # Redefine the output file from the out_path given #
-        out_path = out_path / ('ESTD_' + str(nbr_td) + 'TD.dat')
-
-        # READING OUTPUT OF STEP1 #
-        td_data = generate_t_h_td(config)
-        config['td_data'] = td_data
-
-        # COMPUTING NUMBER OF DAYS REPRESENTED BY EACH TD #
-        sorted_td = td_data['td_count'].copy()
-
-        # BUILDING T_H_TD MATRICE #
-        # generate T_H_TD
-        t_h_td = td_data['t_h_td'].copy()
-        # giving the right syntax for AMPL
-        t_h_td['par_g'] = '('
-        t_h_td['par_d'] = ')'
-        t_h_td['comma1'] = ','
-        t_h_td['comma2'] = ','
-        # giving the right order to the columns
-        t_h_td = t_h_td[['par_g', 'H_of_Y', 'comma1', 'H_of_D', 'comma2', 'TD_number', 'par_d']]
-
-        # COMPUTING THE NORM OVER THE YEAR ##
-        norm = time_series.sum(axis=0)
-        norm.index.rename('Category', inplace=True)
-        norm.name = 'Norm'
-
-        # BUILDING TD TIMESERIES #
-        # creating df with 2 columns : day of the year | hour in the day
-        d_of_h = np.repeat(np.arange(1, 366, 1), 24, axis=0)  # 24 times each day of the year
-        h_of_d = np.resize(np.arange(1, 25), 24 * 365)  # 365 times hours from 1 to 24
-        day_and_hour = pd.DataFrame(np.vstack((d_of_h, h_of_d)).T, index=np.arange(1, 8761, 1),
-                                    columns=['D_of_H', 'H_of_D'])
-        day_and_hour = day_and_hour.astype('int64')
-        time_series = time_series.merge(day_and_hour, left_index=True, right_index=True)
-
-        # selecting time series of TD only
-        td_ts = time_series[time_series['D_of_H'].isin(sorted_td['TD_of_days'])]
-
-        # COMPUTING THE NORM_TD OVER THE YEAR FOR CORRECTION #
-        # computing the sum of ts over each TD
-        agg_td_ts = td_ts.groupby('D_of_H').sum()
-        agg_td_ts.reset_index(inplace=True)
-        agg_td_ts.drop(columns=['D_of_H', 'H_of_D'], inplace=True)
-        # multiplicating each TD by the number of day it represents
-        for c in agg_td_ts.columns:
-            agg_td_ts[c] = agg_td_ts[c] * sorted_td['#days']
-        # sum of new ts over the whole year
-        norm_td = agg_td_ts.sum()
-
-        # BUILDING THE DF WITH THE TS OF EACH TD FOR EACH CATEGORY #
-        # pivoting TD_ts to obtain a (24,Nbr_TD*Nbr_ts*N_c)
-        all_td_ts = td_ts.pivot(index='H_of_D', columns='D_of_H')
-
-        # COMPUTE peak_sh_factor #
-        max_sh_td = td_ts.loc[:, 'Space Heating (%_sh)'].max()
-        max_sh_all = time_series.loc[:, 'Space Heating (%_sh)'].max()
-        peak_sh_factor = max_sh_all / max_sh_td
-
-        # PRINTING #
-        # printing description of file
-        header_file = (Path(__file__).parent / 'headers' / 'header_12td.txt')
-        print_header(header_file=header_file, dat_file=out_path)
-
-        # printing sets and parameters
-        with open(out_path, mode='a', newline='') as td_file:
-            td_writer = csv.writer(td_file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-
-            # print nbr_tds param
-            td_writer.writerow(['param nbr_tds := ' + str(nbr_td)])
-            td_writer.writerow([';		'])
-            td_writer.writerow(['		'])
-            # peak_sh_factor
-            td_writer.writerow(['param peak_sh_factor	:=	' + str(peak_sh_factor)])
-            td_writer.writerow([';		'])
-            td_writer.writerow(['		'])
-
-            # printing T_H_TD param
-            td_writer.writerow(['#SETS [Figure 3]		'])
-            td_writer.writerow(['set T_H_TD := 		'])
-
-        t_h_td.to_csv(out_path, sep='\t', header=False, index=False, mode='a', quoting=csv.QUOTE_NONE)
-
-        # printing interlude
-        with open(out_path, mode='a', newline='') as td_file:
-            td_writer = csv.writer(td_file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-
-            td_writer.writerow([';'])
-            td_writer.writerow([''])
-            td_writer.writerow(['# -----------------------------'])
-            td_writer.writerow(['# PARAMETERS DEPENDING ON NUMBER OF TYPICAL DAYS : '])
-            td_writer.writerow(['# -----------------------------'])
-            td_writer.writerow([''])
-
-        # printing EUD timeseries param
-        for k in eud_params.keys():
-            ts = all_td_ts[k]
-            ts.columns = np.arange(1, nbr_td + 1)
-            ts = ts * norm[k] / norm_td[k]
-            ts.fillna(0, inplace=True)
-
-            ts = ampl_syntax(ts, '')
-            print_df(eud_params[k], ts, out_path)
-            newline(out_path)
-
-        # printing c_p_t param #
-        with open(out_path, mode='a', newline='') as td_file:
-            td_writer = csv.writer(td_file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
-            td_writer.writerow(['param c_p_t:='])
-            # printing c_p_t part where 1 ts => 1 tech
-        for k in res_params.keys():
-            ts = all_td_ts[k]
-            ts.columns = np.arange(1, nbr_td + 1)
-            ts = ts * norm[k] / norm_td[k]
-            ts.fillna(0, inplace=True)
-
-            ts = ampl_syntax(ts, '')
-            s = '["' + res_params[k] + '",*,*]:'
-            ts.to_csv(out_path, sep='\t', mode='a', header=True, index=True, index_label=s, quoting=csv.QUOTE_NONE)
-            newline(out_path)
-
-        # printing c_p_t part where 1 ts => more then 1 tech
-        for k in res_mult_params.keys():
-            for j in res_mult_params[k]:
-                ts = all_td_ts[k]
-                ts.columns = np.arange(1, nbr_td + 1)
-                ts = ts * norm[k] / norm_td[k]
-                ts.fillna(0, inplace=True)
-                ts = ampl_syntax(ts, '')
-                s = '["' + j + '",*,*]:'
-                ts.to_csv(out_path, sep='\t', mode='a', header=True, index=True, index_label=s, quoting=csv.QUOTE_NONE)
 
+def td_data_key(config):
+    """
+    Compute the key of the ESTD_<nbr_td>TD.dat of config in the cache (see print_data).
+    The key is the hash of the time series, the number of TDs and the content of td_of_days.out, the only inputs of
+    the file (the weights of the clustering only act through td_of_days.out). It is also the key of the base typical
+    days of the layered data mode.
+    """
+    return hash_inputs(config['all_data']['Time_series'], config['nbr_td'], file_hash(td_of_days_path(config)))
+
+
+def compute_td_series(config):
+    """
+    Compute the data depending on the typical days from the time series of config['all_data'] and the typical days of
+    step1 (td_of_days.out, see td_of_days_path). The result of generate_t_h_td is also stored into config['td_data'].
+
+    Returns
+    -------
+    Dictionary with the keys 'td_data' (see generate_t_h_td), 'peak_sh_factor', 'names' (names of the time series)
+    and 'td_ts' ((n_ts, 24, nbr_td) array of the time series of the TDs rescaled to keep their sum over the year).
+    """
+    time_series = config['all_data']['Time_series']
+
+    # READING OUTPUT OF STEP1 #
+    td_data = generate_t_h_td(config)
+    config['td_data'] = td_data
+
+    # COMPUTING NUMBER OF DAYS REPRESENTED BY EACH TD #
+    sorted_td = td_data['td_count']
+
+    # COMPUTING THE NORM OVER THE YEAR ##
+    norm = time_series.sum(axis=0)
+
+    # BUILDING TD TIMESERIES #
+    # (n_ts, 24, nbr_td) array of the time series of the TDs (the year is 365 days of 24 hours)
+    year = time_series.to_numpy(dtype=np.float64).reshape(365, 24, -1)
+    td_ts = year[sorted_td['TD_of_days'].to_numpy() - 1].transpose(2, 1, 0)
+
+    # COMPUTING THE NORM_TD OVER THE YEAR FOR CORRECTION #
+    # sum of the ts over each TD multiplied by the number of days it represents, summed over the TDs
+    norm_td = (_kahan_sum(td_ts, axis=1) * sorted_td['#days'].to_numpy()).sum(axis=1)
+
+    # COMPUTE peak_sh_factor #
+    sh = time_series.columns.get_loc('Space Heating (%_sh)')
+    peak_sh_factor = year[:, :, sh].max() / td_ts[sh].max()
+
+    # rescaling all the ts at once to keep their sum over the year
+    with np.errstate(divide='ignore', invalid='ignore'):
+        td_ts = td_ts * norm.to_numpy(dtype=np.float64)[:, None, None] / norm_td[:, None, None]
+    td_ts[np.isnan(td_ts)] = 0
+
+    return {'td_data': td_data, 'peak_sh_factor': peak_sh_factor, 'names': list(time_series.columns),
+            'td_ts': td_ts}
+
+
+def print_td_data(config, out_path, mode=None):
+    """
+    Print the data depending on the typical days (ESTD_<nbr_td>TD.dat) into out_path,
+    from the time series of config['all_data'] and the typical days of step1 (td_of_days.out, see td_of_days_path).
+    The file is streamed by parts (see iter_td_data) into a temporary file moved into place with os.replace, so that
+    a hardlink at out_path (ex: to the cache, see print_data) is replaced instead of being written through.
+    If mode is given, the permissions of the file are set to mode (ex: 0o444 for read-only).
+    """
+    tmp_fn = tmp_path(out_path)
+    with open(tmp_fn, mode='w', newline='') as file:
+        for text in iter_td_data(config):
+            file.write(text)
+    if mode is not None:
+        os.chmod(tmp_fn, mode)
+    replace_file(tmp_fn, out_path)
     return
 
 
+def iter_td_data(config):
+    """
+    Generator of the text of ESTD_<nbr_td>TD.dat by parts (header, T_H_TD by chunks of hours, then one part per
+    parameter block), to stream the file with a bounded memory when the number of TDs is large (up to 365).
+    Only the (n_ts, 24, nbr_td) array of the TDs is built (see compute_td_series), no wide table.
+    """
+    nbr_td = config['nbr_td']
+    td_series = compute_td_series(config)
+    peak_sh_factor = td_series['peak_sh_factor']
+
+    # PRINTING #
+    # printing description of file
+    header_file = (Path(__file__).parent / 'headers' / 'header_12td.txt')
+    dat = DatWriter()
+    dat.header(header_file)
+
+    # printing sets and parameters
+    # print nbr_tds param
+    dat.row('param nbr_tds := ' + str(nbr_td))
+    dat.row(';		')
+    dat.row('		')
+    # peak_sh_factor
+    dat.row('param peak_sh_factor	:=	' + str(peak_sh_factor))
+    dat.row(';		')
+    dat.row('		')
+
+    # printing T_H_TD param
+    dat.row('#SETS [Figure 3]		')
+    dat.row('set T_H_TD := 		')
+    yield dat.drain()
+    yield from _iter_t_h_td(td_series['td_data']['t_h_td'])
+
+    # printing interlude
+    dat.row(';')
+    dat.row('')
+    dat.row('# -----------------------------')
+    dat.row('# PARAMETERS DEPENDING ON NUMBER OF TYPICAL DAYS : ')
+    dat.row('# -----------------------------')
+    dat.row('')
+    yield dat.drain()
+
+    # printing EUD timeseries and c_p_t params
+    yield from _iter_td_series(dat, td_series['names'], td_series['td_ts'])
+
+
 def generate_t_h_td(config):
     """Generate t_h_td and td_count dataframes and assign it to each region
     t_h_td is a pd.DataFrame containing 4 columns:
@@ -527,7 +664,7 @@ def generate_t_h_td(config):
     """
 
     # Reading td_of_days
-    td_of_days = pd.read_csv(config['step1_path'] / 'td_of_days.out', names=['TD_of_days'])
+    td_of_days = pd.read_csv(td_of_days_path(config), names=['TD_of_days'])
     td_of_days['day'] = np.arange(1, 366, 1)  # putting the days of the year beside
 
     # COMPUTING NUMBER OF DAYS REPRESENTED BY EACH TD AND ASSIGNING A TD NUMBER TO EACH REPRESENTATIVE DAY
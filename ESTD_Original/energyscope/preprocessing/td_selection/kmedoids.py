@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+This script contains a k-medoids clustering of the days of the year in pure numpy (FasterPAM),
+as an alternative to the MILP of td_main.mod solved with AMPL and cplex.
+
+The days are clustered with the same objective as td_main.mod: the sum over the days of the squared euclidean
+distance between the day and the typical day (medoid) representing it.
+"""
+
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import pandas as pd
+
+
+def distance_matrix(n_data):
+    """
+    Squared euclidean distance between each pair of days (Distance of td_main.mod), computed as
+    ||x||^2 + ||y||^2 - 2 x.y
+
+    Parameters
+    ----------
+    n_data: pd.DataFrame or np.ndarray
+    Weighted normalized daily time series of shape (365x(n_ts*24)) (see weight).
+
+    Returns
+    -------
+    np.ndarray of shape (365x365)
+    """
+    x = np.asarray(n_data, dtype=np.float64)
+    sq = np.einsum('ij,ij->i', x, x)
+    dist = sq[:, None] + sq[None, :] - 2 * (x @ x.T)
+    # removing the rounding errors (the distance of a day to itself is 0 and distances are positive)
+    np.fill_diagonal(dist, 0)
+    return np.maximum(dist, 0, out=dist)
+
+
+def _nearest(dist, medoids):
+    # distance to the nearest and second nearest medoids and index (in medoids) of the nearest one
+    d = dist[:, medoids]
+    order = np.argsort(d, axis=1)[:, :2]
+    rows = np.arange(d.shape[0])
+    return d[rows, order[:, 0]], d[rows, order[:, 1]], order[:, 0]
+
+
+def _init_medoids(dist, k, rng):
+    # k-means++ like seeding: each new medoid is drawn with a probability proportional to its distance to the nearest
+    # medoid already selected
+    n = dist.shape[0]
+    medoids = [rng.integers(n)]
+    d1 = dist[:, medoids[0]].copy()
+    for _ in range(1, k):
+        p = d1 / d1.sum() if d1.sum() > 0 else None
+        m = rng.choice(n, p=p)
+        while m in medoids:
+            m = rng.choice(n)
+        medoids.append(m)
+        d1 = np.minimum(d1, dist[:, m])
+    return np.array(medoids)
+
+
+def _add_medoids(dist, medoids, k):
+    # greedy completion of medoids up to k medoids (BUILD step of PAM): each new medoid is the day decreasing the most
+    # the objective
+    medoids = list(medoids)
+    d1 = dist[:, medoids].min(axis=1) if medoids else np.full(dist.shape[0], np.inf)
+    while len(medoids) < k:
+        obj = np.minimum(d1[:, None], dist).sum(axis=0)
+        obj[medoids] = np.inf
+        m = np.argmin(obj)
+        medoids.append(m)
+        d1 = np.minimum(d1, dist[:, m])
+    return np.array(medoids)
+
+
+def fasterpam(dist, k, medoids=None, max_iter=100, rng=None):
+    """
+    Swap phase of FasterPAM (Schubert and Rousseeuw, 2021): the first improving swap of a medoid with a non-medoid is
+    applied (eager swaps), the best medoid to remove being found for each candidate in O(n).
+
+    Parameters
+    ----------
+    dist: np.ndarray
+    Distance matrix (nxn).
+
+    k: int
+    Number of medoids.
+
+    medoids: array-like
+    Initial medoids (default: random seeding with rng).
+
+    max_iter: int
+    Maximum number of passes over the candidates.
+
+    rng: np.random.Generator
+
+    Returns
+    -------
+    medoids (np.ndarray of k indices), labels (index in medoids of the medoid of each point) and the objective
+    (sum of the distances of the points to their medoid).
+    """
+    n = dist.shape[0]
+    rng = np.random.default_rng() if rng is None else rng
+    medoids = _init_medoids(dist, k, rng) if medoids is None else np.array(medoids)
+    if k == 1:
+        m = np.argmin(dist.sum(axis=0))
+        return np.array([m]), np.zeros(n, dtype=int), dist[:, m].sum()
+
+    d1, d2, nearest = _nearest(dist, medoids)
+    is_medoid = np.zeros(n, dtype=bool)
+    is_medoid[medoids] = True
+    for _ in range(max_iter):
+        swapped = False
+        for x in rng.permutation(n):
+            if is_medoid[x]:
+                continue
+            # loss of removing each medoid (the points go to their second nearest medoid)
+            removal_loss = np.bincount(nearest, weights=d2 - d1, minlength=k)
+            dx = dist[:, x]
+            closer = dx < d1
+            # points going to x whatever the medoid removed
+            shared = np.sum(dx[closer] - d1[closer])
+            # points of the removed medoid that do not go to x but stay closer to x than to their second nearest
+            acc = removal_loss
+            acc += np.bincount(nearest[closer], weights=(d1 - d2)[closer], minlength=k)
+            second = ~closer & (dx < d2)
+            acc += np.bincount(nearest[second], weights=(dx - d2)[second], minlength=k)
+            delta = shared + acc
+            i = np.argmin(delta)
+            # improving swap (up to the rounding errors relative to the objective)
+            if delta[i] < -1e-12 * d1.sum():
+                is_medoid[medoids[i]] = False
+                is_medoid[x] = True
+                medoids[i] = x
+                d1, d2, nearest = _nearest(dist, medoids)
+                swapped = True
+        if not swapped:
+            break
+    return medoids, nearest, d1.sum()
+
+
+def _best_of(dist, k, n_init, rng):
+    # best of n_init runs of fasterpam with random initial medoids
+    best = None
+    for _ in range(n_init):
+        medoids, labels, obj = fasterpam(dist, k, rng=rng)
+        if best is None or obj < best[2]:
+            best = (medoids, labels, obj)
+    return best
+
+
+def lagrangian_bound(dist, k, ub, max_iter=300):
+    """
+    Lower bound of the objective of td_main.mod (p-median problem) by Lagrangian relaxation of the assignment of each
+    day to exactly one typical day, maximized by subgradient ascent on the multipliers.
+
+    Parameters
+    ----------
+    dist: np.ndarray
+    Distance matrix of the days (see distance_matrix).
+
+    k: int
+    Number of medoids (typical days).
+
+    ub: float
+    Objective of a feasible clustering, used for the step size.
+
+    max_iter: int
+    Maximum number of subgradient iterations.
+
+    Returns
+    -------
+    The best lower bound found (float).
+    """
+    # initial multipliers: distance of each day to the nearest other day
+    lam = np.partition(dist, 1, axis=1)[:, 1].copy()
+    best = 0.
+    theta = 2.
+    stall = 0
+    for _ in range(max_iter):
+        # the days i are assigned to the medoid j if d_ij < lam_i, the k medoids with the lowest reduced costs are kept
+        reduced = np.minimum(dist - lam[:, None], 0)
+        rho = reduced.sum(axis=0)
+        selected = np.argpartition(rho, k - 1)[:k]
+        value = lam.sum() + rho[selected].sum()
+        if value > best:
+            best = value
+            stall = 0
+        else:
+            stall += 1
+            if stall >= 20:
+                theta /= 2
+                stall = 0
+        # subgradient: 1 - number of medoids each day is assigned to
+        g = 1 - (reduced[:, selected] < 0).sum(axis=1)
+        if not g.any() or ub - best <= 1e-9 * ub or theta < 1e-4:
+            break
+        lam = lam + theta * max(ub - value, 1e-9 * ub) / (g @ g) * g
+    return best
+
+
+_dist = None
+
+
+def _init_worker(dist):
+    # distance matrix shared by the restarts of a worker process
+    global _dist
+    _dist = dist
+
+
+def _restart(k, seed):
+    # one restart of fasterpam in a worker process
+    return fasterpam(_dist, k, rng=np.random.default_rng(seed))
+
+
+def _restarts(dist, k, seeds, n_jobs, deadline):
+    # (index of the seed, result of fasterpam) for each seed (in any order with n_jobs > 1), until the deadline once a
+    # result is given
+    if n_jobs == 1:
+        for i, seed in enumerate(seeds):
+            if i > 0 and deadline is not None and time.time() >= deadline:
+                return
+            yield i, fasterpam(dist, k, rng=np.random.default_rng(seed))
+        return
+    executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(dist,))
+    futures = {executor.submit(_restart, k, seed): i for i, seed in enumerate(seeds)}
+    pending = set(futures)
+    n_done = 0
+    try:
+        while pending:
+            timeout = None if deadline is None or n_done == 0 else max(deadline - time.time(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                n_done += 1
+                yield futures[f], f.result()
+            if deadline is not None and n_done > 0 and time.time() >= deadline:
+                return
+    finally:
+        # on an early stop (deadline, gap or error), the pending restarts are cancelled and the running ones are
+        # not waited for (Future.cancel rather than shutdown(cancel_futures=True), which needs python 3.9)
+        for f in pending:
+            f.cancel()
+        executor.shutdown(wait=not pending)
+
+
+def kmedoids(n_data, nbr_td, n_init=10, seed=0, dist=None, n_jobs=1, gap=0., time_budget=None):
+    """
+    Cluster the days into nbr_td typical days with FasterPAM, keeping the best of n_init seeded restarts.
+    The restarts can run in a pool of n_jobs processes and stop early once the best objective is within gap of a
+    lower bound of the MILP (see lagrangian_bound) or after time_budget seconds.
+
+    Parameters
+    ----------
+    n_data: pd.DataFrame
+    Weighted normalized daily time series of shape (365x(n_ts*24)) (see weight).
+
+    nbr_td: int
+    Number of typical days.
+
+    n_init: int
+    Number of restarts (with different random initial medoids).
+
+    seed: int
+    Seed of the random generator (the result is reproducible for a given seed, whatever n_jobs, gap and
+    time_budget, if the restarts are not stopped early).
+
+    dist: np.ndarray
+    Distance matrix of n_data, computed if not given (see distance_matrix).
+
+    n_jobs: int
+    Number of processes running the restarts (None: number of CPUs, 1: no process pool).
+
+    gap: float
+    Relative gap to the lower bound under which the remaining restarts are cancelled.
+
+    time_budget: float
+    Time (s) after which the remaining restarts are cancelled (None: no limit).
+
+    Returns
+    -------
+    td_of_days: pd.DataFrame with one column giving for each day of the year the day (1 to 365) representing it,
+    as read from the td_of_days.out of the MILP, the objective of the clustering, whether the n_init restarts all
+    ran (False if they were stopped early by gap or time_budget) and the relative gap of the objective to the lower
+    bound.
+    """
+    start = time.time()
+    dist = distance_matrix(n_data) if dist is None else dist
+    # lower bound, with the greedy medoids (BUILD step) as first feasible clustering
+    medoids = _add_medoids(dist, [], nbr_td)
+    lb = lagrangian_bound(dist, nbr_td, dist[:, medoids].min(axis=1).sum())
+    deadline = None if time_budget is None else start + time_budget
+
+    best = None
+    n_runs = 0
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    seeds = np.random.SeedSequence(seed).spawn(n_init)
+    for i, (medoids, labels, obj) in _restarts(dist, nbr_td, seeds, n_jobs, deadline):
+        n_runs += 1
+        # ties broken on the index of the seed, so that the result does not depend on the order of completion
+        if best is None or (obj, i) < (best[2], best[3]):
+            best = (medoids, labels, obj, i)
+        if best[2] - lb <= gap * best[2]:
+            break
+    medoids, labels, obj, _ = best
+    obj_gap = (obj - lb) / obj
+    logging.info('kmedoids: objective ' + str(obj) + ' (best of ' + str(n_runs) + ' restarts), lower bound '
+                 + str(lb) + ', gap ' + str(obj_gap) + ', ' + str(round(time.time() - start, 2)) + ' s')
+    return pd.DataFrame(medoids[labels] + 1), obj, n_runs == n_init, obj_gap
+
+
+def kmedoids_sweep(dist, nbr_tds, n_init=10, seed=0):
+    """
+    Cluster the days for several numbers of typical days with FasterPAM. The smallest number of typical days is
+    clustered with n_init restarts, the medoids of each number of typical days are then the initial medoids of the
+    next one, completed greedily (warm start).
+
+    Parameters
+    ----------
+    dist: np.ndarray
+    Distance matrix of the days (see distance_matrix).
+
+    nbr_tds: iterable of int
+    Numbers of typical days.
+
+    n_init: int
+    Number of restarts for the smallest number of typical days.
+
+    seed: int
+    Seed of the random generator.
+
+    Returns
+    -------
+    Dictionary {nbr_td: (td_of_days, objective)} with td_of_days the np.ndarray giving for each day of the year the day
+    (1 to 365) representing it.
+    """
+    rng = np.random.default_rng(seed)
+    results = dict()
+    medoids = None
+    for k in sorted(set(nbr_tds)):
+        if medoids is None:
+            medoids, labels, obj = _best_of(dist, k, n_init, rng)
+        else:
+            medoids, labels, obj = fasterpam(dist, k, medoids=_add_medoids(dist, medoids, k), rng=rng)
+        logging.info('kmedoids: ' + str(k) + ' TDs, objective ' + str(obj))
+        results[k] = (medoids[labels] + 1, obj)
+    return results
+
+
+def clustering_objective(dist, td_of_days):
+    """Objective of td_main.mod (sum of the distances of the days to their typical day) of an assignment"""
+    td = np.asarray(td_of_days).ravel() - 1
+    return dist[np.arange(dist.shape[0]), td].sum()
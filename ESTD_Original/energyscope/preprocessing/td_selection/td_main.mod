@@ -27,13 +27,12 @@
 ############################
 ###  MILP formulation    ###
 ############################
-set DIMENSIONS ;		# Number of input data per day (24h x nbr of time series)
 set DAYS := 1 .. 365;			# Number of days 
 
 ### parameters
 param Nbr_TD default 12; 				#Number of TD days
-param Ndata{DAYS,DIMENSIONS}; 			#Input data (already normalized)
-param Distance{i in DAYS,j in DAYS} := sum{k in DIMENSIONS}((Ndata[i,k]-Ndata[j,k])*(Ndata[i,k]-Ndata[j,k])) ; # Distance matrix.
+param Distance_half{i in DAYS, j in DAYS: i <= j}; 		#Distance matrix (upper half), computed from the normalized input data in python
+param Distance{i in DAYS,j in DAYS} := if i <= j then Distance_half[i,j] else Distance_half[j,i]; # Distance matrix.
 
 ### Variables
 var Selected_TD {DAYS} 				binary;# default 0; #which are the typical days 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+This script contains the evaluation of how well the typical days represent the year.
+
+The yearly time series are rebuilt from the typical days with one gather (np.take) for all the time series at once,
+and compared with the actual ones (energy, peak, ramps, duration curve and correlation between the time series).
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def year_index(t_h_td):
+    """
+    Hour of the year (0 to 8759) of the typical day representing each hour of the year.
+
+    Parameters
+    ----------
+    t_h_td: pd.DataFrame or array-like
+    t_h_td as generated by generate_t_h_td (columns TD_of_days and H_of_D) or td_of_days (the day (1 to 365)
+    representing each day of the year, as read from td_of_days.out).
+
+    Returns
+    -------
+    np.ndarray of 8760 indices
+    """
+    if isinstance(t_h_td, pd.DataFrame) and 'TD_of_days' in t_h_td.columns:
+        return (t_h_td['TD_of_days'].to_numpy() - 1) * 24 + t_h_td['H_of_D'].to_numpy() - 1
+    td_of_days = np.asarray(t_h_td).ravel() - 1
+    return (td_of_days[:, None] * 24 + np.arange(24)).ravel()
+
+
+def rebuild_year(ts, t_h_td):
+    """
+    Rebuild the yearly time series from the typical days: each hour of the year takes the value of the same hour of
+    its typical day.
+
+    Parameters
+    ----------
+    ts: pd.DataFrame or np.ndarray
+    Yearly time series of shape (8760xN_ts).
+
+    t_h_td: pd.DataFrame or array-like
+    Typical days of the year (see year_index).
+
+    Returns
+    -------
+    np.ndarray of shape (8760xN_ts)
+    """
+    return np.take(np.asarray(ts, dtype=np.float64), year_index(t_h_td), axis=0)
+
+
+def td_quality(ts, t_h_td):
+    """
+    Errors of the yearly time series rebuilt from the typical days (see rebuild_year), before the rescaling of the
+    typical days done when printing ESTD_<nbr_td>TD.dat.
+
+    Parameters
+    ----------
+    ts: pd.DataFrame
+    Yearly time series of shape (8760xN_ts) (ex: config['all_data']['Time_series']).
+
+    t_h_td: pd.DataFrame or array-like
+    Typical days of the year (see year_index).
+
+    Returns
+    -------
+    errors: pd.DataFrame indexed by the time series with the relative errors on the yearly energy ('energy'), the
+    peak ('peak') and the maximum hourly ramp ('ramp') and the error on the duration curve ('duration_curve', sum of
+    the absolute differences between the sorted hourly values, relative to the yearly energy).
+    corr_error: pd.DataFrame of shape (N_ts x N_ts), difference between the correlation matrices of the rebuilt and
+    the actual time series.
+    """
+    actual = np.asarray(ts, dtype=np.float64)
+    rebuilt = rebuild_year(actual, t_h_td)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = actual.sum(axis=0)
+        energy = rebuilt.sum(axis=0) / total - 1
+        peak = rebuilt.max(axis=0) / actual.max(axis=0) - 1
+        ramp = np.abs(np.diff(rebuilt, axis=0)).max(axis=0) / np.abs(np.diff(actual, axis=0)).max(axis=0) - 1
+        duration_curve = np.abs(np.sort(rebuilt, axis=0) - np.sort(actual, axis=0)).sum(axis=0) / total
+        corr_error = np.corrcoef(rebuilt, rowvar=False) - np.corrcoef(actual, rowvar=False)
+
+    names = ts.columns if isinstance(ts, pd.DataFrame) else None
+    errors = pd.DataFrame({'energy': energy, 'peak': peak, 'ramp': ramp, 'duration_curve': duration_curve},
+                          index=names)
+    return errors, pd.DataFrame(corr_error, index=names, columns=names)
@@ -7,14 +7,19 @@ This function proceeds to the clustering according to a given number of typical
 
 import os
 import logging
+import shutil
+import tempfile
 import numpy as np
 import pandas as pd
-import sys
 from pathlib import Path
 from subprocess import CalledProcessError, run
 
 
-from energyscope import ampl_syntax, print_set, print_df, newline, print_param, print_header, print_run
+from energyscope import ampl_syntax, print_df, newline, print_param, print_header, print_run, hash_inputs
+from ..es_pre.es_model_data import ModelData, get_model_data
+from ..es_pre.es_data_store import evict_lru, link_file, replace_file, tmp_path
+from .kmedoids import distance_matrix, kmedoids, kmedoids_sweep, clustering_objective
+from .td_quality import year_index, rebuild_year, td_quality
 
 
 def build_td_of_days(config):
@@ -30,27 +35,202 @@ def build_td_of_days(config):
     Returns
     ----------
     Returns none.
-    Creates the .dat files 'td_of_days.out' and 'TD_of_days_XX.out' in the
-    data_dir directory
+    Creates the file 'td_of_days.out' in the directory of the case study (config['cs_path']/config['case_study'])
+    and stores its path into config['td_of_days_path'], where print_data reads it (see td_of_days_path).
+    Nothing is written into the shared step1_path, so that several builds can run concurrently.
+
+    The clustering is the MILP td_main.mod solved with AMPL and cplex (config['td_clustering'] = 'ampl', default)
+    or FasterPAM in numpy with config['td_n_init'] seeded restarts (config['td_clustering'] = 'kmedoids', see
+    kmedoids), run by config['td_n_jobs'] processes and stopped once within config['td_gap'] of a lower bound or
+    after config['td_time_budget'] seconds. If config['td_exact_check'] is True, the MILP is also solved to log the
+    gap of the heuristic.
+    If config['cache_dir'] is given, the result is cached in cache_dir/td_of_days (see td_of_days_key) and
+    td_of_days.out is hardlinked from there when the inputs did not change. At most config['td_cache_size'] results
+    are kept, the least recently used ones being removed. The results of 'kmedoids' stopped early (by td_gap or
+    td_time_budget) are not cached.
+    """
+    n_daily_ts, weights, n_data = build_n_data(config)
+    out_path = case_dir(config) / 'td_of_days.out'
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # If config['cache_dir'] is given, the result is cached there (keyed on n_data, nbr_td and the clustering)
+    cache_dir = config.get('cache_dir')
+    if cache_dir is not None:
+        cached = Path(cache_dir) / 'td_of_days' / ('td_of_days_' + td_of_days_key(config, n_data)[:16] + '.out')
+        if cached.is_file():
+            logging.info('Using cached ' + cached.name)
+            # marking the entry as recently used
+            os.utime(cached)
+            # the case study keeps its own link, the entry can be evicted by a concurrent run
+            link_file(cached, out_path)
+            config['td_of_days_path'] = out_path
+            return
+
+    # run clustering algorithm
+    if config.get('td_clustering', 'ampl') == 'kmedoids':
+        dist = distance_matrix(n_data)
+        td_of_days, obj, complete, obj_gap = kmedoids(n_data, config['nbr_td'], n_init=config.get('td_n_init', 10),
+                                                      seed=config.get('td_seed', 0), dist=dist,
+                                                      n_jobs=config.get('td_n_jobs', 1), gap=config.get('td_gap', 0.),
+                                                      time_budget=config.get('td_time_budget'))
+        if not complete and cache_dir is not None:
+            # the result depends on the timing of the restarts, it is not reused
+            logging.info('Restarts stopped early (gap ' + str(obj_gap) + '), ' + cached.name + ' is not cached')
+            cache_dir = None
+        if config.get('td_exact_check', False):
+            # solving the MILP to check the optimality of the heuristic
+            exact_obj = clustering_objective(dist, kmedoid_clustering(config, n_data, weights, dist=dist))
+            logging.info('kmedoids objective: ' + str(obj) + ', MILP objective: ' + str(exact_obj)
+                         + ', gap: ' + str((obj - exact_obj) / exact_obj))
+    else:
+        td_of_days = kmedoid_clustering(config, n_data, weights)
+
+    if cache_dir is None:
+        tmp_fn = tmp_path(out_path)
+        td_of_days.to_csv(tmp_fn, index=False, header=False)
+        replace_file(tmp_fn, out_path)
+    else:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fn = tmp_path(cached)
+        td_of_days.to_csv(tmp_fn, index=False, header=False)
+        # read-only, as it is shared by the case studies through hardlinks
+        os.chmod(tmp_fn, 0o444)
+        replace_file(tmp_fn, cached)
+        link_file(cached, out_path)
+        evict_lru(cached.parent, config.get('td_cache_size', 64), pattern='td_of_days_*.out')
+    config['td_of_days_path'] = out_path
+    return
+
+
+def case_dir(config):
+    """Directory of the case study of config"""
+    return Path(config['cs_path']) / config['case_study']
+
+
+def td_of_days_path(config):
+    """
+    Path of the typical days assignment (td_of_days.out) of config: config['td_of_days_path'] (set by
+    build_td_of_days) or, if not given, the td_of_days.out of step1_path.
+    """
+    if config.get('td_of_days_path') is not None:
+        return Path(config['td_of_days_path'])
+    return Path(config['step1_path']) / 'td_of_days.out'
+
+
+def td_of_days_key(config, n_data):
+    """
+    Compute the key of the result of build_td_of_days in the cache.
+    The key is the hash of the weighted normalized daily time series (n_data), the number of TDs and the clustering
+    method (with its number of restarts and seed for 'kmedoids'). Only the results of all the restarts are cached,
+    they do not depend on td_n_jobs, td_gap and td_time_budget.
+    """
+    method = config.get('td_clustering', 'ampl')
+    if method == 'kmedoids':
+        method = [method, config.get('td_n_init', 10), config.get('td_seed', 0)]
+    return hash_inputs(n_data, config['nbr_td'], method)
+
+
+def build_n_data(config):
+    """Build the input data of the clustering from the time series and the data of config
+
+    Returns
+    ----------
+    n_daily_ts (normalized daily time series, see pivot_ts), weights (Cell_w and Weights_n of each time series)
+    and n_data (weighted normalized daily time series of shape (365x(n_ts*24)), see weight)
     """
-    all_data = config['all_data']
-    
     # pivot ts to have (365x(24*N_ts))
-    n_daily_ts = pivot_ts(all_data['Time_series'].copy())
+    n_daily_ts = pivot_ts(config['all_data']['Time_series'])
     weights = pd.DataFrame()
-    compute_cell_w(all_data, weights)
+    compute_cell_w(get_model_data(config), weights)
     normalize_weights(weights)
     n_data = weight(weights, n_daily_ts)
-    
-    # run clustering algorithm
-    td_of_days = kmedoid_clustering(config, n_data, weights)
-    td_of_days.to_csv(config['step1_path'] / 'td_of_days.out', index=False, header=False)
-    return
+    return n_daily_ts, weights, n_data
+
+
+def select_nbr_td(config, nbr_tds=range(2, 25)):
+    """Cluster the days for a range of numbers of typical days and compute the aggregation errors of each one, to
+    choose config['nbr_td']
+
+    n_data and its distance matrix are built once, the clustering of each number of typical days starts from the
+    medoids of the previous one (see kmedoids_sweep, with config['td_n_init'] restarts for the smallest one).
+
+    Parameters
+    ----------
+    config :   dict
+               contains all the information about the energy system and the
+               optimization problem solved by EnergyScope
+    nbr_tds :  iterable of int
+               numbers of typical days to try
+
+    Returns
+    ----------
+    pd.DataFrame indexed by the number of typical days with the columns:
+    ('objective', '') the objective of the clustering (sum of the distances of the days to their typical day),
+    ('rmse', '') the root mean square error of the weighted normalized time series (n_data),
+    (error, ts) the errors of each time series rebuilt from the typical days, error being 'energy', 'peak', 'ramp'
+    and 'duration_curve' (see td_quality).
+    """
+    n_daily_ts, weights, n_data = build_n_data(config)
+    dist = distance_matrix(n_data)
+    results = kmedoids_sweep(dist, nbr_tds, n_init=config.get('td_n_init', 10), seed=config.get('td_seed', 0))
+
+    ts = config['all_data']['Time_series']
+    x = n_data.to_numpy()
+    metrics = dict()
+    for k, (td_of_days, obj) in results.items():
+        errors, _ = td_quality(ts, td_of_days)
+        rmse = np.sqrt(np.mean((x - x[td_of_days - 1]) ** 2))
+        metrics[k] = pd.concat([pd.Series({('objective', ''): obj, ('rmse', ''): rmse}), errors.unstack()])
+    return pd.DataFrame.from_dict(metrics, orient='index').rename_axis('nbr_td')
+
+
+def daily_ts(values):
+    """Normalize the time series (sum of each one equal to 1) and arrange them by day
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Time series of shape (8760xN_ts)
+
+    Returns
+    ----------
+    np.ndarray of shape (365xN_ts*24), the 24 hours of each time series being contiguous for each day
+    """
+    values = np.asarray(values, dtype=np.float64)
+    # normalize the timeseries (the missing values and the time series summing to 0 are set to 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_daily = values / np.nansum(values, axis=0)
+    n_daily[np.isnan(n_daily)] = 0
+    # (8760, N_ts) -> (365, 24, N_ts) -> (365, N_ts, 24)
+    return n_daily.reshape(365, 24, -1).transpose(0, 2, 1).reshape(365, -1)
+
+
+def weight_daily_ts(n_daily, w):
+    """Weight the normalized daily time series in place and keep the ones with a weight
+
+    Parameters
+    ----------
+    n_daily : np.ndarray
+        Normalized daily time series of shape (365xN_ts*24) (see daily_ts), multiplied in place
+    w : np.ndarray
+        Weight of each time series (N_ts), NaN for the time series to drop
+
+    Returns
+    ----------
+    The weighted time series (365x(n_kept*24)) and the mask of the time series kept (N_ts)
+    """
+    w = np.asarray(w, dtype=np.float64)
+    n_days = n_daily.shape[0]
+    n_daily = n_daily.reshape(n_days, w.shape[0], -1)
+    n_daily *= w[None, :, None]
+    keep = ~np.isnan(w)
+    return n_daily[:, keep, :].reshape(n_days, -1), keep
 
 
 def pivot_ts(ts):
     """Pivot time series in daily format
     Transforms the time series in the data to have normalized daily time series of shape (365x(N_ts*24))
+    (see daily_ts).
     
     Parameters
     ----------
@@ -59,19 +239,13 @@ def pivot_ts(ts):
     
     Returns
     ----------
-    Normalized and pivoted time series in the daily format (365x(N_ts*24))
+    Normalized and pivoted time series in the daily format (365x(N_ts*24)), with the columns (time series, H_of_D)
     """
     ###### THE FOLLOWING LINE MIGHT NEED TO BE ADAPTED ######
-    ts.rename(columns={'Electricity (%_elec)': 'LIGHTING', 'Space Heating (%_sh)': 'HEAT_LOW_T_SH'}, inplace=True)
-    ts_names = ts.columns
-    # normalize the timeseries
-    ts = ts/ts.sum()
-    # adding columns for pivoting
-    ts['Days'] = np.repeat(np.arange(1, 366), 24, axis=0)
-    ts['H_of_D'] = np.resize(np.arange(1, 25), ts.shape[0])
-    # pivoting normalized time series (norm_ts) to get daily normalized time series (n_daily_ts)
-    n_daily_ts = ts.pivot(index='Days', columns='H_of_D', values=ts_names)
-    return n_daily_ts.fillna(0)
+    ts_names = ts.columns.to_series().replace({'Electricity (%_elec)': 'LIGHTING',
+                                               'Space Heating (%_sh)': 'HEAT_LOW_T_SH'})
+    columns = pd.MultiIndex.from_product([ts_names, np.arange(1, 25)], names=[None, 'H_of_D'])
+    return pd.DataFrame(daily_ts(ts.to_numpy()), index=pd.Index(np.arange(1, 366), name='Days'), columns=columns)
 
 
 def compute_cell_w(all_data, weights):
@@ -82,14 +256,15 @@ def compute_cell_w(all_data, weights):
             
     Parameters
     ----------
-    all_data: dict
+    all_data: ModelData or dict
               contains the input data for the optimization problem solved by 
-              EnergyScope. 
+              EnergyScope (see get_model_data).
     weights : pandas data frame
               empty data frame to which the computed weights will be appended
               as the column 'Cell_w'.
     """
-    tot_ts = all_data['Time_series'].sum(axis=0)
+    md = all_data if isinstance(all_data, ModelData) else ModelData(all_data)
+    tot_ts = pd.Series(md.time_series_total(), index=md.time_series_names)
     ###### THE FOLLOWING 4 LINES MIGHT NEED TO BE ADAPTED ######
     demand_ts = ['LIGHTING', 'HEAT_LOW_T_SH']
     prod_ts = ['PV', 'Wind_onshore', 'Wind_offshore', 'Hydro_river']
@@ -97,7 +272,7 @@ def compute_cell_w(all_data, weights):
     tot_ts.rename({'Electricity (%_elec)': 'LIGHTING', 'Space Heating (%_sh)': 'HEAT_LOW_T_SH'}, inplace=True)
     
     # multiply demand time series sum by the year consumption
-    tot_ts[demand_ts] = tot_ts[demand_ts] * all_data['Demand'].loc[demand_ts, :].sum(axis=1, numeric_only=True).values
+    tot_ts[demand_ts] = tot_ts[demand_ts] * md.demand_total(demand_ts)
     
     # Weight the heating time series by a conversion coefficient to
     # account for the difference in energy quality compared to the electricity
@@ -106,7 +281,7 @@ def compute_cell_w(all_data, weights):
 
     # multiply the sum of the production time series by the maximum potential
     # (f_max in GW) of the corresponding technologies
-    tot_ts[prod_ts] = tot_ts[prod_ts] * all_data['Technologies'].loc[prod_ts2, 'f_max'].values
+    tot_ts[prod_ts] = tot_ts[prod_ts] * md.tech_param('f_max', prod_ts2)
     tot_ts.loc[~tot_ts.index.isin(demand_ts+prod_ts)] = np.nan
     
     # Add Cell_w to the weights data frame
@@ -135,30 +310,27 @@ def normalize_weights(weights):
 def weight(weights, n_daily_ts):
     """Weighting the normalized daily time series
     The normalized daily concatenated time series (n_daily_ts) are weighted by the normalized weights
-    (weights['Weights_n']).
+    (weights['Weights_n'], in the order of the time series).
     The time series with no weight or a null weight are dropped.
     The result (n_data) is ready to be used in a clustering algorithm and is of shape (365x(len(non_null_weights)*24))
     """
-    # use numpy broadcasting to multiply each time series by its weight
-    n_data = numpy_broadcasting(weights.loc[:, 'Weights_n'], n_daily_ts.transpose())
-    # drop ts without weight
-    n_data.dropna(axis=0, how='any', inplace=True)
-    return n_data.transpose()  # transpose to the form (365x(n_ts*24))
+    n_data, keep = weight_daily_ts(n_daily_ts.to_numpy(copy=True), weights['Weights_n'].to_numpy())
+    columns = n_daily_ts.columns[np.repeat(keep, n_daily_ts.shape[1] // keep.shape[0])]
+    return pd.DataFrame(n_data, index=n_daily_ts.index, columns=columns)
     
 
-def print_dat(dat_file, n_data, weights, nbr_td):
+def print_dat(dat_file, n_data, weights, nbr_td, dist=None):
     """
     dat_file = path to the .dat file
+    The distance between the days is computed in python (see distance_matrix) and only its upper half is printed
+    (param Distance_half of td_main.mod), instead of the n_data table.
     Returns
     -------
     """
-    # set n_data columns index to numerical index
-    n_data.columns = np.arange(1, n_data.shape[1] + 1)
+    dist = distance_matrix(n_data) if dist is None else dist
     # printing signature of data file
     print_header(Path(__file__).parent/'header.txt', dat_file)
     newline(dat_file)
-    # printing SET DIMENSIONS
-    print_set(my_set=[str(i) for i in n_data.columns], out_path=dat_file, name='DIMENSIONS')
     # printing Nbr_TD
     print_param('Nbr_TD', nbr_td, '', dat_file)
     newline(dat_file)
@@ -168,100 +340,85 @@ def print_dat(dat_file, n_data, weights, nbr_td):
     weights = weights[['#', 'Time series', 'Cell_w', 'Weights_n']]
     weights.to_csv(dat_file, sep='\t', header=True, index=False, mode='a')
     newline(dat_file)
-    # printing param n_data in ampl syntax
-    print_df(df=ampl_syntax(n_data, ''), out_path=dat_file, name='param Ndata :')
+    # printing param Distance_half in ampl syntax (the lower half is not given, '.')
+    days = np.arange(1, dist.shape[0] + 1)
+    half = pd.DataFrame(np.where(np.triu(np.ones(dist.shape, dtype=bool)), dist, np.nan), index=days, columns=days)
+    print_df(df=ampl_syntax(half, ''), out_path=dat_file, name='param Distance_half :', na_rep='.')
     return
 
 
-def kmedoid_clustering(config, n_data, weights):
+def kmedoid_clustering(config, n_data, weights, dist=None):
     """
+    Solve the MILP td_main.mod with AMPL, dist is the distance matrix of n_data (computed if not given).
+    The files of the run (data.dat, td_main.run, log.txt and td_of_days.out) are written into a temporary workspace
+    created for each call, with absolute paths and without changing the working directory, so that several
+    clusterings can run concurrently. The log of AMPL is copied into the directory of the case study
+    (td_selection_log.txt) at the end. A RuntimeError is raised if AMPL fails.
     Returns
     -------
     """
     # extract info of interest from config
     nbr_td = config['nbr_td']
-    step1_path = config['step1_path']
-    
-    # define path
-    mod_path = step1_path / 'td_main.mod'
-    data_path = step1_path / 'data.dat'
-    log_file = step1_path / 'log.txt'
-    run_file = 'td_main.run'
-
-    # logging info
-    logging.info('Starting kmedoid clustering of typical days based on ' + str(data_path))
-    
-    # print .dat file
-    print_dat(data_path, n_data, weights, nbr_td)
-
-    # define options
-    cplex_options = ['mipdisplay=5',
-                     'mipinterval=1000',
-                     'mipgap=1e-6']
-    cplex_options_str = ' '.join(cplex_options)
-    options = {'show_stats': 3,
-               'log_file': str(log_file),
-               'times': 1,
-               'gentimes': 1,
-               'solver': 'cplex',
-               'cplex_options': cplex_options_str}
-
-    # using AMPL_path if specified. Otherwise, we assume ampl is in environment variables
-    if config['AMPL_path'] is None:
-        ampl_command = 'ampl ' + run_file
-    else:
-        config['AMPL_path'] = Path(config['AMPL_path'])
-        print('AMPL path is', config['AMPL_path'])
-        options ['solver'] = config['AMPL_path'] / options ['solver']
-        ampl_command = str(config['AMPL_path'] / 'ampl ') + run_file
+    step1_path = Path(config['step1_path'])
 
-    # print .run
-    print_run(run_fn=str(step1_path / run_file), mod_fns=[str(mod_path)],
-              dat_fns=[str(data_path)],
-              options=options, output_dir=step1_path,
-              print_files=['printing_outputs.run'])
+    with tempfile.TemporaryDirectory(prefix='td_selection_') as workspace:
+        workspace = Path(workspace)
+        # define path
+        mod_path = step1_path / 'td_main.mod'
+        data_path = workspace / 'data.dat'
+        log_file = workspace / 'log.txt'
+        run_file = 'td_main.run'
 
-    os.chdir(step1_path)
-    # running ES
-    logging.info('Running kmedoid clustering')
+        # logging info
+        logging.info('Starting kmedoid clustering of typical days based on ' + str(data_path))
 
-    try:
-        run(ampl_command, shell=True, check=True)
-    except CalledProcessError as e:
-        print("The run didn't end normally.")
-        print(e)
-        sys.exit(1)
+        # print .dat file
+        print_dat(data_path, n_data, weights, nbr_td, dist=dist)
 
-    td_of_days = pd.read_csv('td_of_days.out', header=None)
+        # define options
+        cplex_options = ['mipdisplay=5',
+                         'mipinterval=1000',
+                         'mipgap=1e-6']
+        cplex_options_str = ' '.join(cplex_options)
+        options = {'show_stats': 3,
+                   'log_file': str(log_file),
+                   'times': 1,
+                   'gentimes': 1,
+                   'solver': 'cplex',
+                   'cplex_options': cplex_options_str}
 
-    os.chdir(config['Working_directory'])
+        # using AMPL_path if specified. Otherwise, we assume ampl is in environment variables
+        if config['AMPL_path'] is None:
+            ampl_command = 'ampl ' + run_file
+        else:
+            config['AMPL_path'] = Path(config['AMPL_path'])
+            logging.info('AMPL path is ' + str(config['AMPL_path']))
+            options ['solver'] = config['AMPL_path'] / options ['solver']
+            ampl_command = str(config['AMPL_path'] / 'ampl ') + run_file
 
-    logging.info('End of kmedoid clustering')
+        # print .run (td_of_days.out is printed relatively to the workspace)
+        print_run(run_fn=str(workspace / run_file), mod_fns=[str(mod_path)],
+                  dat_fns=[str(data_path)],
+                  options=options, output_dir=workspace,
+                  print_files=[str(step1_path / 'printing_outputs.run')])
 
-    return td_of_days
+        # running ES
+        logging.info('Running kmedoid clustering')
 
+        try:
+            run(ampl_command, shell=True, check=True, cwd=workspace)
+        except CalledProcessError as e:
+            # the log of AMPL is kept in the case study (see below)
+            raise RuntimeError("The kmedoid clustering with AMPL didn't end normally: " + str(e)) from e
+        finally:
+            if log_file.is_file():
+                case_dir(config).mkdir(parents=True, exist_ok=True)
+                tmp_fn = tmp_path(case_dir(config) / 'td_selection_log.txt')
+                shutil.copyfile(log_file, tmp_fn)
+                os.replace(tmp_fn, case_dir(config) / 'td_selection_log.txt')
 
-def numpy_broadcasting(df0, df1):
-    """
-    Multiplies 2 multiindexed pandas dataframes of different dimensions using numpy broadcasting
-    Used to multiply each hour of each day for each time series by its respective weight
-    Parameters
-    ----------
-    df0: pd.Series()
-        Multiindexed dataframe containing the normalized weights of the time series
-        (df0.index.levshape = n_ts)
-    df1: pd.DataFrame()
-        Multiindexed dataframe containing the times series under the form:
-        df1.index.levshape = (n_ts, 24), df1.shape[1] = 365
-    Returns
-    -------
-    df_out: pd.DataFrame()
-        Multiindexed dataframe (same shape as df1), product of df1 by df0.
-        For each time series, all the hours of all the days are multiplied by the normalized weight (df0)
-    """
-    m, n = map(len, df1.index.levels)
-    a0 = df0.values.reshape(m, -1)
-    a1 = df1.values.reshape(m, n, -1)
-    out = (a1 * a0[..., None, :]).reshape(-1, a1.shape[-1])
-    df_out = pd.DataFrame(out, index=df1.index, columns=df1.columns)
-    return df_out
+        td_of_days = pd.read_csv(workspace / 'td_of_days.out', header=None)
+
+    logging.info('End of kmedoid clustering')
+
+    return td_of_days
@@ -9,10 +9,24 @@ Contains functions format and print data into ampl syntax into .dat files
 
 
 import csv
+import io
+import os
+import sys
+import hashlib
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+from ..es_pre.es_data_store import file_hash, evict_lru, tmp_path
+
 # TODO write doc
 
+# Version of the formatting of the cached .dat sections, part of their keys (increment when DatWriter changes the text
+# it produces in a way the code of the formatters and of their modules does not show)
+FRAGMENT_VERSION = 1
+
 
 def ampl_syntax(df, comment):
     # adds ampl syntax to df
@@ -28,8 +42,9 @@ def print_set(my_set, name, out_path):
         writer.writerow(['set ' + name + ' := \t' + '\t'.join(my_set) + ';'])
 
 
-def print_df(name, df, out_path):
-    df.to_csv(out_path, sep='\t', mode='a', header=True, index=True, index_label=name, quoting=csv.QUOTE_NONE)
+def print_df(name, df, out_path, na_rep=''):
+    df.to_csv(out_path, sep='\t', mode='a', header=True, index=True, index_label=name, na_rep=na_rep,
+              quoting=csv.QUOTE_NONE)
 
     with open(out_path, mode='a', newline='') as file:
         writer = csv.writer(file, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
@@ -56,3 +71,217 @@ def print_header(header_file: Path, dat_file: Path):
     with open(dat_file, mode='w', newline='') as file, open(header_file, 'r') as header:
         for line in header:
             file.write(line)
+
+
+def _code_key(code):
+    # bytecode and constants of a function (and of its nested functions/comprehensions), stable between sessions
+    consts = [_code_key(c) if hasattr(c, 'co_code') else repr(c) for c in code.co_consts]
+    return [code.co_code, code.co_names, consts]
+
+
+@lru_cache(maxsize=None)
+def _module_key(module_name):
+    # content hash of the source file of a module (the helpers called by a formatter are defined in its module)
+    file = getattr(sys.modules.get(module_name), '__file__', None)
+    return '' if file is None else file_hash(file)
+
+
+def hash_inputs(*args, **kwargs):
+    """
+    Compute a hash of the inputs of a formatter (dataframes, numpy arrays, lists, dictionaries and scalars).
+
+    Returns
+    -------
+    The hexadecimal sha256 digest of the inputs (str).
+    """
+    h = hashlib.sha256()
+
+    def update(obj):
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            h.update(repr((type(obj).__name__, obj.shape, list(obj.index.names), obj.index.dtype,
+                           list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name,
+                           list(obj.dtypes) if isinstance(obj, pd.DataFrame) else obj.dtype)).encode())
+            h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        elif isinstance(obj, np.ndarray):
+            h.update(repr((obj.dtype, obj.shape)).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, dict):
+            h.update(b'{')
+            for k, v in obj.items():
+                update(k)
+                update(v)
+            h.update(b'}')
+        elif isinstance(obj, (list, tuple)):
+            h.update(b'[')
+            for v in obj:
+                update(v)
+            h.update(b']')
+        else:
+            h.update(repr(obj).encode())
+        h.update(b';')
+
+    update(list(args))
+    update(kwargs)
+    return h.hexdigest()
+
+
+class DatWriter:
+    """
+    Writer of an AMPL .dat file into one in-memory text buffer.
+    The data is formatted with the same syntax as the print_* functions, but the file is only written once (see flush)
+    instead of being reopened for each set, parameter or table.
+    Section-level formatters can be plugged in (see add_formatter and section).
+
+    Example:
+    dat = DatWriter(out_path)
+    dat.header(header_file)
+    dat.set(['HOUSEHOLDS', 'SERVICES'], 'SECTORS')
+    dat.param('i_rate', 0.015, '')
+    dat.flush()
+    """
+
+    def __init__(self, out_path=None, formatters=None):
+        """
+        Parameters
+        ----------
+        out_path: pathlib.Path
+        Path of the .dat file written by flush.
+
+        formatters: dict
+        Section-level formatters {section name: function(writer, *args, **kwargs)}.
+        """
+        self.out_path = out_path
+        self.formatters = dict(formatters or {})
+        self.buffer = io.StringIO(newline='')
+        self.writer = csv.writer(self.buffer, delimiter='\t', quotechar=' ', quoting=csv.QUOTE_MINIMAL)
+        # sections formatted (not read from the cache) by this writer
+        self.formatted = []
+
+    def header(self, header_file: Path):
+        # printing signature of data file
+        with open(header_file, 'r') as header:
+            self.buffer.write(header.read())
+
+    def row(self, text):
+        # one line of text (ex: comment), with the same quoting as the print_* functions
+        self.writer.writerow([text])
+
+    def newline(self):
+        self.writer.writerow([''])
+
+    def set(self, my_set, name):
+        self.writer.writerow(['set ' + name + ' := \t' + '\t'.join(my_set) + ';'])
+
+    def param(self, name, param, comment):
+        if comment == '':
+            self.writer.writerow(['param ' + str(name) + ' := ' + str(param) + ';'])
+        else:
+            self.writer.writerow(['param ' + str(name) + ' := ' + str(param) + '; # ' + str(comment)])
+
+    def table(self, df, **kwargs):
+        # df printed as a tab separated table (kwargs are passed to DataFrame.to_csv)
+        df.to_csv(self.buffer, sep='\t', quoting=csv.QUOTE_NONE, **kwargs)
+
+    def matrix(self, name, index, columns, values):
+        """
+        2-dimensional table from an array (or nested lists) of floats, printed as table(ampl_syntax(df, ''))
+        would print it (the floats with their shortest repr, as DataFrame.to_csv), without building a dataframe.
+        """
+        values = values.tolist() if isinstance(values, np.ndarray) else values
+        lines = [name + '\t' + '\t'.join(map(str, columns)) + ' := ']
+        lines += [str(i) + '\t' + '\t'.join(map(repr, row)) for i, row in zip(index, values)]
+        self.buffer.write('\n'.join(lines) + '\n')
+
+    def df(self, name, df):
+        self.table(df, header=True, index=True, index_label=name)
+        self.writer.writerow([';'])
+
+    def sparse(self, name, rows, cols, values, default=0):
+        # 2-dimensional parameter as a list of its entries (row, column, value), the entries not listed take the
+        # default value
+        self.writer.writerow(['param', name, 'default', str(default), ':='])
+        self.writer.writerows(zip(rows, cols, values))
+        self.writer.writerow([';'])
+
+    def add_formatter(self, name, formatter):
+        """Plug in the formatter of a section, called as formatter(writer, *args, **kwargs)"""
+        self.formatters[name] = formatter
+
+    def section(self, name, *args, **kwargs):
+        """Format the section name with its formatter (see add_formatter)"""
+        self.formatters[name](self, *args, **kwargs)
+        self.formatted.append(name)
+
+    def cached_section(self, name, cache_dir, max_entries=1024, **inputs):
+        """
+        Format the section name with its formatter (see section), reusing the formatted text cached in cache_dir.
+        The cached fragments are keyed on the name of the section, the code of its formatter, the source of the modules
+        of the formatter and of DatWriter, FRAGMENT_VERSION and the hash of its inputs (see hash_inputs), so that a
+        section is only formatted again when one of its inputs or the code producing it changed.
+        At most max_entries fragments are kept in cache_dir, the least recently used ones being removed.
+
+        Parameters
+        ----------
+        name: str
+        Name of the section.
+
+        cache_dir: pathlib.Path
+        Directory of the cached fragments (the section is always formatted if None).
+
+        max_entries: int
+        Maximum number of fragments kept in cache_dir.
+
+        inputs:
+        Inputs of the formatter, passed as keyword arguments.
+        """
+        if cache_dir is None:
+            self.section(name, **inputs)
+            return
+        formatter = self.formatters[name]
+        key = hash_inputs(name, FRAGMENT_VERSION, _code_key(formatter.__code__), _module_key(formatter.__module__),
+                          _module_key(__name__), **inputs)
+        fragment_fn = Path(cache_dir) / (name + '_' + key + '.txt')
+        try:
+            with open(fragment_fn, 'r', newline='') as file:
+                text = file.read()
+        except FileNotFoundError:
+            # not cached (or removed by a concurrent run)
+            text = None
+        if text is not None:
+            self.buffer.write(text)
+            try:
+                # marking the fragment as recently used
+                os.utime(fragment_fn)
+            except FileNotFoundError:
+                pass
+            return
+        fragment = DatWriter(formatters=self.formatters)
+        fragment.section(name, **inputs)
+        text = fragment.getvalue()
+        self.buffer.write(text)
+        self.formatted.append(name)
+        # atomic write, several scenarios can share the cache
+        fragment_fn.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fn = tmp_path(fragment_fn)
+        with open(tmp_fn, 'w', newline='') as file:
+            file.write(text)
+        os.replace(tmp_fn, fragment_fn)
+        evict_lru(fragment_fn.parent, max_entries, pattern='*.txt')
+
+    def getvalue(self):
+        """Content of the buffer"""
+        return self.buffer.getvalue()
+
+    def drain(self):
+        """Return the text formatted since the last drain and empty the buffer (to stream a file by parts)"""
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def flush(self, mode='w'):
+        """Write the content of the buffer into out_path with a single write and empty the buffer"""
+        with open(self.out_path, mode=mode, newline='') as file:
+            file.write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
@@ -34,6 +34,18 @@ def print_dat(run_fn: str, dat_fns: List[str]) -> None:
             file.write(f'data "{dat_fn}";\n')
 
 
+def print_commands(run_fn: str, commands_fns: List[str]) -> None:
+    """
+    Add the inclusion of AMPL commands files (e.g. let commands overriding the data) to run file
+    :param run_fn: Path to .run file
+    :param commands_fns: Paths to the commands files
+    """
+    with open(run_fn, mode='a', newline='') as file:
+        file.write("\n# Override data\n")
+        for commands_fn in commands_fns:
+            file.write(f'include "{commands_fn}";\n')
+
+
 def print_options(run_fn: str, options: dict) -> None:
     """
     Add options to run file
@@ -88,7 +100,8 @@ def print_save(run_fn: str, output_dir: str, print_files: List[str]) -> None:
         file.write("\t\t\texit 0;\n\t\t}\n\t}\n}")
 
 
-def print_run(run_fn: str, mod_fns: List[str], dat_fns: List[str], options: dict, output_dir: str, print_files: List[str]) -> None:
+def print_run(run_fn: str, mod_fns: List[str], dat_fns: List[str], options: dict, output_dir: str, print_files: List[str],
+              commands_fns: List[str] = None) -> None:
     """
     Print the .run file.
 
@@ -100,6 +113,7 @@ def print_run(run_fn: str, mod_fns: List[str], dat_fns: List[str], options: dict
     :param output_dir: Path to the directory where the output of the model is to be generated (e.g. used as PathName in
     AMPL_utils/print.run and AMPL_utils/sankey.run)
     :param print_files: List of path to the files containing the instructions of which outputs to print
+    :param commands_fns: Paths to AMPL commands files included after loading the data (e.g. overrides of the data)
     """
 
     # Add header
@@ -112,6 +126,9 @@ def print_run(run_fn: str, mod_fns: List[str], dat_fns: List[str], options: dict
     print_mod(run_fn, mod_fns)
     # Add .dat import
     print_dat(run_fn, dat_fns)
+    # Add data overrides
+    if commands_fns:
+        print_commands(run_fn, commands_fns)
     # Add run options
     print_options(run_fn, options)
     # Add solving
@@ -5,6 +5,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import sys
 from pathlib import Path
+import energyscope as es
 
 # 1) Trouver la racine du projet
 root = Path(__file__).resolve().parent.parent.parent
@@ -13,13 +14,11 @@ root = Path(__file__).resolve().parent.parent.parent
 csv_path = root / "Data" / "2050" / "Time_series.csv" 
 
 
-# 1. Charger les données
-df = pd.read_csv(csv_path, sep=';')
+# 1. Charger les données (vue sur le stockage binaire des séries temporelles)
+df = es.load_time_series(csv_path, cache_dir=root / "cache")
 
-# 4) Renommer la première colonne si elle s'appelle "{PERIODS}"
-first = df.columns[0]
-if first != "PERIODS":
-    df = df.rename(columns={first: "PERIODS"})
+# 4) Renommer l'index ("{PERIODS}") en colonne "PERIODS"
+df = df.rename_axis("PERIODS").reset_index()
 
 
 # 2. Créer un graphique par série temporelle
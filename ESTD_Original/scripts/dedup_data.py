@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+This script converts the data directories into the content-addressed store (Data/.store)
+
+Usage: python dedup_data.py [--mode hardlink|reflink|manifest] [data directories]
+(default: all the directories of Data/ converted with hardlinks)
+"""
+import argparse
+from pathlib import Path
+import energyscope as es
+
+root = Path(__file__).resolve().parent.parent
+store_dir = root / "Data" / ".store"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store each unique data file once in ' + str(store_dir))
+    parser.add_argument('--mode', default='hardlink', choices=['hardlink', 'reflink', 'manifest'])
+    parser.add_argument('data_dirs', nargs='*', type=Path)
+    args = parser.parse_args()
+
+    data_dirs = args.data_dirs or sorted(d for d in (root / "Data").iterdir() if d.is_dir() and d != store_dir)
+    for data_dir in data_dirs:
+        files = es.dedup_data_dir(data_dir, store_dir, mode=args.mode)
+        print(f"[✔] {data_dir} : {len(files)} fichiers ({args.mode})")
+    size = sum(f.stat().st_size for f in store_dir.rglob('*') if f.is_file()) // 1024
+    print(f"[🎯] Taille du store {store_dir} : {size} kB")
@@ -21,6 +21,8 @@ if __name__ == '__main__':
     
    # Reading the data of the csv
     es.import_data(config)
+    # Checking the consistency of the data before any computation
+    es.check_data(config)
 
     if compute_TDs:
         es.build_td_of_days(config)
@@ -58,7 +60,7 @@ if __name__ == '__main__':
     # primary resources used
     fig2, ax2 = es.plot_barh(outputs['resources_breakdown'][['Used']], title='Primary energy [GWh/y]')
     # elec assets
-    elec_assets = es.get_assets_l(layer='ELECTRICITY', eff_tech=config['all_data']['Layers_in_out'],
+    elec_assets = es.get_assets_l(layer='ELECTRICITY', eff_tech=es.get_model_data(config),
                                   assets=outputs['assets'])
     fig3, ax3 = es.plot_barh(elec_assets[['f']], title='Electricity assets [GW_e]',
                              x_label='Installed capacity [GW_e]')
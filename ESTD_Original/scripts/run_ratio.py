@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
-import pandas as pd
 import shutil
 import energyscope as es
 
@@ -19,6 +18,7 @@ config_path = root / "scripts" / "config_ref.yaml"
 
 # === FONCTION POUR CONSTRUIRE LES TD UNE FOIS ===
 def generate_typical_days():
+    """Construit les TD dans case_studies/base_TD (ou les reprend du cache) et renvoie le chemin de td_of_days.out"""
     print("[⏳] Construction des TD...")
     config = es.load_config(config_fn=str(config_path))
     config["Working_directory"] = str(td_base_case)
@@ -29,41 +29,34 @@ def generate_typical_days():
     es.build_td_of_days(config)
     es.print_data(config)
     print("[✅] TD générés.")
+    return config["td_of_days_path"]
 
 # === FONCTION POUR UN SCÉNARIO AVEC GWP GAS ET GWP AMMONIA ===
-def run_scenario(gwp_gas, gwp_ammonia):
+def run_scenario(gwp_gas, gwp_ammonia, td_of_days_path):
     scenario_name = f"GAS_{gwp_gas:.3f}_AMMONIA_{gwp_ammonia:.3f}"
     print(f"[▶] {scenario_name}...")
 
-    scenario_data_dir = root / "Data" / scenario_name
     scenario_case_dir = root / "case_studies" / scenario_name
-    scenario_data_dir.mkdir(parents=True, exist_ok=True)
     scenario_case_dir.mkdir(parents=True, exist_ok=True)
 
     try:
-        # 1. Copier les données de base
-        shutil.copytree(base_data_dir, scenario_data_dir, dirs_exist_ok=True)
+        # 1. Patch de Resources (appliqué en mémoire sur Data/2050)
+        data_patch = {'Resources': {'GAS_RE': {'gwp_op': gwp_gas},
+                                    'AMMONIA_RE': {'gwp_op': gwp_ammonia}}}
 
-        # 2. Modifier Resources.csv
-        scenario_resources_fn = scenario_data_dir / "Resources.csv"
-        df = pd.read_csv(scenario_resources_fn, sep=';', skiprows=2)
-        df.columns = df.columns.str.strip()
-        df.loc[df['parameter name'] == 'GAS_RE', 'gwp_op'] = gwp_gas
-        df.loc[df['parameter name'] == 'AMMONIA_RE', 'gwp_op'] = gwp_ammonia
-        with open(scenario_resources_fn, 'w', encoding='utf-8') as f:
-            f.write(";;;Availability;Direct and indirect emissions;Price;\n")
-            f.write(";;units;[GWh/y];[ktCO2-eq./GWh];[Meuro/GWh];\n")
-            df.to_csv(f, sep=';', index=False)
-
-        # 3. Copier fichier TD
-        shutil.copy(td_base_case / "ESTD_12TD.dat", scenario_case_dir / "ESTD_12TD.dat")
+        # 3. Les TD sont imprimés par print_data (fichier partagé dans cache_dir, reconstruit si les données changent)
 
         # 4. Charger config
         config = es.load_config(config_fn=str(config_path))
         config["case_study"] = scenario_name
         config["Working_directory"] = str(scenario_case_dir)
-        config["data_dir"] = Path(scenario_data_dir)
+        config["data_dir"] = base_data_dir
+        config["data_patch"] = data_patch
+        # TD construits une fois dans base_TD (voir generate_typical_days)
+        config["td_of_days_path"] = td_of_days_path
         config["print_data"] = True
+        # données de base partagées (case_studies/_base) + ESTD_override.run du scénario
+        config["layered_data"] = True
         config.setdefault("ampl_options", {})
         config["ampl_options"]["log_file"] = str((scenario_case_dir / "output" / "log.txt").as_posix())
 
@@ -80,6 +73,7 @@ def run_scenario(gwp_gas, gwp_ammonia):
 
         # 6. Import et run
         es.import_data(config)
+        es.check_data(config)  # rejette le scénario si les données sont incohérentes
         es.print_data(config)
         es.run_es(config)
 
@@ -96,9 +90,9 @@ def run_scenario(gwp_gas, gwp_ammonia):
 
 # === SCRIPT PRINCIPAL ===
 if __name__ == '__main__':
-    # generate_typical_days()
+    td_of_days_path = generate_typical_days()
     for gwp_gas in gwp_gas_range:
         for i in range(N_AMMONIA_STEPS):
             gwp_ammonia = round(gwp_ammonia_min + i * STEP_AMMONIA, 3)
-            run_scenario(gwp_gas, gwp_ammonia)
+            run_scenario(gwp_gas, gwp_ammonia, td_of_days_path)
     print("[🎯] Tous les scénarios sont terminés.")
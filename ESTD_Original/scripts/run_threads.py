@@ -2,7 +2,6 @@
 
 # -*- coding: utf-8 -*-
 from pathlib import Path
-import pandas as pd
 import shutil
 import energyscope as es
 
@@ -11,7 +10,6 @@ import energyscope as es
 # === CHEMINS ===
 root = Path(__file__).resolve().parent.parent
 base_data_dir = root / "Data" / "2050"
-td_base_case = root / "case_studies" / "base_TD"
 config_path = root / "scripts" / "config_ref.yaml"
 
 
@@ -34,8 +32,21 @@ config = {
 
 
 
+# === FONCTION POUR CONSTRUIRE LES TD UNE FOIS ===
+def generate_typical_days():
+    """Construit les TD dans case_studies/base_TD (ou les reprend du cache) et renvoie le chemin de td_of_days.out"""
+    print("[⏳] Construction des TD...")
+    config = es.load_config(config_fn=str(config_path))
+    config["case_study"] = "base_TD"
+    config["data_dir"] = base_data_dir
+    es.import_data(config)
+    es.build_td_of_days(config)
+    print("[✅] TD générés.")
+    return config["td_of_days_path"]
+
+
 # === FONCTION POUR UN SCÉNARIO AVEC NOUVEAU GWP_OP ===
-def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
+def run_scenario(gwp_other_fuel, gwp_num, gwp_denum, td_of_days_path, config=config):
     NAME = config['NAME']
     if config['ONLY']:
         scenario_name = f"{NAME}_{gwp_num:.3f}"
@@ -48,9 +59,6 @@ def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
 
     print(f"[▶] {scenario_name}...")
 
-    scenario_data_dir = root / "Data" / scenario_name
-
-
     if config['NUCLEAR']:
         if config['ONLY']:
             scenario_case_dir = root / "case_studies" / "NUCLEAR" / "ONLY" /  NAME /"log" /scenario_name
@@ -60,35 +68,20 @@ def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
     else:
         scenario_case_dir = root / "case_studies" / "NON_NUCLEAR" /  NAME /"log" /scenario_name
 
-    scenario_data_dir.mkdir(parents=True, exist_ok=True)
     scenario_case_dir.mkdir(parents=True, exist_ok=True)
 
     try:
-        # 1. Copier les données de base
-        shutil.copytree(base_data_dir, scenario_data_dir, dirs_exist_ok=True)
-
-        # 2. Modifier les valeurs de gwp_op dans Resources.csv
-        scenario_resources_fn = scenario_data_dir / "Resources.csv"
-        df = pd.read_csv(scenario_resources_fn, sep=';', skiprows=2)
-        df.columns = df.columns.str.strip()
-        #---------------------------------------------------------------------------------------------------------00000000000000000000
-
-        df.loc[df['parameter name'] == 'METHANOL_RE', 'gwp_op'] = gwp_other_fuel
-        df.loc[df['parameter name'] == 'BIODIESEL', 'gwp_op']   = gwp_other_fuel
-        df.loc[df['parameter name'] == 'BIOETHANOL', 'gwp_op']  = gwp_other_fuel
-        df.loc[df['parameter name'] == 'AMMONIA_RE', 'gwp_op']  = gwp_denum
-        df.loc[df['parameter name'] == 'GAS_RE', 'gwp_op']      = gwp_denum 
-        df.loc[df['parameter name'] == 'H2_RE', 'gwp_op']       = gwp_num 
-
-        #---------------------------------------------------------------------------------------------------------00000000000000000000
-
-        with open(scenario_resources_fn, 'w', encoding='utf-8') as f:
-            f.write(";;;Availability;Direct and indirect emissions;Price;\n")
-            f.write(";;units;[GWh/y];[ktCO2-eq./GWh];[Meuro/GWh];\n")
-            df.to_csv(f, sep=';', index=False)
-
-        # 3. Copier les TD
-        shutil.copy(td_base_case / "ESTD_12TD.dat", scenario_case_dir / "ESTD_12TD.dat")
+        # 1. Patch des valeurs de gwp_op de Resources (appliqué en mémoire sur Data/2050)
+        data_patch = {'Resources': {
+            'METHANOL_RE': {'gwp_op': gwp_other_fuel},
+            'BIODIESEL':   {'gwp_op': gwp_other_fuel},
+            'BIOETHANOL':  {'gwp_op': gwp_other_fuel},
+            'AMMONIA_RE':  {'gwp_op': gwp_denum},
+            'GAS_RE':      {'gwp_op': gwp_denum},
+            'H2_RE':       {'gwp_op': gwp_num},
+        }}
+
+        # 3. Les TD sont imprimés par print_data à partir des TD de base_TD (voir generate_typical_days)
         
         # 5. Nettoyage output
         output_dir = scenario_case_dir / "output"
@@ -101,8 +94,12 @@ def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
         config = es.load_config(config_fn=str(config_path))
         config["case_study"] = scenario_name
         config["Working_directory"] = str(scenario_case_dir)
-        config["data_dir"] = Path(scenario_data_dir)
+        config["data_dir"] = base_data_dir
+        config["data_patch"] = data_patch
+        config["td_of_days_path"] = td_of_days_path
         config["print_data"] = True
+        # données de base partagées (case_studies/_base) + ESTD_override.run du scénario
+        config["layered_data"] = True
 
         config.setdefault("ampl_options", {})
         config["ampl_options"]["log_file"] = str((scenario_case_dir / "output" / "log.txt").as_posix())
@@ -116,6 +113,7 @@ def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
 
         # 6. Importation + génération .dat/.run
         es.import_data(config)
+        es.check_data(config)  # rejette le scénario si les données sont incohérentes
         es.print_data(config)
 
         # 7. Run EnergyScope
@@ -334,7 +332,7 @@ def run_scenario(gwp_other_fuel, gwp_num, gwp_denum,config=config):
 
 # === SCRIPT PRINCIPAL ===
 if __name__ == '__main__':
-    # generate_typical_days()  # Décommenter si nécessaire
+    td_of_days_path = generate_typical_days()
     if config['gwp_range_num'] == 0:
         print("[❌] Aucune valeur dans gwp_range_num, veuillez vérifier la configuration.")
         
@@ -343,12 +341,13 @@ if __name__ == '__main__':
 
         if config['gwp_range_denum'] == 0:
             for gwp_num in config['gwp_range_num']:
-                run_scenario(gwp_other_fuel=0, gwp_num=gwp_num, gwp_denum=0)
+                run_scenario(gwp_other_fuel=0, gwp_num=gwp_num, gwp_denum=0, td_of_days_path=td_of_days_path)
 
         else:  #---- CLASSIQUE ----#
             for gwp_denum in config['gwp_range_denum']:
                 for gwp_num in config['gwp_range_num']:
-                    run_scenario(gwp_other_fuel=0, gwp_num=gwp_num, gwp_denum=gwp_denum)
+                    run_scenario(gwp_other_fuel=0, gwp_num=gwp_num, gwp_denum=gwp_denum,
+                                 td_of_days_path=td_of_days_path)
 
             # config['NAME'] = 'gasRE_VS_ammoniaRE&H2RE'  # Réinitialiser pour lancer une autre boucle sans avoir a rérun
             # for gwp_denum in config['gwp_range_denum']:
@@ -366,7 +365,8 @@ if __name__ == '__main__':
             for gwp_denum in config['gwp_range_denum']:
                 for gwp_num in config['gwp_range_num']:
                     
-                    run_scenario(gwp_other_fuel=gwp_other_fuel, gwp_num=gwp_num, gwp_denum=gwp_denum)
+                    run_scenario(gwp_other_fuel=gwp_other_fuel, gwp_num=gwp_num, gwp_denum=gwp_denum,
+                                 td_of_days_path=td_of_days_path)
  
 
     print("[🎯] Tous les scénarios sont terminés.")
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the content-addressed store of the data directories (es_data_store).
+"""
+import os
+
+import pytest
+
+import energyscope.preprocessing.es_pre.es_data_store as ds
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / 'Data' / '2050'
+    data_dir.mkdir(parents=True)
+    (data_dir / 'Resources.csv').write_text('name;gwp_op\nGAS_RE;0.1\n')
+    (data_dir / 'Demand.csv').write_text('name;HOUSEHOLDS\nLIGHTING;4960.6\n')
+    (data_dir / 'misc.json').write_text('{"i_rate": 0.015}')
+    return data_dir
+
+
+@pytest.fixture
+def hash_calls(monkeypatch):
+    # files hashed by the store
+    calls = []
+    file_hash = ds.file_hash
+    monkeypatch.setattr(ds, 'file_hash', lambda file: calls.append(file.name) or file_hash(file))
+    return calls
+
+
+def test_link_file(tmp_path):
+    src = tmp_path / 'src.dat'
+    src.write_text('typical days')
+    os.chmod(src, 0o444)
+    dst = tmp_path / 'case' / 'ESTD_12TD.dat'
+    dst.parent.mkdir()
+    dst.write_text('old')
+    ds.link_file(src, dst)
+    assert dst.read_text() == 'typical days'
+    assert os.path.samefile(src, dst)
+    # dst is replaced, the file it linked to is not written through
+    other = tmp_path / 'other.dat'
+    other.write_text('other typical days')
+    ds.link_file(other, dst)
+    assert dst.read_text() == 'other typical days'
+    assert src.read_text() == 'typical days'
+    assert not list(dst.parent.glob('*.tmp'))
+
+
+@pytest.mark.parametrize('mode', ['hardlink', 'reflink', 'manifest'])
+def test_dedup_data_dir(data_dir, tmp_path, mode):
+    store_dir = tmp_path / 'store'
+    contents = {f.name: f.read_text() for f in data_dir.iterdir()}
+    files = ds.dedup_data_dir(data_dir, store_dir, mode=mode)
+    assert sorted(files) == sorted(contents)
+    for name, text in contents.items():
+        assert ds.resolve_data_file(data_dir, name).read_text() == text
+        assert ds.blob_path(store_dir, files[name]).read_text() == text
+    if mode == 'hardlink':
+        assert os.path.samefile(data_dir / 'Resources.csv', ds.blob_path(store_dir, files['Resources.csv']))
+    if mode == 'manifest':
+        assert sorted(f.name for f in data_dir.iterdir()) == [ds.MANIFEST]
+    assert not list(data_dir.glob('*.tmp'))
+
+
+def test_create_scenario(data_dir, tmp_path):
+    store_dir = tmp_path / 'store'
+    ds.dedup_data_dir(data_dir, store_dir, mode='manifest')
+    resources = tmp_path / 'Resources.csv'
+    resources.write_text('name;gwp_op\nGAS_RE;0.05\n')
+    scenario_dir = tmp_path / 'Data' / 'scenario'
+    ds.create_scenario(data_dir, scenario_dir, store_dir, files={'Resources.csv': resources})
+    assert sorted(f.name for f in scenario_dir.iterdir()) == [ds.MANIFEST]
+    assert ds.resolve_data_file(scenario_dir, 'Resources.csv').read_text() == resources.read_text()
+    assert ds.resolve_data_file(scenario_dir, 'Demand.csv').read_text() == 'name;HOUSEHOLDS\nLIGHTING;4960.6\n'
+    assert ds.resolve_data_file(scenario_dir, 'Unknown.csv') is None
+
+
+def test_create_scenario_hashes_changed_files_only(data_dir, tmp_path, hash_calls):
+    store_dir = tmp_path / 'store'
+    ds.dedup_data_dir(data_dir, store_dir, mode='reflink')
+    hash_calls.clear()
+    ds.create_scenario(data_dir, tmp_path / 'Data' / 'scenario', store_dir)
+    assert hash_calls == []
+
+    # a modified file of base_dir is hashed again
+    (data_dir / 'misc.json').unlink()
+    (data_dir / 'misc.json').write_text('{"i_rate": 0.02}')
+    ds.create_scenario(data_dir, tmp_path / 'Data' / 'scenario_2', store_dir)
+    assert hash_calls == ['misc.json']
+    assert ds.resolve_data_file(tmp_path / 'Data' / 'scenario_2', 'misc.json').read_text() == '{"i_rate": 0.02}'
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the k-medoids clustering of the typical days (FasterPAM), checked against the optimum of the MILP of
+td_main.mod computed by enumeration on a small instance.
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from energyscope.preprocessing.td_selection.kmedoids import distance_matrix, fasterpam, lagrangian_bound, kmedoids, \
+    kmedoids_sweep, clustering_objective
+
+
+def _instance(n=30, seed=1):
+    # three groups of days with 4 hourly values each
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0, 0, 0, 0], [5, 5, 0, 0], [0, 5, 5, 5]], dtype=float)
+    return pd.DataFrame(centers[rng.integers(3, size=n)] + rng.normal(scale=1.5, size=(n, 4)))
+
+
+def _milp_optimum(dist, k):
+    # optimum of td_main.mod: best set of k medoids, each day being assigned to its nearest medoid
+    return min(dist[:, list(m)].min(axis=1).sum() for m in combinations(range(dist.shape[0]), k))
+
+
+@pytest.fixture
+def n_data():
+    return _instance()
+
+
+def test_distance_matrix(n_data):
+    dist = distance_matrix(n_data)
+    x = n_data.to_numpy()
+    expected = ((x[:, None, :] - x[None, :, :]) ** 2).sum(axis=2)
+    assert np.allclose(dist, expected)
+    assert (np.diag(dist) == 0).all()
+
+
+@pytest.mark.parametrize('k', [2, 3, 4])
+def test_fasterpam_reaches_milp_optimum(n_data, k):
+    dist = distance_matrix(n_data)
+    optimum = _milp_optimum(dist, k)
+    medoids, labels, obj = min((fasterpam(dist, k, rng=np.random.default_rng(s)) for s in range(10)),
+                               key=lambda r: r[2])
+    assert obj == pytest.approx(optimum)
+    assert obj == pytest.approx(dist[np.arange(len(labels)), medoids[labels]].sum())
+    assert lagrangian_bound(dist, k, obj) <= optimum * (1 + 1e-9)
+
+
+def test_kmedoids(n_data):
+    dist = distance_matrix(n_data)
+    td_of_days, obj, complete, gap = kmedoids(n_data, 3, n_init=10, dist=dist)
+    # the restarts stop before n_init only once the objective reaches the lower bound (gap=0)
+    assert complete or gap <= 0
+    assert obj == pytest.approx(_milp_optimum(dist, 3))
+    assert obj == pytest.approx(clustering_objective(dist, td_of_days))
+    # each typical day represents itself
+    td = td_of_days[0].to_numpy()
+    assert (td[td - 1] == td).all()
+    assert 0 <= gap <= 1
+
+
+def test_kmedoids_reproducible_whatever_n_jobs(n_data):
+    sequential = kmedoids(n_data, 3, n_init=8, seed=3, n_jobs=1)
+    parallel = kmedoids(n_data, 3, n_init=8, seed=3, n_jobs=2)
+    assert sequential[0].equals(parallel[0])
+    assert sequential[1] == parallel[1]
+
+
+def test_kmedoids_stopped_early(n_data):
+    # a gap of 100% stops the restarts after the first one
+    td_of_days, obj, complete, gap = kmedoids(n_data, 3, n_init=8, gap=1.)
+    assert not complete
+
+
+def test_kmedoids_sweep(n_data):
+    dist = distance_matrix(n_data)
+    results = kmedoids_sweep(dist, [4, 2, 3], n_init=5)
+    assert sorted(results) == [2, 3, 4]
+    for k, (td_of_days, obj) in results.items():
+        assert len(np.unique(td_of_days)) == k
+        assert obj == pytest.approx(clustering_objective(dist, td_of_days))
+        assert obj >= _milp_optimum(dist, k) * (1 - 1e-9)
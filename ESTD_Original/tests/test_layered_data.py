@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the layered data mode of print_data: the shared base files plus the overrides of a scenario (let commands of
+ESTD_override.run) must give the same data as the dense ESTD_data.dat of the scenario.
+"""
+import re
+import shutil
+from pathlib import Path
+
+import pytest
+
+import energyscope as es
+from energyscope.preprocessing.es_pre.es_write_energy_model_data import OVERRIDE_TABLES
+
+ROOT = Path(__file__).resolve().parents[1]
+CS = ROOT / 'case_studies'
+
+PATCH = {'Resources': {'GAS_RE': {'gwp_op': 0.05}},
+         'Technologies': {'PV': {'f_max': 30.5, 'c_inv': 600.}},
+         'Demand': {'LIGHTING': {'HOUSEHOLDS': 5000.}},
+         'Misc': {'i_rate': 0.02}}
+
+
+@pytest.fixture
+def case_studies():
+    # names of the case studies printed by the test, removed at the end with the base files created meanwhile
+    base = CS / '_base'
+    before = set(base.iterdir()) if base.is_dir() else set()
+    names = []
+    yield names
+    for name in names:
+        shutil.rmtree(CS / name, ignore_errors=True)
+    if base.is_dir():
+        for d in set(base.iterdir()) - before:
+            shutil.rmtree(d, ignore_errors=True)
+        if not any(base.iterdir()):
+            base.rmdir()
+
+
+def _config(case_study, data_patch=None, layered_data=False):
+    config = es.load_config(str(ROOT / 'scripts' / 'config_ref.yaml'))
+    config.update(case_study=case_study, data_patch=data_patch, layered_data=layered_data, cache_dir=None,
+                  time_series_store=False)
+    es.import_data(config)
+    return config
+
+
+def _print(case_studies, case_study, **kwargs):
+    config = _config(case_study, **kwargs)
+    case_studies.append(case_study)
+    es.print_data(config)
+    return config
+
+
+def _read(file):
+    with open(file, 'r', newline='') as fp:
+        return fp.read()
+
+
+def _apply_overrides(config, override_fn):
+    # applies the let commands of ESTD_override.run on the imported data, as AMPL does after loading the base data
+    tables = {param: table for table, param in OVERRIDE_TABLES.items() if param is not None}
+    all_data = config['all_data']
+    for line in _read(override_fn).splitlines()[1:]:
+        param, index, value = re.fullmatch(r'let (\w+)(?:\[(.*)\])? := (.*);', line).groups()
+        index = [] if index is None else [i.strip('"') for i in index.split(',')]
+        value = float(value)
+        if param == 'gwp_limit':
+            # always overridden, kept as read from the config if unchanged
+            if value != config['GWP_limit']:
+                config['GWP_limit'] = value
+        elif param in all_data['Misc']:
+            es.set_params(config, 'Misc', param, index[0] if index else None, value)
+        elif param in tables:
+            es.set_param(config, tables[param], index[0], index[1], value)
+        else:
+            table = next(t for t, p in OVERRIDE_TABLES.items()
+                         if p is None and param in all_data[t].columns and index[0] in all_data[t].index)
+            es.set_param(config, table, index[0], param, value)
+
+
+def test_layered_base_files(case_studies):
+    config = _print(case_studies, '_test_layered', data_patch=PATCH, layered_data=True)
+    _print(case_studies, '_test_dense_base')
+    layered_files = config['layered_files']
+    assert _read(layered_files['data']) == _read(CS / '_test_dense_base' / 'ESTD_data.dat')
+    assert _read(layered_files['td']) == _read(CS / '_test_dense_base' / 'ESTD_12TD.dat')
+    assert not (CS / '_test_layered' / 'ESTD_data.dat').exists()
+
+
+def test_layered_equals_dense(case_studies):
+    config = _print(case_studies, '_test_layered', data_patch=PATCH, layered_data=True)
+    overrides = _read(config['layered_files']['override'])
+    assert 'let gwp_op["GAS_RE"] := 0.05;' in overrides
+    assert 'let f_max["PV"] := 30.5;' in overrides
+    assert 'let end_uses_demand_year["LIGHTING","HOUSEHOLDS"] := 5000.0;' in overrides
+    assert 'let i_rate := 0.02;' in overrides
+
+    # the base data with the overrides gives the dense data of the scenario
+    rebuilt = _config('_test_rebuilt')
+    _apply_overrides(rebuilt, config['layered_files']['override'])
+    case_studies.append('_test_rebuilt')
+    es.print_data(rebuilt)
+    _print(case_studies, '_test_dense', data_patch=PATCH)
+    assert _read(CS / '_test_rebuilt' / 'ESTD_data.dat') == _read(CS / '_test_dense' / 'ESTD_data.dat')
+
+
+def test_layered_falls_back_to_dense(case_studies):
+    # a technology producing an end-use type changes the sets derived from the data, which cannot be overridden
+    patch = {'Layers_in_out': {'PV': {'HEAT_HIGH_T': 1.}}}
+    config = _print(case_studies, '_test_layered', data_patch=patch, layered_data=True)
+    assert 'layered_files' not in config
+    _print(case_studies, '_test_dense', data_patch=patch)
+    assert _read(CS / '_test_layered' / 'ESTD_data.dat') == _read(CS / '_test_dense' / 'ESTD_data.dat')
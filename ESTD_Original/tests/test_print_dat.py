@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the formatted sections of DatWriter cached on their inputs (cached_section).
+"""
+import pandas as pd
+
+from energyscope.preprocessing.utils.print_dat import DatWriter
+
+
+def _print_costs(dat, costs, rate):
+    dat.param('i_rate', rate, 'discount rate')
+    dat.df('param :', costs)
+    dat.newline()
+
+
+FORMATTERS = {'costs': _print_costs}
+
+
+def _costs(value=1.5):
+    return pd.DataFrame({'c_inv': [value, 2.], 'c_maint': [0.1, 0.2]}, index=['PV', 'WIND'])
+
+
+def _write(cache_dir, **inputs):
+    dat = DatWriter(formatters=FORMATTERS)
+    dat.row('# header')
+    dat.cached_section('costs', cache_dir, **inputs)
+    return dat.getvalue(), dat.formatted
+
+
+def test_cached_section_round_trip(tmp_path):
+    expected, formatted = _write(None, costs=_costs(), rate=0.015)
+    assert formatted == ['costs']
+
+    # formatted and cached
+    text, formatted = _write(tmp_path, costs=_costs(), rate=0.015)
+    assert (text, formatted) == (expected, ['costs'])
+    assert len(list(tmp_path.glob('costs_*.txt'))) == 1
+
+    # read from the cache
+    text, formatted = _write(tmp_path, costs=_costs(), rate=0.015)
+    assert (text, formatted) == (expected, [])
+
+
+def test_cached_section_inputs_change(tmp_path):
+    _write(tmp_path, costs=_costs(), rate=0.015)
+    text, formatted = _write(tmp_path, costs=_costs(value=3.), rate=0.015)
+    assert formatted == ['costs']
+    assert text == _write(None, costs=_costs(value=3.), rate=0.015)[0]
+    assert len(list(tmp_path.glob('costs_*.txt'))) == 2
+
+
+def test_cached_section_eviction(tmp_path):
+    for i in range(5):
+        dat = DatWriter(formatters=FORMATTERS)
+        dat.cached_section('costs', tmp_path, max_entries=3, costs=_costs(value=float(i)), rate=0.015)
+    assert len(list(tmp_path.glob('costs_*.txt'))) == 3
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_flush(tmp_path):
+    out_path = tmp_path / 'data.dat'
+    dat = DatWriter(out_path, formatters=FORMATTERS)
+    dat.section('costs', costs=_costs(), rate=0.015)
+    text = dat.getvalue()
+    dat.flush()
+    assert out_path.read_bytes().decode() == text
+    assert dat.getvalue() == ''
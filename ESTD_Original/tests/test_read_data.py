@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the modifications of the imported data in memory (apply_patch, set_params and set_param).
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from energyscope.preprocessing.es_pre.es_read_data import apply_patch, load_patch, set_param, set_params
+
+
+def _all_data():
+    resources = pd.DataFrame({'gwp_op': [0.2, 0.3, 0.], 'c_op': [0.05, 0.06, 0.01]},
+                             index=['GAS', 'GAS_RE', 'H2_RE'])
+    technologies = pd.DataFrame({'f_max': [1e15, 50.], 'c_inv': [1000., 1200.]}, index=['CCGT', 'PV'])
+    time_series = pd.DataFrame(np.arange(6, dtype=np.float64).reshape(3, 2), columns=['PV', 'WIND'])
+    time_series.to_numpy().flags.writeable = False
+    misc = {'i_rate': 0.015, 'share_ned': {'HVC': 0.7, 'AMMONIA': 0.2}}
+    return {'Resources': resources, 'Technologies': technologies, 'Time_series': time_series, 'Misc': misc}
+
+
+def test_apply_patch():
+    all_data = _all_data()
+    apply_patch(all_data, {'Resources': {'GAS_RE': {'gwp_op': 0.05}, 'H2_RE': {'gwp_op': 0.01, 'c_op': 0.02}},
+                           'Misc': {'i_rate': 0.02, 'share_ned': {'HVC': 0.6}}})
+    resources = all_data['Resources']
+    assert resources.loc['GAS_RE', 'gwp_op'] == 0.05
+    assert resources.loc['H2_RE', 'gwp_op'] == 0.01
+    assert resources.loc['H2_RE', 'c_op'] == 0.02
+    # the values not in the patch are kept
+    assert resources.loc['GAS_RE', 'c_op'] == 0.06
+    assert resources.loc['GAS', 'gwp_op'] == 0.2
+    assert all_data['Misc'] == {'i_rate': 0.02, 'share_ned': {'HVC': 0.6, 'AMMONIA': 0.2}}
+
+
+def test_apply_patch_read_only_table():
+    all_data = _all_data()
+    apply_patch(all_data, {'Time_series': {1: {'WIND': 10.}}})
+    assert all_data['Time_series'].loc[1, 'WIND'] == 10.
+    assert all_data['Time_series'].loc[1, 'PV'] == 2.
+
+
+@pytest.mark.parametrize('patch', [{'Unknown': {'GAS': {'gwp_op': 0.}}},
+                                   {'Resources': {'COAL': {'gwp_op': 0.}}},
+                                   {'Resources': {'GAS': {'gwp_constr': 0.}}},
+                                   {'Misc': {'unknown': 0.}}])
+def test_apply_patch_unknown_names(patch):
+    with pytest.raises(KeyError):
+        apply_patch(_all_data(), patch)
+
+
+def test_load_patch(tmp_path):
+    patch = {'Resources': {'GAS_RE': {'gwp_op': 0.05}}}
+    patch_fn = tmp_path / 'patch.json'
+    patch_fn.write_text(json.dumps(patch))
+    assert load_patch(patch_fn) == patch
+    patch_fn = tmp_path / 'patch.yaml'
+    patch_fn.write_text('Resources:\n  GAS_RE:\n    gwp_op: 0.05\n')
+    assert load_patch(patch_fn) == patch
+    assert load_patch(patch) is patch
+
+
+def test_set_params():
+    config = {'all_data': _all_data(), 'model_data': object()}
+    technologies = config['all_data']['Technologies']
+    set_params(config, 'Resources', ['GAS', 'GAS_RE'], 'gwp_op', [0.1, 0.15])
+    set_param(config, 'Resources', 'H2_RE', 'c_op', 0.03)
+    resources = config['all_data']['Resources']
+    assert resources['gwp_op'].tolist() == [0.1, 0.15, 0.]
+    assert resources.loc['H2_RE', 'c_op'] == 0.03
+    # the integer-indexed view is rebuilt at its next use
+    assert 'model_data' not in config
+    # the data before the first modification is kept, only the modified tables are copied
+    base_data = config['base_data']
+    assert base_data['Resources']['gwp_op'].tolist() == [0.2, 0.3, 0.]
+    assert base_data['Resources'].loc['H2_RE', 'c_op'] == 0.01
+    assert base_data['Technologies'] is technologies
+
+
+def test_set_params_misc_and_time_series():
+    config = {'all_data': _all_data()}
+    set_params(config, 'Misc', 'i_rate', None, 0.03)
+    set_params(config, 'Misc', ['share_ned'], 'HVC', 0.5)
+    set_params(config, 'Time_series', [0, 2], 'PV', 1.)
+    assert config['all_data']['Misc']['i_rate'] == 0.03
+    assert config['all_data']['Misc']['share_ned']['HVC'] == 0.5
+    assert config['all_data']['Time_series']['PV'].tolist() == [1., 2., 1.]
+    assert config['base_data']['Misc']['i_rate'] == 0.015
+    assert config['base_data']['Misc']['share_ned']['HVC'] == 0.7
+    with pytest.raises(KeyError):
+        set_params(config, 'Misc', 'share_ned', 'UNKNOWN', 0.)
+    with pytest.raises(KeyError):
+        set_params(config, 'Technologies', 'PV', 'f_min', 0.)